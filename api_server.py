@@ -0,0 +1,449 @@
+# api_server.py
+# 多 session 模擬 API 伺服器 (asyncio，僅使用標準函式庫)
+# 讓其他工具不經 Streamlit 直接使用 logic.py 的交易規則
+#
+# HTTP (JSON)：
+#   POST   /sessions                      {ticker, asset_type, seed?}      建立 session
+#   GET    /sessions/<id>                                                  取得快照
+#   POST   /sessions/<id>/advance         {days}                          推進 (天數多時交給 worker 行程池)
+#   POST   /sessions/<id>/order           {mode, qty, leverage?, order_type?, price?, limit_price?, stop_price?}
+#   POST   /sessions/<id>/close           {position_id?, qty?}            平倉 (省略 position_id = 全部平倉)
+#   POST   /sessions/<id>/sl_tp           {position_id, sl, tp}
+#   POST   /sessions/<id>/settle                                          提早結算
+#   DELETE /sessions/<id>
+#   GET    /stats                                                          session 數與資料下載合併統計 (監控用)
+# WebSocket：GET /ws，每則文字訊息為 {"op": "create"|"snapshot"|"advance"|"order"|"close"|"sl_tp"|"settle"|"delete", "session_id": ..., ...}
+#
+# 用法：python api_server.py [--host 127.0.0.1] [--port 8600] [--workers N]
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import hashlib
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import config
+import logic
+from replay import locate_window
+from data_manager import fetch_historical_data, download_stats
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+# --- 共用價格資料 ---
+# 每個代碼只載入一次完整歷史；各 session 的視窗是同一份資料的切片
+# 最多保留 API_MAX_DATASETS 個代碼 (LRU)；載入失敗不快取，暫時性的下載錯誤下次請求會重試
+
+_datasets = OrderedDict()
+_datasets_lock = threading.Lock()   # 載入在執行緒中進行
+
+def _cached_dataset(ticker):
+    with _datasets_lock:
+        data = _datasets.get(ticker)
+        if data is not None:
+            _datasets.move_to_end(ticker)
+        return data
+
+def _load_dataset(ticker):
+    data = _cached_dataset(ticker)
+    if data is None:
+        data = fetch_historical_data(ticker)
+        if data is not None:
+            with _datasets_lock:
+                _datasets[ticker] = data
+                while len(_datasets) > config.API_MAX_DATASETS:
+                    _datasets.popitem(last=False)
+    return data
+
+# --- Worker 行程：長距離推進 ---
+
+_worker_windows = {}
+
+def _advance_in_worker(state_dict, window_key, days):
+    """在 worker 行程中推進 session；價格視窗由 worker 自行載入並快取，不隨每次呼叫傳送"""
+    if window_key not in _worker_windows:
+        ticker, window_start, window_length = window_key
+        _worker_windows[window_key] = locate_window(
+            _load_dataset(ticker), {'window_start': window_start, 'window_length': window_length}
+        )
+    state = logic.HeadlessState(state_dict)
+    state.core_data = _worker_windows[window_key]
+    _advance(state, days)
+    del state['core_data']
+    return dict(state)
+
+def _advance(state, days):
+    with logic.bind_state(state):
+        for _ in range(days):
+            if not state.sim_active: break
+            logic.perform_action('next_day')
+
+# --- Session ---
+
+class Session:
+    def __init__(self, session_id, state):
+        self.id = session_id
+        self.state = state
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        core_data = state.core_data
+        # 日期字串只在建立時轉換一次，快照不必每次從 DataFrame 取整列
+        self.dates = core_data['Date'].dt.strftime('%Y-%m-%d').tolist()
+        self.window_key = (state.ticker, self.dates[0], len(core_data))
+
+    def snapshot(self):
+        state = self.state
+        with logic.bind_state(state):
+            idx = state.current_sim_index
+            open_price = logic._bar_value(state.core_data, 'Open', min(idx, len(self.dates) - 1))
+            return {
+                'session_id': self.id, 'ticker': state.ticker, 'asset_type': state.asset_type, 'seed': state.seed,
+                'sim_active': state.sim_active, 'index': idx, 'max_index': state.max_sim_index,
+                'date': self.dates[min(idx, len(self.dates) - 1)], 'open_price': open_price,
+                'balance': state.balance,
+                'asset_value': logic.get_current_asset_value(state.core_data, idx),
+                'unrealized_pnl': logic.get_total_unrealized_pnl(open_price),
+                'positions': state.positions, 'orders': list(state.order_book),
+                'n_transactions': len(state.transactions),
+                'last_event': state.get('last_event_msg'), 'settlement': state.settlement_stats,
+            }
+
+class SessionManager:
+    def __init__(self, workers=None):
+        self.sessions = {}
+        self._pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ApiError(404, f"找不到 session {session_id}")
+        session.last_used = time.monotonic()
+        return session
+
+    def evict_idle(self):
+        deadline = time.monotonic() - config.API_SESSION_TTL
+        for sid in [sid for sid, s in self.sessions.items() if s.last_used < deadline and not s.lock.locked()]:
+            del self.sessions[sid]
+
+    async def create(self, body):
+        if len(self.sessions) >= config.API_MAX_SESSIONS:
+            self.evict_idle()
+            if len(self.sessions) >= config.API_MAX_SESSIONS:
+                raise ApiError(503, "session 數量已達上限")
+
+        ticker = str(body.get('ticker', config.DEFAULT_TICKER)).upper()
+        asset_type = body.get('asset_type', 'Stock')
+        if asset_type not in config.ASSET_CONFIGS:
+            raise ApiError(400, f"未知的資產類型: {asset_type}")
+        seed = body.get('seed')
+        try:
+            seed = int(seed) if seed is not None else int.from_bytes(os.urandom(4), 'big')
+        except (ValueError, TypeError) as e:
+            raise ApiError(400, f"參數錯誤: {e}")
+
+        # 首次載入代碼可能需要下載，放到執行緒避免阻塞事件迴圈
+        loop = asyncio.get_running_loop()
+        data = _cached_dataset(ticker)
+        if data is None:
+            data = await loop.run_in_executor(None, _load_dataset, ticker)
+        window = logic.select_window(data, seed) if data is not None else None
+        if window is None:
+            raise ApiError(422, f"無法載入 {ticker} 的數據或資料不足")
+
+        state = logic.HeadlessState(ticker=ticker, asset_type=asset_type)
+        with logic.bind_state(state):
+            logic.reset_state()
+            logic.start_simulation(window, asset_type, seed)
+
+        session = Session(uuid.uuid4().hex[:12], state)
+        self.sessions[session.id] = session
+        return session.snapshot()
+
+    async def advance(self, session, body):
+        try:
+            days = int(body.get('days', 1))
+        except (ValueError, TypeError) as e:
+            raise ApiError(400, f"參數錯誤: {e}")
+        if days < 1:
+            raise ApiError(400, "days 必須 >= 1")
+
+        if days <= config.API_OFFLOAD_DAYS:
+            # 短距離推進：每推進一天就讓出事件迴圈，其他請求最多只等一天的計算 (session.lock 保證同一 session 不會同時被改動)
+            # 不用執行緒：純 Python 計算受 GIL 限制，交給執行緒反而讓事件迴圈與執行緒互相等待 GIL
+            for _ in range(days):
+                if not session.state.sim_active: break
+                _advance(session.state, 1)
+                await asyncio.sleep(0)
+            return session.snapshot()
+
+        # 長距離推進：把狀態送到 worker 行程，完成後接回共用的價格視窗
+        # 價格資料與逐根快照不隨每次呼叫傳送 (快照只帶最後一筆供結構共享)，新增的快照再接回原串列
+        state = session.state
+        snapshots = state.get('snapshots')
+        state_dict = {k: v for k, v in state.items() if k not in ('core_data', 'snapshots')}
+        sent = snapshots[-1:] if snapshots is not None else None
+        state_dict['snapshots'] = sent
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._pool, _advance_in_worker, state_dict, session.window_key, days)
+        new_state = logic.HeadlessState(result)
+        new_state.core_data = state.core_data
+        if snapshots is not None:
+            snapshots.extend(result['snapshots'][len(sent):])
+            new_state.snapshots = snapshots
+        session.state = new_state
+        return session.snapshot()
+
+    def act(self, session, op, body):
+        state = session.state
+        with logic.bind_state(state):
+            if op == 'order':
+                mode = body.get('mode', 'Spot_Buy')
+                qty = float(body['qty'])
+                leverage = float(body.get('leverage', 1.0))
+                error = logic.validate_leverage(mode, leverage)
+                if error:
+                    raise ApiError(400, error)
+                order_type = body.get('order_type', 'Market')
+                if order_type == 'Market':
+                    open_price = logic._bar_value(state.core_data, 'Open', state.current_sim_index)
+                    ok = logic.perform_action('open', mode, qty, open_price, leverage)
+                elif order_type == 'OCO':
+                    ok = logic.perform_action('oco', mode, qty, float(body['limit_price']), float(body['stop_price']), leverage)
+                else:
+                    ok = logic.perform_action('order', mode, order_type, qty, float(body['price']), leverage)
+            elif op == 'close':
+                if body.get('position_id') is None:
+                    ok = logic.perform_action('close_all') is None
+                else:
+                    pos = next((p for p in state.positions if p['id'] == body['position_id']), None)
+                    if pos is None:
+                        raise ApiError(404, f"找不到倉位 {body['position_id']}")
+                    open_price = logic._bar_value(state.core_data, 'Open', state.current_sim_index)
+                    ok = logic.perform_action('close', pos['id'], float(body.get('qty', pos['qty'])), open_price)
+            elif op == 'sl_tp':
+                pos = next((p for p in state.positions if p['id'] == body['position_id']), None)
+                if pos is None:
+                    raise ApiError(404, f"找不到倉位 {body['position_id']}")
+                sl, tp = float(body.get('sl', 0.0)), float(body.get('tp', 0.0))
+                error = logic.validate_sl_tp(pos, sl, tp)
+                if error:
+                    raise ApiError(400, error)
+                ok = logic.perform_action('sl_tp', pos['id'], sl, tp)
+            elif op == 'settle':
+                ok = logic.perform_action('settle') is None
+            else:
+                raise ApiError(404, f"未知的操作 {op}")
+
+        result = session.snapshot()
+        result['ok'] = bool(ok)
+        return result
+
+    async def dispatch(self, op, session_id=None, body=None):
+        """HTTP 與 WebSocket 共用的操作入口；同一 session 的操作依序執行"""
+        body = body or {}
+        if op == 'create':
+            return await self.create(body)
+        if op == 'stats':
+            return {'sessions': len(self.sessions), 'downloads': download_stats()}
+
+        session = self.get(session_id)
+        async with session.lock:
+            if op == 'snapshot':
+                return session.snapshot()
+            if op == 'advance':
+                return await self.advance(session, body)
+            if op == 'delete':
+                del self.sessions[session.id]
+                return {'deleted': session.id}
+            try:
+                return self.act(session, op, body)
+            except (KeyError, ValueError, TypeError) as e:
+                raise ApiError(400, f"參數錯誤: {e}")
+
+# --- HTTP / WebSocket 協定層 ---
+
+_ROUTES = [
+    ('POST', re.compile(r'^/sessions/?$'), 'create'),
+    ('GET', re.compile(r'^/stats$'), 'stats'),
+    ('GET', re.compile(r'^/sessions/(?P<sid>\w+)$'), 'snapshot'),
+    ('DELETE', re.compile(r'^/sessions/(?P<sid>\w+)$'), 'delete'),
+    ('POST', re.compile(r'^/sessions/(?P<sid>\w+)/(?P<op>advance|order|close|sl_tp|settle)$'), None),
+]
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 422: 'Unprocessable Entity',
+                500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+def _to_json(payload):
+    return json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return method, path.split('?', 1)[0], headers, body
+
+def _write_response(writer, status, payload, keep_alive=True):
+    data = _to_json(payload)
+    head = (f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + data)
+
+async def _ws_recv(reader):
+    """讀取一則 WebSocket 訊息，回傳 (opcode, payload)"""
+    b1, b2 = await reader.readexactly(2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+    mask = await reader.readexactly(4) if b2 & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+def _ws_send(writer, payload, opcode=0x1):
+    length = len(payload)
+    if length < 126:
+        head = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        head = bytes([0x80 | opcode, 126]) + length.to_bytes(2, 'big')
+    else:
+        head = bytes([0x80 | opcode, 127]) + length.to_bytes(8, 'big')
+    writer.write(head + payload)
+
+class ApiServer:
+    def __init__(self, manager: SessionManager):
+        self.manager = manager
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                    await self._websocket(reader, writer, headers)
+                    break
+                status, payload = await self._http(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # 伺服器關閉時仍在等待請求的連線會被取消，直接結束即可
+            pass
+        finally:
+            writer.close()
+
+    async def _http(self, method, path, raw_body):
+        for route_method, pattern, op in _ROUTES:
+            match = pattern.match(path)
+            if match and method == route_method:
+                try:
+                    body = json.loads(raw_body) if raw_body else {}
+                    return 200, await self.manager.dispatch(op or match['op'], match.groupdict().get('sid'), body)
+                except ApiError as e:
+                    return e.status, {'error': e.message}
+                except json.JSONDecodeError:
+                    return 400, {'error': '無效的 JSON'}
+                except Exception as e:
+                    return 500, {'error': f"伺服器錯誤: {e}"}
+        return 404, {'error': f"未知的路徑 {method} {path}"}
+
+    async def _websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + _WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        while True:
+            opcode, payload = await _ws_recv(reader)
+            if opcode == 0x8:      # close
+                _ws_send(writer, b'', 0x8)
+                break
+            if opcode == 0x9:      # ping
+                _ws_send(writer, payload, 0xA)
+                continue
+            if opcode != 0x1:
+                continue
+            message = None
+            try:
+                message = json.loads(payload)
+                result = await self.manager.dispatch(message.get('op'), message.get('session_id'), message)
+                reply = {'ok': True, 'result': result}
+            except ApiError as e:
+                reply = {'ok': False, 'status': e.status, 'error': e.message}
+            except json.JSONDecodeError:
+                reply = {'ok': False, 'status': 400, 'error': '無效的 JSON'}
+            except Exception as e:
+                reply = {'ok': False, 'status': 500, 'error': f"伺服器錯誤: {e}"}
+            if isinstance(message, dict) and 'request_id' in message:
+                reply['request_id'] = message['request_id']
+            _ws_send(writer, _to_json(reply))
+            await writer.drain()
+
+async def start_server(host=None, port=None, workers=None):
+    """啟動伺服器並回傳 (asyncio.Server, SessionManager)，供 CLI 與負載測試使用"""
+    manager = SessionManager(workers)
+    server = await asyncio.start_server(ApiServer(manager).handle, host or config.API_HOST,
+                                        config.API_PORT if port is None else port)
+    return server, manager
+
+async def _serve(host, port, workers):
+    server, manager = await start_server(host, port, workers)
+    addr = server.sockets[0].getsockname()
+    print(f"🚀 Ksim API 伺服器：http://{addr[0]}:{addr[1]} (WebSocket: /ws)")
+    try:
+        async with server:
+            while True:
+                await asyncio.sleep(60)
+                manager.evict_idle()
+    finally:
+        manager.close()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 多 session 模擬 API 伺服器")
+    parser.add_argument('--host', default=config.API_HOST)
+    parser.add_argument('--port', type=int, default=config.API_PORT)
+    parser.add_argument('--workers', type=int, help="長距離推進使用的 worker 行程數 (預設 CPU 核心數)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
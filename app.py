@@ -1,454 +1,681 @@
-# app.py
-# 應用程式入口：負責 UI 介面、事件處理與資料呈現
-
-import streamlit as st
-import pandas as pd
-import numpy as np
-import config
-import logic
-import charts
-
-# --- 初始化 ---
-st.set_page_config(layout="wide", page_title="Ksim V2 - Optimized")
-
-# 確保 Session State 已初始化
-if 'initialized' not in st.session_state:
-    logic.reset_state()
-
-# 簡化變數引用
-state = st.session_state
-
-# --- 側邊欄：初始設定 (Asset & Ticker) ---
-if not state.initialized:
-    with st.sidebar:
-        st.header("Ksim V2.1")
-        
-        # 選擇回測資產類型
-        selected_asset_type = st.radio(
-            "選擇回測資產類型 (定義交易規則)",
-            ('Stock', 'Forex', 'Crypto'),
-            format_func=lambda x: {'Stock': '📈 股票', 'Forex': '💱 匯率', 'Crypto': '₿ 加密貨幣'}[x]
-        )
-        
-        state.ticker = st.text_input(
-            "請輸入代碼 (e.g. TSLA, JPY=X, BTC-USD)",
-            value=state.ticker 
-        ).strip().upper() 
-        
-        if st.button("🚀點擊開始回測"):
-            if state.ticker:
-                valid_input = True
-                error_msg = ""
-                
-                # 簡單的 Yahoo Finance 代碼規則檢查
-                if selected_asset_type == 'Forex':
-                    if not state.ticker.endswith('=X'):
-                        valid_input = False
-                        error_msg = f"錯誤：匯率代碼通常以 '=X' 結尾 (例如 JPY=X)。您輸入的是 {state.ticker}。"
-                elif selected_asset_type == 'Crypto':
-                    if not state.ticker.endswith('-USD'):
-                        valid_input = False
-                        error_msg = f"錯誤：加密貨幣代碼通常以 '-USD' 結尾 (例如 BTC-USD)。您輸入的是 {state.ticker}。"
-                elif selected_asset_type == 'Stock':
-                    if state.ticker.endswith('=X') or state.ticker.endswith('-USD'):
-                        valid_input = False
-                        error_msg = f"錯誤：您選擇了「股票」，但輸入的代碼看起來像匯率或加密貨幣。"
-
-                if valid_input:
-                    logic.reset_state()
-                    logic.initialize_data_and_simulation(selected_asset_type) 
-                    st.rerun()
-                else:
-                    st.error(error_msg)
-            else:
-                st.error("請輸入有效的代碼！")
-    
-    st.info(f"請在左側欄選擇資產類型，輸入代碼，並點擊 '🚀點擊開始回測'。目前預設: {state.ticker}")
-    st.stop()
-
-# --- 載入當前狀態參數 ---
-asset_conf = config.ASSET_CONFIGS[state.asset_type]
-unit_name = asset_conf['unit']
-min_qty = asset_conf['min_qty']
-default_qty = asset_conf['default_qty']
-
-# 取得當前價格資訊
-_, open_price, _ = logic.get_price_info_by_index(state.core_data, state.current_sim_index)
-current_open_price = open_price if open_price > 0 else 0.0
-
-# --- 側邊欄：控制面板與交易區 ---
-with st.sidebar:
-    st.subheader(f"📈 {state.ticker} ({unit_name}回測)")
-    
-    days_passed = state.current_sim_index - config.INITIAL_OBSERVATION_DAYS + 1
-    days_remain = state.max_sim_index - state.current_sim_index
-    
-    st.markdown(f"**進度:** {max(1, days_passed)} 天 / 剩餘 {max(0, days_remain)} 天")
-    st.caption(f"(觀察期: {config.INITIAL_OBSERVATION_DAYS}天 / 顯示範圍: {config.VIEW_DAYS}天)")
-    st.markdown("---")
-    
-    # 時間控制按鈕
-    if state.sim_active:
-        col_t1, col_t2 = st.columns(2)
-        with col_t1:
-            if st.button("➡️ 下一天", use_container_width=True): 
-                logic.next_day()
-                st.rerun()
-        with col_t2:
-            if st.button("⏭️ 下十天", use_container_width=True): 
-                logic.next_ten_days()
-                st.rerun()
-        
-        if st.button("🛑 **提早結算**", use_container_width=True, help="結束模擬並平倉"):
-            logic.settle_portfolio(force_end=True)
-            st.rerun()
-    else:
-        if st.button("重新開始回測", use_container_width=True):
-            logic.reset_state()
-            st.rerun()
-    
-    st.markdown("---")
-    
-    # --- 交易下單面板 ---
-    st.subheader("🛒 開倉交易")
-    
-    if state.sim_active:
-        # 1. 模式選擇
-        def get_mode_label(key):
-            if key == 'Spot_Buy': return asset_conf['mode_spot']
-            if key == 'Margin_Long': return asset_conf['mode_margin_long']
-            if key == 'Margin_Short': return asset_conf['mode_margin_short']
-            return key
-
-        trade_mode_key = st.radio(
-             "交易模式",
-             ('Spot_Buy', 'Margin_Long', 'Margin_Short'), 
-             format_func=get_mode_label,
-             horizontal=True, key='trade_mode_select'
-        )
-
-        mode_conf = config.TRADE_MODE_MAP[trade_mode_key]
-        is_margin = mode_conf['type'] == 'Margin'
-        leverage = 1.0
-        
-        if is_margin:
-            leverage = st.slider("槓桿倍數", 1.0, 20.0, 2.0, 0.5, format='%.1fx')
-        
-        # 2. 數量輸入
-        qty_mode = st.radio("數量模式", ('Absolute', 'Percentage'), 
-                            format_func=lambda x: unit_name if x == 'Absolute' else '百分比 (%)', 
-                            horizontal=True, label_visibility="collapsed")
-        
-        final_qty = 0.0
-        is_int_qty = (min_qty >= 1.0 and min_qty == int(min_qty))
-        
-        if qty_mode == 'Absolute':
-            if is_int_qty:
-                qty_input = st.number_input(
-                    f"數量 ({unit_name})", 
-                    min_value=int(min_qty),        
-                    value=int(default_qty),        
-                    step=int(max(1, min_qty)),
-                    format='%i'
-                )
-                final_qty = float(qty_input)
-            else:
-                qty_input = st.number_input(
-                    f"數量 ({unit_name})", 
-                    min_value=float(min_qty),        
-                    value=float(default_qty),        
-                    step=float(min_qty) if min_qty < 1 else 1.0,
-                    format='%.3f'
-                )
-                final_qty = float(qty_input)
-        else:
-            pct = st.slider("開倉比例 (%)", 1.0, 100.0, 50.0, 1.0)
-            asset_to_use = state.balance * (pct / 100.0)
-            max_shares = (asset_to_use / open_price * leverage) if open_price > 0 else 0.0
-            
-            if is_int_qty:
-                 final_qty = float(int(max_shares / min_qty) * min_qty)
-            else:
-                 precision = len(str(min_qty).split('.')[-1])
-                 final_qty = round(max_shares / min_qty) * min_qty
-                 final_qty = round(final_qty, precision)
-            
-            st.markdown(f"<p style='font-size: small;'>換算數量: {final_qty:,.3f} {unit_name}</p>", unsafe_allow_html=True)
-
-        # 3. 預估計算
-        est_cost = final_qty * open_price
-        est_margin = est_cost / leverage
-        fee_rate = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
-        est_fee = est_cost * fee_rate
-        
-        st.info(f"參考價: ${open_price:,.2f}")
-        
-        col_fee, col_cost = st.columns(2)
-        with col_fee:
-            st.markdown(f"<p style='font-size: small;'>預估手續費用: ${est_fee:,.2f}</p>", unsafe_allow_html=True)
-        with col_cost:
-            st.markdown(f"<p style='font-size: small;'>總值: ${est_cost:,.2f}</p>", unsafe_allow_html=True)
-        
-        if is_margin:
-            liq_price = 0.0
-            if mode_conf['direction'] == 'Long':
-                liq_price = open_price * (1.0 - (1.0 / leverage))
-            else:
-                liq_price = open_price * (1.0 + (1.0 / leverage))
-            
-            st.markdown(f"**預估保證金:** ${est_margin:,.2f}")
-            st.markdown(f"**預估強平價:** ${liq_price:,.2f}")
-
-        # 4. 執行按鈕
-        if st.button(f"執行開倉", use_container_width=True):
-            if logic.execute_trade(trade_mode_key, final_qty, open_price, leverage):
-                st.rerun()
-    else:
-        st.info("模擬已結束。")
-
-# --- 主畫面區 ---
-
-# 0. 通知
-if state.get('last_event_msg'):
-    msg = state.last_event_msg
-    if msg['type'] == 'error':
-        st.error(f"### {msg['text']}")
-    elif msg['type'] == 'success':
-        st.success(f"### {msg['text']}")
-    else:
-        st.info(f"### {msg['text']}")
-
-# 1. 結算報告
-if not state.sim_active and state.get('settlement_stats'):
-    stats = state.settlement_stats
-    with st.container():
-        st.success(f"🏁 回測模擬結束！")
-        c1, c2, c3, c4 = st.columns(4)
-        c1.metric("最終資產", f"${stats['final_asset']:,.2f}")
-        
-        pnl = stats['total_pnl']
-        color = "normal" 
-        
-        c2.metric("總損益", f"${pnl:,.2f}", delta_color=color)
-        c3.metric("投資報酬率 (ROI)", f"{stats['roi']:+.2f}%", delta_color=color)
-        
-        with c4:
-            s_str = stats['start_date'].strftime('%Y/%m/%d')
-            e_str = stats['end_date'].strftime('%Y/%m/%d')
-            st.metric("回測期間", f"{s_str} ~ {e_str}")
-            
-        st.markdown("---")
-
-# 2. 資金看板
-total_asset = logic.get_current_asset_value(state.core_data, state.current_sim_index)
-unrealized_pnl = logic.get_total_unrealized_pnl(current_open_price)
-spot_info = logic.get_spot_summary(state.core_data, state.current_sim_index)
-
-m1, m2, m3, m4 = st.columns(4)
-m1.metric("總資產 (含未實現)", f"${total_asset:,.2f}")
-m2.metric("現金餘額", f"${state.balance:,.2f}")
-m3.metric("未實現損益", f"${unrealized_pnl:,.2f}")
-m4.metric(f"現貨持倉 ({unit_name})", f"{spot_info['qty']:,.3f}")
-
-# 3. 圖表繪製
-fig = charts.render_main_chart(
-    state.ticker, state.core_data, state.current_sim_index, 
-    state.positions, state.end_sim_index_on_settle, state.plot_layout
-)
-
-chart_event = st.plotly_chart(
-    fig, 
-    use_container_width=True, 
-    key="main_chart",
-    config={'scrollZoom': True, 'displayModeBar': True} 
-)
-
-if "main_chart" in state and state.main_chart:
-    layout = state.main_chart.get('layout', {})
-    if layout:
-        saved = {}
-        for i in [None, 2, 3]:
-            k = f'xaxis{i}' if i else 'xaxis'
-            if k in layout and 'range' in layout[k]:
-                 saved[f'{k}.range'] = layout[k]['range']
-        if saved: state.plot_layout = saved
-
-# 4. 倉位管理
-st.markdown("---")
-st.header("🎯 交易倉位 (Open Positions)")
-
-if state.positions:
-    pos_data = []
-    for pos in state.positions:
-        qty = pos['qty']
-        cost = pos['cost']
-        leverage = pos.get('leverage', 1.0)
-        
-        mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
-        direction = mode_info.get('direction', 'Long')
-        
-        pnl = logic.calculate_pnl_value(direction, qty, cost, current_open_price)
-            
-        sl_val = pos['sl']
-        tp_val = pos['tp']
-        sl_pnl_str = ""
-        tp_pnl_str = ""
-        
-        if sl_val > 0:
-            est_sl_pnl = logic.calculate_pnl_value(direction, qty, cost, sl_val)
-            sign = "+" if est_sl_pnl > 0 else "-"
-            sl_pnl_str = f"預估 {sign}${abs(est_sl_pnl):,.0f}"
-
-        if tp_val > 0:
-            est_tp_pnl = logic.calculate_pnl_value(direction, qty, cost, tp_val)
-            sign = "+" if est_tp_pnl > 0 else "-"
-            tp_pnl_str = f"預估 {sign}${abs(est_tp_pnl):,.0f}"
-        
-        pos_data.append({
-            'ID': pos['id'],
-            '類型': pos['display_name'],  
-            '槓桿': f"{leverage:.1f}x",
-            '數量': qty,
-            '開倉價': cost,
-            '未實現損益': pnl,
-            'SL': sl_val,
-            'SL 預估損益': sl_pnl_str,
-            'TP': tp_val,
-            'TP 預估損益': tp_pnl_str
-        })
-    
-    df_pos = pd.DataFrame(pos_data)
-    
-    edited_df = st.data_editor(
-        df_pos.set_index('ID'),
-        column_config={
-            "類型": st.column_config.TextColumn(disabled=True),
-            "槓桿": st.column_config.TextColumn(disabled=True),
-            "數量": st.column_config.NumberColumn(format="%.3f", disabled=True),
-            "開倉價": st.column_config.NumberColumn(format="$%.2f", disabled=True),
-            "未實現損益": st.column_config.NumberColumn(format="$%.2f", disabled=True),
-            "SL": st.column_config.NumberColumn("止損價格 (SL)", format="$%.2f", step=0.1),
-            "SL 預估損益": st.column_config.TextColumn("SL 損益", disabled=True),
-            "TP": st.column_config.NumberColumn("止盈價格 (TP)", format="$%.2f", step=0.1),
-            "TP 預估損益": st.column_config.TextColumn("TP 損益", disabled=True),
-        },
-        use_container_width=True,
-        key='pos_editor'
-    )
-    
-    if st.button("💾 儲存 SL/TP 設定", use_container_width=True):
-        updates = edited_df.to_dict('index')
-        changed = False
-        validation_error = False
-        
-        for pos in state.positions:
-            pid = pos['id']
-            if pid in updates:
-                new_sl = updates[pid]['SL']
-                new_tp = updates[pid]['TP']
-                
-                if pos['sl'] == new_sl and pos['tp'] == new_tp:
-                    continue
-                
-                liq_price = pos.get('liquidation_price', 0.0)
-                cost_price = pos.get('cost', 0.0)
-                mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
-                direction = mode_info.get('direction', 'Long')
-                
-                # 驗證邏輯
-                if liq_price > 0:
-                    if direction == 'Long' and new_sl > 0 and new_sl <= liq_price:
-                        st.error(f"🚫 ID {pid[-4:]} 錯誤：多頭止損 ({new_sl}) 不能低於強制平倉價 ({liq_price:.2f})！")
-                        validation_error = True; continue
-                    elif direction == 'Short' and new_sl > 0 and new_sl >= liq_price:
-                        st.error(f"🚫 ID {pid[-4:]} 錯誤：空頭止損 ({new_sl}) 不能高於強制平倉價 ({liq_price:.2f})！")
-                        validation_error = True; continue
-                
-                if new_tp > 0:
-                    if direction == 'Long' and new_tp <= cost_price:
-                        st.error(f"🚫 ID {pid[-4:]} 錯誤：多頭止盈 ({new_tp}) 必須高於開倉價 ({cost_price:.2f})！")
-                        validation_error = True; continue
-                    elif direction == 'Short' and new_tp >= cost_price:
-                        st.error(f"🚫 ID {pid[-4:]} 錯誤：空頭止盈 ({new_tp}) 必須低於開倉價 ({cost_price:.2f})！")
-                        validation_error = True; continue
-
-                pos['sl'] = new_sl
-                pos['tp'] = new_tp
-                changed = True
-        
-        if not validation_error:
-            if changed: st.success("設定已更新！"); st.rerun() 
-            else: st.info("無變更。")
-
-    # --- 手動平倉區 ---
-    st.markdown("---")
-    
-    col_header, col_close_all = st.columns([4, 1])
-    with col_header: st.subheader("手動平倉操作")
-    
-    if state.sim_active:
-        pos_opts = {p['id']: f"{p['display_name']} {p['qty']:.3f} ({p['id'][-4:]})" for p in state.positions}
-        
-        with col_close_all:
-             st.write("") 
-             if st.button("🔴 平倉所有部位", use_container_width=True, key='close_all_btn'):
-                logic.settle_portfolio()
-                st.rerun()
-            
-        col_select, col_mode_radio = st.columns([3, 2])
-        with col_select:
-            st.caption("選擇部位")
-            sel_pid = st.selectbox("選擇部位", options=list(pos_opts.keys()), format_func=lambda x: pos_opts[x], label_visibility='collapsed', key='manual_close_select')
-            
-        target_pos = next((p for p in state.positions if p['id'] == sel_pid), None)
-        
-        if target_pos:
-            max_q = target_pos['qty']
-            close_q = max_q
-            
-            with col_mode_radio:
-                st.caption("平倉模式")
-                close_mode = st.radio("平倉模式", ('全部', '指定數量', '指定比例'), horizontal=True, label_visibility='collapsed', key='manual_close_mode_radio')
-            
-            st.markdown("##### ") 
-            col_input_value, col_execute = st.columns([4, 1])
-            
-            with col_input_value:
-                if close_mode == '指定數量':
-                    close_q = st.number_input(f"平倉數量 ({unit_name})", min_value=0.0, max_value=float(max_q), value=float(max_q), step=min_qty if min_qty < 1 else 1.0, key='manual_close_qty_input')
-                elif close_mode == '指定比例':
-                    pct_close = st.slider("比例 (%)", 1.0, 100.0, 50.0, key='manual_close_pct_slider')
-                    close_q = max_q * (pct_close / 100.0)
-                    st.caption(f"換算數量: **{close_q:,.3f} {unit_name}**")
-                else: 
-                    close_q = max_q
-                    st.info(f"將平倉部位全部數量: **{max_q:,.3f} {unit_name}**")
-            
-            with col_execute:
-                if close_mode == '指定數量': st.markdown("<br>", unsafe_allow_html=True) 
-                else: st.markdown("##### ") 
-                if st.button(f"執行平倉", use_container_width=True, key='execute_close_btn'):
-                    if logic.close_position_lot(sel_pid, close_q, current_open_price, reason='手動平倉', mode='手動'):
-                        st.rerun()
-else:
-    st.info("目前無持倉。")
-
-# --- 交易紀錄 ---
-st.markdown("---")
-st.header("📝 交易紀錄 (Transaction History)")
-
-if state.transactions:
-    df_tx = pd.DataFrame(state.transactions)
-    df_display = df_tx[['type_display', 'qty', 'open_price', 'close_price', 'fees', 'net_pnl', 'reason']].copy()
-    df_display.columns = ['類型', '數量', '開倉價', '平倉價', '總手續費', '淨損益', '備註']
-    
-    def color_pnl(val): return f'color: {"green" if val > 0 else "red" if val < 0 else ""}'
-
-    st.dataframe(
-        df_display.style.map(color_pnl, subset=['淨損益'])
-        .format({'數量': '{:,.3f}', '開倉價': '${:,.2f}', '平倉價': '${:,.2f}', '總手續費': '${:,.2f}', '淨損益': '${:,.2f}'}),
-        use_container_width=True, hide_index=True
-    )
-else:
-
-    st.info("尚無已平倉的交易紀錄。")
+# app.py
+# 應用程式入口：負責 UI 介面、事件處理與資料呈現
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+import json
+import copy
+import uuid
+import sqlite3
+import config
+import logic
+import charts
+import results_store
+import symbols
+import regimes
+import outcomes
+import jobs
+import strategies
+import batch_engine
+
+# --- 初始化 ---
+st.set_page_config(layout="wide", page_title="Ksim V2 - Optimized")
+
+# 確保 Session State 已初始化
+if 'initialized' not in st.session_state:
+    logic.reset_state()
+
+# 簡化變數引用
+state = st.session_state
+
+# --- 側邊欄：初始設定 (Asset & Ticker) ---
+if not state.initialized:
+    with st.sidebar:
+        st.header("Ksim V2.1")
+        
+        # 代碼輸入 + 本地目錄自動完成 (symbols.py，不連網)
+        symbol_index = symbols.get_index()
+        state.setdefault('ticker_query', state.ticker)
+        state.ticker = st.text_input(
+            "請輸入代碼或名稱 (e.g. TSLA, JPY=X, BTC-USD, 台積電, SYN:GBM:7)", key='ticker_query'
+        ).strip().upper()
+
+        suggestions = [sym for sym in symbol_index.search(state.ticker, limit=8) if sym != state.ticker]
+        if suggestions:
+            def _pick_suggestion():
+                state.ticker_query = state.ticker_suggestion
+
+            st.selectbox(
+                "建議代碼", suggestions, index=None, key='ticker_suggestion', on_change=_pick_suggestion,
+                format_func=lambda sym: f"{sym}  {symbol_index.get(sym)['name']}", placeholder="選擇以自動填入"
+            )
+
+        # 選擇回測資產類型 (目錄中有的代碼自動預選)
+        asset_types = ('Stock', 'Forex', 'Crypto')
+        entry = symbol_index.get(state.ticker)
+        selected_asset_type = st.radio(
+            "選擇回測資產類型 (定義交易規則)",
+            asset_types,
+            index=asset_types.index(entry['asset_type']) if entry else 0,
+            format_func=lambda x: {'Stock': '📈 股票', 'Forex': '💱 匯率', 'Crypto': '₿ 加密貨幣'}[x]
+        )
+        if entry and entry.get('first_date'):
+            st.caption(f"{entry['name']}：{entry['first_date']} ~ {entry['last_date']}")
+
+        seed_input = st.number_input(
+            "隨機種子 (0 = 隨機區間)", min_value=0, value=0, step=1,
+            help="輸入相同種子可重現同一段回測區間"
+        )
+        regime = st.selectbox(
+            "回測情境", [None, *regimes.REGIMES],
+            format_func=lambda r: "不限 (隨機區間)" if r is None else regimes.REGIMES[r],
+            help="只從該代碼歷史中符合情境的區間抽樣 (例如崩盤：模擬期內大幅回撤)"
+        )
+        
+        if st.button("🚀點擊開始回測"):
+            if state.ticker:
+                # 代碼 / 資產類型檢查在本機完成，不合規的代碼不會發出下載
+                error_msg = symbols.validate_ticker(state.ticker, selected_asset_type, symbol_index)
+                valid_input = error_msg is None
+
+                if valid_input:
+                    logic.reset_state()
+                    logic.initialize_data_and_simulation(selected_asset_type, seed=int(seed_input) or None, regime=regime)
+                    if state.initialized:
+                        symbols.remember(state.ticker, selected_asset_type)
+                    st.rerun()
+                else:
+                    st.error(error_msg)
+            else:
+                st.error("請輸入有效的代碼！")
+    
+    st.info(f"請在左側欄選擇資產類型，輸入代碼，並點擊 '🚀點擊開始回測'。目前預設: {state.ticker}")
+    st.stop()
+
+# --- 載入當前狀態參數 ---
+asset_conf = config.ASSET_CONFIGS[state.asset_type]
+unit_name = asset_conf['unit']
+min_qty = asset_conf['min_qty']
+default_qty = asset_conf['default_qty']
+
+def get_mode_label(key):
+    if key == 'Spot_Buy': return asset_conf['mode_spot']
+    if key == 'Margin_Long': return asset_conf['mode_margin_long']
+    if key == 'Margin_Short': return asset_conf['mode_margin_short']
+    return key
+
+# --- 背景工作 (jobs.py)：重計算交給行程池，頁面不會卡住 ---
+def _account_token():
+    """背景快轉送出後帳戶是否又被操作過 (有變動則不套用快轉結果)"""
+    return (state.current_sim_index, len(state.action_log), len(state.transactions), state.balance)
+
+def _submit_job(kind, submit, *args, **kwargs):
+    owner = state.setdefault('job_owner', uuid.uuid4().hex)
+    try:
+        job = submit(owner, *args, **kwargs)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    state.setdefault('background_jobs', {})[job.id] = {'kind': kind, 'token': _account_token()}
+
+def _fast_forward_account():
+    """送往 worker 的帳戶狀態：逐根快照只帶最後一筆 (新快照與它結構共享)，其餘快照留在本機"""
+    account = logic.export_account_state()
+    account['snapshots'] = account['snapshots'][-1:]
+    return copy.deepcopy(account)
+
+def _apply_fast_forward(job, info):
+    if info['token'] != _account_token():
+        state.last_event_msg = {'text': "⚠️ 快轉期間帳戶已有其他操作，快轉結果未套用。", 'type': 'error'}
+        return
+    account = dict(job.carry)
+    # 帳戶未變動，本機快照的最後一筆就是送出的那一筆：只接上 worker 新增的快照
+    state.snapshots.extend(account['snapshots'][len(state.snapshots[-1:]):])
+    account['snapshots'] = state.snapshots
+    logic.import_account_state(account)
+    done = "完成" if job.status == 'done' else "已取消，停在目前進度"
+    state.last_event_msg = {'text': f"⏩ {job.label}{done}。", 'type': 'info'}
+
+@st.fragment(run_every=config.JOB_POLL_SECONDS)
+def _job_panel():
+    """背景工作的進度與部分結果 (定時只重跑這個區塊)"""
+    manager = jobs.get_manager()
+    entries = state.background_jobs
+    for job_id, info in list(entries.items()):
+        job = manager.get(job_id)
+        if job is None:
+            del entries[job_id]
+            continue
+        status = {'queued': "排隊中", 'running': f"{job.progress:.0%}", 'done': "完成",
+                  'cancelled': "已取消", 'error': "失敗"}[job.status]
+        c1, c2 = st.columns([5, 1])
+        c1.progress(job.progress, text=f"{job.label}：{status}")
+        if not job.finished:
+            if c2.button("取消", key=f"cancel_job_{job_id}", use_container_width=True):
+                job.cancel()
+        elif c2.button("關閉", key=f"close_job_{job_id}", use_container_width=True):
+            del entries[job_id]
+            st.rerun(scope='fragment')
+
+        if job.status == 'error':
+            st.error(job.error)
+        elif info['kind'] == 'fast_forward':
+            if job.finished:
+                _apply_fast_forward(job, info)
+                del entries[job_id]
+                st.rerun()
+            st.caption(f"已推進到第 {job.carry['current_sim_index'] - config.INITIAL_OBSERVATION_DAYS + 1} 天；"
+                       "快轉期間若在畫面上操作，快轉結果將不套用。")
+        elif info['kind'] == 'sweep':
+            rows = [record for chunk in job.partial_results() for record in chunk]
+            if rows:
+                df_sweep = pd.DataFrame(rows).sort_values('roi', ascending=False).head(10)
+                # 現貨規則一律以 1 倍執行，槓桿欄標示為 n/a 以免誤讀
+                is_spot = df_sweep['mode'].map(lambda m: config.TRADE_MODE_MAP[m]['type'] == 'Spot')
+                df_sweep['leverage'] = df_sweep['leverage'].astype(object).where(~is_spot, 'n/a')
+                st.dataframe(df_sweep[['mode', 'leverage', 'sl_pct', 'tp_pct', 'roi', 'max_drawdown', 'n_trades', 'win_rate', 'liquidated']],
+                             use_container_width=True, hide_index=True)
+
+# 取得當前價格資訊
+_, open_price, _ = logic.get_price_info_by_index(state.core_data, state.current_sim_index)
+current_open_price = open_price if open_price > 0 else 0.0
+
+# --- 側邊欄：控制面板與交易區 ---
+with st.sidebar:
+    st.subheader(f"📈 {state.ticker} ({unit_name}回測)")
+    
+    days_passed = state.current_sim_index - config.INITIAL_OBSERVATION_DAYS + 1
+    days_remain = state.max_sim_index - state.current_sim_index
+    
+    st.markdown(f"**進度:** {max(1, days_passed)} 天 / 剩餘 {max(0, days_remain)} 天")
+    st.caption(f"(觀察期: {config.INITIAL_OBSERVATION_DAYS}天 / 顯示範圍: {config.VIEW_DAYS}天)")
+    st.markdown("---")
+    
+    # 時間控制按鈕
+    if state.sim_active:
+        col_t1, col_t2 = st.columns(2)
+        with col_t1:
+            if st.button("➡️ 下一天", use_container_width=True): 
+                logic.perform_action('next_day')
+                st.rerun()
+        with col_t2:
+            if st.button("⏭️ 下十天", use_container_width=True): 
+                logic.perform_action('next_ten_days')
+                st.rerun()
+        
+        if st.button("🛑 **提早結算**", use_container_width=True, help="結束模擬並平倉"):
+            logic.perform_action('settle')
+            st.rerun()
+
+        # 長距離快轉交給背景工作，推進時畫面仍可操作
+        with st.expander("⏩ 背景快轉"):
+            ff_days = int(st.number_input("快轉天數", min_value=1, max_value=max(1, days_remain),
+                                          value=min(100, max(1, days_remain)), step=10))
+            if st.button("⏩ 開始快轉", use_container_width=True):
+                chunk = config.JOB_FAST_FORWARD_CHUNK
+                target = state.current_sim_index + ff_days
+                _submit_job('fast_forward', jobs.get_manager().submit_chain, f"快轉 {ff_days} 天", jobs.advance_chunk,
+                            _fast_forward_account(), -(-ff_days // chunk),
+                            args=(jobs.window_key(state.ticker, state.core_data), chunk, target),
+                            until=lambda account: not account['sim_active'] or account['current_sim_index'] >= target)
+                st.rerun()
+    else:
+        if st.button("重新開始回測", use_container_width=True):
+            logic.reset_state()
+            st.rerun()
+
+    # 回溯：回到之前某一天開盤時的狀態，換一個決策重新推進 (不需重新下載資料)
+    rewind_range = logic.rewind_range()
+    if rewind_range:
+        first_day = rewind_range[0] - config.INITIAL_OBSERVATION_DAYS + 1
+        last_day = rewind_range[1] - config.INITIAL_OBSERVATION_DAYS + 1
+        with st.expander("⏪ 回溯到之前的某一天"):
+            rewind_day = st.number_input(
+                "回到第幾天 (該日開盤、操作前)", min_value=first_day, max_value=last_day,
+                value=max(first_day, last_day - 1), step=1
+            )
+            if st.button("⏪ 回溯", use_container_width=True):
+                logic.perform_action('rewind', int(rewind_day) - 1 + config.INITIAL_OBSERVATION_DAYS)
+                st.rerun()
+
+    st.download_button(
+        "💾 下載操作日誌", 
+        data=json.dumps(logic.export_session_log(), ensure_ascii=False),
+        file_name=f"ksim_{state.ticker}_{state.seed}.json", mime="application/json",
+        use_container_width=True, help="可用 replay.py 無頭重現本次回測"
+    )
+    
+    st.markdown("---")
+    
+    # --- 交易下單面板 ---
+    st.subheader("🛒 開倉交易")
+    
+    if state.sim_active:
+        # 1. 模式選擇
+        trade_mode_key = st.radio(
+             "交易模式",
+             ('Spot_Buy', 'Margin_Long', 'Margin_Short'), 
+             format_func=get_mode_label,
+             horizontal=True, key='trade_mode_select'
+        )
+
+        mode_conf = config.TRADE_MODE_MAP[trade_mode_key]
+        is_margin = mode_conf['type'] == 'Margin'
+        leverage = 1.0
+        
+        if is_margin:
+            leverage = st.slider("槓桿倍數", 1.0, config.MAX_LEVERAGE, 2.0, 0.5, format='%.1fx')
+        
+        # 2. 數量輸入
+        qty_mode = st.radio("數量模式", ('Absolute', 'Percentage'), 
+                            format_func=lambda x: unit_name if x == 'Absolute' else '百分比 (%)', 
+                            horizontal=True, label_visibility="collapsed")
+        
+        final_qty = 0.0
+        is_int_qty = (min_qty >= 1.0 and min_qty == int(min_qty))
+        
+        if qty_mode == 'Absolute':
+            if is_int_qty:
+                qty_input = st.number_input(
+                    f"數量 ({unit_name})", 
+                    min_value=int(min_qty),        
+                    value=int(default_qty),        
+                    step=int(max(1, min_qty)),
+                    format='%i'
+                )
+                final_qty = float(qty_input)
+            else:
+                qty_input = st.number_input(
+                    f"數量 ({unit_name})", 
+                    min_value=float(min_qty),        
+                    value=float(default_qty),        
+                    step=float(min_qty) if min_qty < 1 else 1.0,
+                    format='%.3f'
+                )
+                final_qty = float(qty_input)
+        else:
+            pct = st.slider("開倉比例 (%)", 1.0, 100.0, 50.0, 1.0)
+            asset_to_use = state.balance * (pct / 100.0)
+            max_shares = (asset_to_use / open_price * leverage) if open_price > 0 else 0.0
+            
+            if is_int_qty:
+                 final_qty = float(int(max_shares / min_qty) * min_qty)
+            else:
+                 precision = len(str(min_qty).split('.')[-1])
+                 final_qty = round(max_shares / min_qty) * min_qty
+                 final_qty = round(final_qty, precision)
+            
+            st.markdown(f"<p style='font-size: small;'>換算數量: {final_qty:,.3f} {unit_name}</p>", unsafe_allow_html=True)
+
+        # 3. 預估計算
+        est_cost = final_qty * open_price
+        est_margin = est_cost / leverage
+        fee_rate = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
+        est_fee = est_cost * fee_rate
+        
+        st.info(f"參考價: ${open_price:,.2f}")
+        
+        col_fee, col_cost = st.columns(2)
+        with col_fee:
+            st.markdown(f"<p style='font-size: small;'>預估手續費用: ${est_fee:,.2f}</p>", unsafe_allow_html=True)
+        with col_cost:
+            st.markdown(f"<p style='font-size: small;'>總值: ${est_cost:,.2f}</p>", unsafe_allow_html=True)
+        
+        if is_margin:
+            liq_price = 0.0
+            if mode_conf['direction'] == 'Long':
+                liq_price = open_price * (1.0 - (1.0 / leverage))
+            else:
+                liq_price = open_price * (1.0 + (1.0 / leverage))
+            
+            st.markdown(f"**預估保證金:** ${est_margin:,.2f}")
+            st.markdown(f"**預估強平價:** ${liq_price:,.2f}")
+
+        # 4. 委託類型 (市價立即成交；限價 / 停損 / OCO 掛單於之後的 K 線觸價成交)
+        order_type = st.radio(
+            "委託類型", ('Market', 'Limit', 'Stop', 'OCO'),
+            format_func=lambda x: {'Market': '市價', 'Limit': '限價', 'Stop': '停損', 'OCO': 'OCO'}[x],
+            horizontal=True, key='order_type_select'
+        )
+        
+        if order_type in ('Limit', 'OCO'):
+            limit_price = st.number_input("限價", min_value=0.0, value=float(open_price), format='%.2f', key='limit_price_input')
+        if order_type in ('Stop', 'OCO'):
+            stop_price = st.number_input("停損觸發價", min_value=0.0, value=float(open_price), format='%.2f', key='stop_price_input')
+
+        # 5. 執行按鈕
+        if order_type == 'Market':
+            if st.button(f"執行開倉", use_container_width=True):
+                if logic.perform_action('open', trade_mode_key, final_qty, open_price, leverage):
+                    st.rerun()
+        elif st.button(f"送出委託", use_container_width=True):
+            if order_type == 'OCO':
+                placed = logic.perform_action('oco', trade_mode_key, final_qty, limit_price, stop_price, leverage)
+            else:
+                trigger_price = limit_price if order_type == 'Limit' else stop_price
+                placed = logic.perform_action('order', trade_mode_key, order_type, final_qty, trigger_price, leverage)
+            if placed:
+                st.rerun()
+    else:
+        st.info("模擬已結束。")
+
+# --- 主畫面區 ---
+
+# 0. 通知
+if state.get('last_event_msg'):
+    msg = state.last_event_msg
+    if msg['type'] == 'error':
+        st.error(f"### {msg['text']}")
+    elif msg['type'] == 'success':
+        st.success(f"### {msg['text']}")
+    else:
+        st.info(f"### {msg['text']}")
+
+# 背景工作進度 (有工作時才輪詢)
+if state.get('background_jobs'):
+    st.subheader("🛠️ 背景工作")
+    _job_panel()
+
+# 1. 結算報告
+if not state.sim_active and state.get('settlement_stats'):
+    stats = state.settlement_stats
+    if not state.get('result_saved'):
+        # 每次回測只寫入結果庫一次 (config.RESULTS_DB 為空字串時停用)
+        state.result_saved = True
+        try:
+            results_store.save_session(state)
+        except sqlite3.Error as e:
+            st.warning(f"⚠️ 無法寫入回測結果庫：{e}")
+    with st.container():
+        st.success(f"🏁 回測模擬結束！")
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("最終資產", f"${stats['final_asset']:,.2f}")
+        
+        pnl = stats['total_pnl']
+        color = "normal" 
+        
+        c2.metric("總損益", f"${pnl:,.2f}", delta_color=color)
+        c3.metric("投資報酬率 (ROI)", f"{stats['roi']:+.2f}%", delta_color=color)
+        
+        with c4:
+            s_str = stats['start_date'].strftime('%Y/%m/%d')
+            e_str = stats['end_date'].strftime('%Y/%m/%d')
+            st.metric("回測期間", f"{s_str} ~ {e_str}")
+
+        # SL/TP 假設分析：同一次結算只計算一次
+        if state.transactions:
+            with st.expander("🧪 SL/TP 假設分析：若改用不同的止損 / 止盈距離"):
+                end_idx = state.end_sim_index_on_settle if state.end_sim_index_on_settle is not None else state.current_sim_index
+                outcome_key = (state.seed, len(state.transactions), end_idx, state.transactions[-1]['net_pnl'])
+                if state.get('sltp_outcomes', (None,))[0] != outcome_key:
+                    state.sltp_outcomes = (outcome_key, outcomes.sltp_outcomes(state.core_data, state.transactions, end_idx))
+                result = state.sltp_outcomes[1]
+                best = outcomes.best_cell(result)
+                b1, b2 = st.columns(2)
+                b1.metric("實際已實現淨損益", f"${result['actual_net_pnl']:,.0f}")
+                b2.metric(f"最佳組合 SL {best['sl_pct']:.1f}% / TP {best['tp_pct']:.1f}%", f"${best['net_pnl']:,.0f}",
+                          delta=f"{best['net_pnl'] - result['actual_net_pnl']:+,.0f}")
+                st.plotly_chart(charts.render_outcome_heatmap(result), use_container_width=True)
+                st.caption(f"以 {result['n_trades']} 筆已平倉交易的進場價與數量，從進場下一根起持有到觸及 SL / TP / 強平，"
+                           "否則以結束時收盤價結算 (不含移動止損)。")
+
+        # 策略參數掃描：同一段行情上跑多組規則 (背景執行，結果陸續出現在上方的背景工作區)
+        with st.expander("🧮 策略參數掃描 (背景執行)：同一段行情上比較多組規則"):
+            s1, s2 = st.columns(2)
+            sweep_strategy = s1.selectbox("策略", list(strategies.RULES), key='sweep_strategy')
+            sweep_mode = s2.selectbox("交易模式", list(config.TRADE_MODE_MAP), format_func=get_mode_label, key='sweep_mode')
+            if config.TRADE_MODE_MAP[sweep_mode]['type'] == 'Margin':
+                sweep_leverage = [float(v) for v in st.multiselect("槓桿", [1, 2, 3, 5, 10, 20], default=[1, 2, 5], key='sweep_leverage')]
+            else:
+                sweep_leverage = [1.0]   # 現貨不使用槓桿：不重複跑結果相同的組合
+                st.caption("現貨模式不使用槓桿。")
+            sweep_grid = batch_engine.param_grid(
+                leverage=sweep_leverage,
+                sl_pct=[float(v) for v in st.multiselect("止損 %", [0, 2, 5, 10], default=[0, 5], key='sweep_sl')],
+                tp_pct=[float(v) for v in st.multiselect("止盈 %", [0, 5, 10, 20], default=[0, 10], key='sweep_tp')],
+            )
+            if st.button(f"🧮 開始掃描 ({len(sweep_grid)} 組)", disabled=not sweep_grid):
+                rules = [dict(params, strategy=sweep_strategy, mode=sweep_mode) for params in sweep_grid]
+                _submit_job('sweep', jobs.get_manager().submit_map, f"{sweep_strategy} 掃描 {len(rules)} 組",
+                            jobs.run_rules_chunk, jobs.chunked(rules, config.JOB_SWEEP_CHUNK),
+                            args=(jobs.window_key(state.ticker, state.core_data), state.asset_type))
+                st.rerun()
+
+        st.markdown("---")
+
+# 2. 資金看板
+total_asset = logic.get_current_asset_value(state.core_data, state.current_sim_index)
+unrealized_pnl = logic.get_total_unrealized_pnl(current_open_price)
+spot_info = logic.get_spot_summary(state.core_data, state.current_sim_index)
+margin_info = logic.get_margin_usage(state.core_data, state.current_sim_index)
+
+m1, m2, m3, m4 = st.columns(4)
+m1.metric("總資產 (含未實現)", f"${total_asset:,.2f}")
+m2.metric("現金餘額", f"${state.balance:,.2f}")
+m3.metric("未實現損益", f"${unrealized_pnl:,.2f}")
+m4.metric(f"現貨持倉 ({unit_name})", f"{spot_info['qty']:,.3f}")
+if margin_info['used_margin'] > 0:
+    st.caption(f"槓桿保證金占用：${margin_info['used_margin']:,.2f} (總資產的 {margin_info['ratio']:.1f}%)")
+
+# 3. 圖表繪製
+fig = charts.render_main_chart(
+    state.ticker, state.core_data, state.current_sim_index, 
+    state.positions, state.end_sim_index_on_settle, state.plot_layout,
+    pending_orders=list(state.order_book)
+)
+
+chart_event = st.plotly_chart(
+    fig, 
+    use_container_width=True, 
+    key="main_chart",
+    config={'scrollZoom': True, 'displayModeBar': True} 
+)
+
+if "main_chart" in state and state.main_chart:
+    layout = state.main_chart.get('layout', {})
+    if layout:
+        saved = {}
+        for i in [None, 2, 3]:
+            k = f'xaxis{i}' if i else 'xaxis'
+            if k in layout and 'range' in layout[k]:
+                 saved[f'{k}.range'] = layout[k]['range']
+        if saved: state.plot_layout = saved
+
+# 4. 倉位管理
+st.markdown("---")
+st.header("🎯 交易倉位 (Open Positions)")
+
+if state.positions:
+    pos_data = []
+    for pos in state.positions:
+        qty = pos['qty']
+        cost = pos['cost']
+        leverage = pos.get('leverage', 1.0)
+        
+        mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
+        direction = mode_info.get('direction', 'Long')
+        
+        pnl = logic.calculate_pnl_value(direction, qty, cost, current_open_price)
+            
+        sl_val = pos['sl']
+        tp_val = pos['tp']
+        sl_pnl_str = ""
+        tp_pnl_str = ""
+        
+        if sl_val > 0:
+            est_sl_pnl = logic.calculate_pnl_value(direction, qty, cost, sl_val)
+            sign = "+" if est_sl_pnl > 0 else "-"
+            sl_pnl_str = f"預估 {sign}${abs(est_sl_pnl):,.0f}"
+
+        if tp_val > 0:
+            est_tp_pnl = logic.calculate_pnl_value(direction, qty, cost, tp_val)
+            sign = "+" if est_tp_pnl > 0 else "-"
+            tp_pnl_str = f"預估 {sign}${abs(est_tp_pnl):,.0f}"
+        
+        pos_data.append({
+            'ID': pos['id'],
+            '類型': pos['display_name'],  
+            '槓桿': f"{leverage:.1f}x",
+            '數量': qty,
+            '開倉價': cost,
+            '未實現損益': pnl,
+            'SL': sl_val,
+            'SL 預估損益': sl_pnl_str,
+            'TP': tp_val,
+            'TP 預估損益': tp_pnl_str,
+            '移動止損%': pos.get('trail_pct', 0.0)
+        })
+    
+    df_pos = pd.DataFrame(pos_data)
+    
+    edited_df = st.data_editor(
+        df_pos.set_index('ID'),
+        column_config={
+            "類型": st.column_config.TextColumn(disabled=True),
+            "槓桿": st.column_config.TextColumn(disabled=True),
+            "數量": st.column_config.NumberColumn(format="%.3f", disabled=True),
+            "開倉價": st.column_config.NumberColumn(format="$%.2f", disabled=True),
+            "未實現損益": st.column_config.NumberColumn(format="$%.2f", disabled=True),
+            "SL": st.column_config.NumberColumn("止損價格 (SL)", format="$%.2f", step=0.1),
+            "SL 預估損益": st.column_config.TextColumn("SL 損益", disabled=True),
+            "TP": st.column_config.NumberColumn("止盈價格 (TP)", format="$%.2f", step=0.1),
+            "TP 預估損益": st.column_config.TextColumn("TP 損益", disabled=True),
+            "移動止損%": st.column_config.NumberColumn("移動止損 (%)", format="%.1f%%", min_value=0.0, step=0.5),
+        },
+        use_container_width=True,
+        key='pos_editor'
+    )
+    
+    if st.button("💾 儲存 SL/TP 設定", use_container_width=True):
+        updates = edited_df.to_dict('index')
+        changed = False
+        validation_error = False
+        
+        for pos in state.positions:
+            pid = pos['id']
+            if pid in updates:
+                new_sl = updates[pid]['SL']
+                new_tp = updates[pid]['TP']
+                new_trail = updates[pid]['移動止損%']
+
+                # 表格顯示的是儲存前的 SL/TP；移動止損會改寫 pos['sl']，需先記下才能判斷使用者是否修改
+                old_sl, old_tp = pos['sl'], pos['tp']
+                if new_trail != pos.get('trail_pct', 0.0):
+                    logic.perform_action('trail', pid, new_trail)
+                    changed = True
+                
+                if old_sl == new_sl and old_tp == new_tp:
+                    continue
+                if old_sl == new_sl: new_sl = pos['sl']   # 只改了 TP：保留移動止損算出的止損
+                
+                error = logic.validate_sl_tp(pos, new_sl, new_tp)
+                if error:
+                    st.error(f"🚫 ID {pid[-4:]} 錯誤：{error}")
+                    validation_error = True; continue
+
+                logic.perform_action('sl_tp', pid, new_sl, new_tp)
+                changed = True
+        
+        if not validation_error:
+            if changed: st.success("設定已更新！"); st.rerun() 
+            else: st.info("無變更。")
+
+    # --- 手動平倉區 ---
+    st.markdown("---")
+    
+    col_header, col_close_all = st.columns([4, 1])
+    with col_header: st.subheader("手動平倉操作")
+    
+    if state.sim_active:
+        pos_opts = {p['id']: f"{p['display_name']} {p['qty']:.3f} ({p['id'][-4:]})" for p in state.positions}
+        
+        with col_close_all:
+             st.write("") 
+             if st.button("🔴 平倉所有部位", use_container_width=True, key='close_all_btn'):
+                logic.perform_action('close_all')
+                st.rerun()
+            
+        col_select, col_mode_radio = st.columns([3, 2])
+        with col_select:
+            st.caption("選擇部位")
+            sel_pid = st.selectbox("選擇部位", options=list(pos_opts.keys()), format_func=lambda x: pos_opts[x], label_visibility='collapsed', key='manual_close_select')
+            
+        target_pos = next((p for p in state.positions if p['id'] == sel_pid), None)
+        
+        if target_pos:
+            max_q = target_pos['qty']
+            close_q = max_q
+            
+            with col_mode_radio:
+                st.caption("平倉模式")
+                close_mode = st.radio("平倉模式", ('全部', '指定數量', '指定比例'), horizontal=True, label_visibility='collapsed', key='manual_close_mode_radio')
+            
+            st.markdown("##### ") 
+            col_input_value, col_execute = st.columns([4, 1])
+            
+            with col_input_value:
+                if close_mode == '指定數量':
+                    close_q = st.number_input(f"平倉數量 ({unit_name})", min_value=0.0, max_value=float(max_q), value=float(max_q), step=min_qty if min_qty < 1 else 1.0, key='manual_close_qty_input')
+                elif close_mode == '指定比例':
+                    pct_close = st.slider("比例 (%)", 1.0, 100.0, 50.0, key='manual_close_pct_slider')
+                    close_q = max_q * (pct_close / 100.0)
+                    st.caption(f"換算數量: **{close_q:,.3f} {unit_name}**")
+                else: 
+                    close_q = max_q
+                    st.info(f"將平倉部位全部數量: **{max_q:,.3f} {unit_name}**")
+            
+            with col_execute:
+                if close_mode == '指定數量': st.markdown("<br>", unsafe_allow_html=True) 
+                else: st.markdown("##### ") 
+                if st.button(f"執行平倉", use_container_width=True, key='execute_close_btn'):
+                    if logic.perform_action('close', sel_pid, close_q, current_open_price):
+                        st.rerun()
+else:
+    st.info("目前無持倉。")
+
+# --- 掛單 ---
+st.markdown("---")
+st.header("📋 掛單 (Pending Orders)")
+
+if state.order_book:
+    order_type_names = {'Limit': '限價', 'Stop': '停損'}
+    df_orders = pd.DataFrame([{
+        'ID': o['id'], '類型': f"{get_mode_label(o['pos_mode_key'])} {order_type_names[o['order_type']]}",
+        '觸發價': o['price'], '數量': o['qty'], '槓桿': f"{o['leverage']:.1f}x", 'OCO': o['oco'] or ''
+    } for o in state.order_book])
+    st.dataframe(
+        df_orders.style.format({'觸發價': '${:,.2f}', '數量': '{:,.3f}'}),
+        use_container_width=True, hide_index=True
+    )
+    
+    if state.sim_active:
+        col_order_select, col_order_cancel = st.columns([4, 1])
+        with col_order_select:
+            cancel_oid = st.selectbox("選擇掛單", options=df_orders['ID'].tolist(), label_visibility='collapsed', key='cancel_order_select')
+        with col_order_cancel:
+            if st.button("撤單", use_container_width=True, key='cancel_order_btn'):
+                logic.perform_action('cancel_order', cancel_oid)
+                st.rerun()
+else:
+    st.info("目前無掛單。")
+
+# --- 交易紀錄 ---
+st.markdown("---")
+st.header("📝 交易紀錄 (Transaction History)")
+
+if state.transactions:
+    df_tx = pd.DataFrame(state.transactions)
+    df_display = df_tx[['type_display', 'qty', 'open_price', 'close_price', 'fees', 'net_pnl', 'reason']].copy()
+    df_display.columns = ['類型', '數量', '開倉價', '平倉價', '總手續費', '淨損益', '備註']
+    
+    def color_pnl(val): return f'color: {"green" if val > 0 else "red" if val < 0 else ""}'
+
+    st.dataframe(
+        df_display.style.map(color_pnl, subset=['淨損益'])
+        .format({'數量': '{:,.3f}', '開倉價': '${:,.2f}', '平倉價': '${:,.2f}', '總手續費': '${:,.2f}', '淨損益': '${:,.2f}'}),
+        use_container_width=True, hide_index=True
+    )
+else:
+
+    st.info("尚無已平倉的交易紀錄。")
@@ -0,0 +1,246 @@
+# batch_engine.py
+# 批次多帳戶引擎：同一段價格路徑上同時模擬 K 個獨立帳戶 (只差在槓桿、SL/TP、資金比例...)
+# 帳戶狀態以長度 K 的陣列表示 (balance / qty / cost / sl / tp / liq)，每根 K 線對全部帳戶做一次向量運算
+#
+# 交易規則與 logic.py 相同 (強平 → 止損 → 止盈的優先順序、開平倉手續費、破產檢測、到期以收盤價結算)，
+# 行為等同 strategies.run_rule 的 buy_and_hold 規則：空手時以開盤價依資金比例進場，出場後下一根再進場
+# 同一根同時觸及多個出場價時固定依上述優先順序 (不支援 config.INTRABAR_RESOLUTION 的盤中判定)
+#
+# 用法：python batch_engine.py TSLA --seed 1 [--regime crash] --mode Margin_Long --leverage 1 2 5 10 --sl 0 2 5 --tp 0 5 10 --size 50 100
+
+import sys
+import time
+import argparse
+import itertools
+import numpy as np
+import config
+import logic
+import regimes
+
+PARAM_DEFAULTS = {'mode': 'Spot_Buy', 'leverage': 1.0, 'size_pct': 100.0, 'sl_pct': 0.0, 'tp_pct': 0.0, 'trail_pct': 0.0}
+
+# --- 參數 ---
+
+def make_params(variants: list[dict]) -> dict[str, np.ndarray]:
+    """把規則列表 (與 strategies 的規則欄位相同) 轉成各欄一個陣列"""
+    for v in variants:
+        error = logic.validate_leverage(v.get('mode', 'Spot_Buy'), float(v.get('leverage', 1.0)))
+        if error:
+            raise ValueError(error)
+    params = {key: np.array([v.get(key, default) for v in variants]) for key, default in PARAM_DEFAULTS.items()}
+    for key in PARAM_DEFAULTS:
+        if key != 'mode':
+            params[key] = params[key].astype(float)
+    return params
+
+def param_grid(**axes) -> list[dict]:
+    """參數網格：param_grid(leverage=[1, 5], sl_pct=[0, 5]) -> 4 組規則"""
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*(axes[k] for k in keys))]
+
+# --- 引擎 ---
+
+def run_accounts(window_data, asset_type: str, params: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """
+    在 window_data (start_simulation 使用的視窗) 上同時模擬所有帳戶，回傳各帳戶的結果陣列
+    結果欄位同 results_store.summarize_run：final_asset, roi, max_drawdown, n_trades, win_rate, total_fees, liquidated, bars
+    """
+    opens = window_data['Open'].to_numpy(dtype=float)
+    highs = window_data['High'].to_numpy(dtype=float)
+    lows = window_data['Low'].to_numpy(dtype=float)
+    closes = window_data['Close'].to_numpy(dtype=float)
+    start, last = config.INITIAL_OBSERVATION_DAYS, len(window_data) - 1
+    min_qty = config.ASSET_CONFIGS[asset_type]['min_qty']
+
+    k = len(params['mode'])
+    is_margin = np.array([config.TRADE_MODE_MAP[m]['type'] == 'Margin' for m in params['mode']])
+    sign = np.array([1.0 if config.TRADE_MODE_MAP[m]['direction'] == 'Long' else -1.0 for m in params['mode']])
+    long_ = sign > 0
+    leverage = np.where(is_margin, params['leverage'], 1.0)
+    fee_rate = np.where(is_margin, config.LEVERAGE_FEE_RATE, config.FEE_RATE)
+    size_frac = params['size_pct'] / 100.0
+    sl_pct, tp_pct, trail = params['sl_pct'] / 100.0, params['tp_pct'] / 100.0, params['trail_pct'] / 100.0
+
+    active = np.ones(k, dtype=bool)
+    balance = np.full(k, config.INITIAL_CAPITAL)
+    qty = np.zeros(k)
+    cost = np.zeros(k)
+    sl = np.zeros(k)
+    tp = np.zeros(k)
+    liq = np.zeros(k)
+    open_fee = np.zeros(k)
+    end_idx = np.full(k, last)
+    n_trades = np.zeros(k, dtype=np.int64)
+    wins = np.zeros(k, dtype=np.int64)
+    total_fees = np.zeros(k)
+    liquidated = np.zeros(k, dtype=bool)
+    peak = np.full(k, -np.inf)
+    max_dd = np.zeros(k)
+
+    def asset_value(price):
+        # 與 get_current_asset_value 相同：保證金 + 未實現損益 (現貨槓桿為 1，即市值)
+        margin_value = cost * qty / leverage + sign * (price - cost) * qty
+        return balance + np.where(qty > 0, np.where(is_margin, margin_value, qty * price), 0.0)
+
+    def close(mask, price):
+        """平倉 (close_position_lot)：mask 內的帳戶以 price 全部平倉"""
+        q, c = qty[mask], cost[mask]
+        close_fee = q * price * fee_rate[mask]
+        pnl = sign[mask] * (price - c) * q
+        balance[mask] -= close_fee
+        balance[mask] += c * q / leverage[mask] + pnl
+        fees = open_fee[mask] + close_fee
+        total_fees[mask] += fees
+        wins[mask] += (pnl - fees) > 0
+        n_trades[mask] += 1
+        qty[mask] = 0.0
+
+    def end(mask, idx, settle_price=None):
+        """結束模擬 (settle_portfolio(force_end=True))：持倉以 settle_price 結算"""
+        if settle_price is not None:
+            holding = mask & (qty > 0)
+            if holding.any():
+                close(holding, settle_price)
+        active[mask] = False
+        end_idx[mask] = idx
+
+    def _trail(mask, high, low):
+        """移動止損 (_trail_stop)：多單只上調、空單只下調"""
+        new_sl = np.where(long_, high * (1.0 - trail), low * (1.0 + trail))
+        better = np.where(long_, new_sl > sl, (sl <= 0) | (new_sl < sl))
+        update = mask & better
+        sl[update] = new_sl[update]
+
+    def track_drawdown(values, mask):
+        peak[mask] = np.maximum(peak[mask], values[mask])
+        max_dd[mask] = np.maximum(max_dd[mask], (peak[mask] - values[mask]) / peak[mask])
+
+    for i in range(start, last + 1):
+        price = opens[i]
+        track_drawdown(asset_value(price), active)
+
+        # 進場：空手的帳戶依資金比例以開盤價開倉 (strategies.position_size + execute_trade)
+        flat = active & (qty == 0)
+        if flat.any() and price > 0:
+            raw = balance * size_frac / (price * (1.0 / leverage + fee_rate))
+            q = np.floor(raw / min_qty + 1e-9) * min_qty
+            entering = flat & (q > 0)
+            fee = q * price * fee_rate
+            bankrupt = entering & (balance - fee <= 0)
+            if bankrupt.any():
+                balance[bankrupt] -= fee[bankrupt]
+                end(bankrupt, i)
+            margin = q * price / leverage
+            entering &= ~bankrupt & (balance - fee >= margin)
+            if entering.any():
+                balance[entering] -= fee[entering]
+                balance[entering] -= margin[entering]
+                qty[entering] = q[entering]
+                cost[entering] = price
+                open_fee[entering] = fee[entering]
+                s = sign[entering]
+                lev = leverage[entering]
+                liq[entering] = np.where(is_margin[entering], price * (1.0 - s / lev), 0.0)
+                sl[entering] = np.where(sl_pct[entering] > 0, price * (1.0 - s * sl_pct[entering]), 0.0)
+                tp[entering] = np.where(tp_pct[entering] > 0, price * (1.0 + s * tp_pct[entering]), 0.0)
+                # 移動止損的初始止損 (set_trailing_stop：以開盤價為基準)
+                trail_entry = entering & (trail > 0)
+                if trail_entry.any():
+                    _trail(trail_entry, price, price)
+
+        if i == last:
+            # 最後一根：以收盤價結算所有仍在進行的帳戶
+            end(active, i, closes[i])
+            break
+
+        # 推進到下一根 K 線：強平 → 止損 → 止盈 (check_sl_tp_trigger)
+        j = i + 1
+        high, low = highs[j], lows[j]
+        holding = active & (qty > 0)
+        liq_hit = holding & is_margin & (liq > 0) & np.where(long_, low <= liq, high >= liq)
+        sl_hit = holding & ~liq_hit & (sl > 0) & np.where(long_, low <= sl, high >= sl)
+        tp_hit = holding & ~liq_hit & ~sl_hit & (tp > 0) & np.where(long_, high >= tp, low <= tp)
+        hit = liq_hit | sl_hit | tp_hit
+        if hit.any():
+            exit_price = np.where(liq_hit, liq, np.where(sl_hit, sl, tp))
+            close(hit, exit_price[hit])
+            liquidated |= liq_hit
+            broke = hit & (balance <= 0)
+            if broke.any():
+                end(broke, j)
+
+        # 移動止損：以本根極值調整，下一根起生效
+        trailing = active & (qty > 0) & (trail > 0)
+        if trailing.any():
+            _trail(trailing, high, low)
+
+        # 破產檢測 (_advance_one_day)：以新一根的開盤價估值，歸零則以收盤價強制結算
+        broke = active & (asset_value(opens[j]) <= 0)
+        if broke.any():
+            end(broke, j, closes[j])
+
+    final_asset = balance
+    track_drawdown(final_asset, np.ones(k, dtype=bool))
+    return {
+        'final_asset': final_asset,
+        'roi': (final_asset - config.INITIAL_CAPITAL) / config.INITIAL_CAPITAL * 100,
+        'max_drawdown': max_dd * 100,
+        'n_trades': n_trades,
+        'win_rate': np.where(n_trades > 0, wins / np.maximum(n_trades, 1) * 100, 0.0),
+        'total_fees': total_fees,
+        'liquidated': liquidated,
+        'bars': end_idx - start,
+    }
+
+def to_records(params, results) -> list[dict]:
+    """參數 + 結果陣列轉成逐帳戶的 dict 列表"""
+    keys = list(params) + list(results)
+    columns = [params.get(key, results.get(key)) for key in keys]
+    return [{key: value.item() for key, value in zip(keys, row)} for row in zip(*columns)]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 批次多帳戶引擎 (參數掃描)")
+    parser.add_argument('ticker')
+    parser.add_argument('--asset-type', default='Stock')
+    parser.add_argument('--seed', type=int, default=0, help="回測視窗種子 (與 app / batch_runner 相同)")
+    parser.add_argument('--regime', choices=list(regimes.REGIMES), help="只從該市場情境的視窗抽樣 (見 regimes.py)")
+    parser.add_argument('--mode', nargs='+', default=['Margin_Long'])
+    parser.add_argument('--leverage', type=float, nargs='+', default=[1.0, 2.0, 5.0, 10.0])
+    parser.add_argument('--size', type=float, nargs='+', default=[100.0], help="資金比例 (%%)")
+    parser.add_argument('--sl', type=float, nargs='+', default=[0.0], help="止損 (%%)")
+    parser.add_argument('--tp', type=float, nargs='+', default=[0.0], help="止盈 (%%)")
+    parser.add_argument('--trail', type=float, nargs='+', default=[0.0], help="移動止損 (%%)")
+    parser.add_argument('--top', type=int, default=10, help="列出 ROI 最高的前幾組")
+    args = parser.parse_args(argv)
+
+    data = logic.fetch_historical_data(args.ticker.upper())
+    try:
+        if data is None:
+            window = None
+        elif args.regime:
+            window = regimes.select_regime_window(args.ticker.upper(), data, args.regime, args.seed)
+        else:
+            window = logic.select_window(data, args.seed)
+    except ValueError as e:
+        print(e)
+        return 1
+    if window is None:
+        print(f"無法載入 {args.ticker} 的數據或資料不足")
+        return 1
+
+    params = make_params(param_grid(mode=args.mode, leverage=args.leverage, size_pct=args.size,
+                                    sl_pct=args.sl, tp_pct=args.tp, trail_pct=args.trail))
+    t0 = time.perf_counter()
+    results = run_accounts(window, args.asset_type, params)
+    elapsed = time.perf_counter() - t0
+
+    records = sorted(to_records(params, results), key=lambda r: r['roi'], reverse=True)
+    print(f"✅ {len(records):,} 組參數 / {elapsed * 1000:,.1f} ms ({len(records) / elapsed:,.0f} 組/秒)")
+    print(f"強平比例 {results['liquidated'].mean() * 100:.1f}% / ROI 中位數 {np.median(results['roi']):+.2f}%")
+    for r in records[:args.top]:
+        print(f"  {r['mode']:<13}{r['leverage']:>5g}x size {r['size_pct']:>5g}% sl {r['sl_pct']:>4g}% tp {r['tp_pct']:>4g}% "
+              f"trail {r['trail_pct']:>4g}% → ROI {r['roi']:+8.2f}%  MDD {r['max_drawdown']:6.2f}%  交易 {r['n_trades']}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
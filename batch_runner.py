@@ -0,0 +1,287 @@
+# batch_runner.py
+# 無頭批次回測：依 JSON / YAML 規格跑大量回測，不需 Streamlit，多核心平行執行
+#
+# 規格範例 (spec.yaml)：
+#   tickers: [TSLA, NVDA]
+#   asset_type: Stock
+#   windows: {count: 20, seed: 42}      # 每檔代碼隨機抽 20 段視窗 (種子 42, 43, ...，與 app 種子輸入相容)
+#                                        # 可加 regime: crash 只抽該情境的視窗 (crash / rally / high_vol / sideways，見 regimes.py)
+#   rules:                               # 可為單一規則或規則列表
+#     - {strategy: ma_cross, fast: 20, slow: 60, mode: Margin_Long, leverage: 3, size_pct: 50, sl_pct: 5, tp_pct: 10}
+#   fees: {fee_rate: 0.005, leverage_fee_rate: 0.01}
+#   workers: 4
+#   output: results.jsonl                # 或 results.parquet (需要 pyarrow)
+#   db: ksim_results.db                  # 選用：同時寫入 results_store 結果庫 (含交易紀錄與權益曲線)
+#
+# 用法：python batch_runner.py spec.yaml [--workers N] [--output PATH] [--db PATH]
+
+import os
+import sys
+import json
+import time
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import config
+import logic
+import strategies
+import regimes
+from results_store import ResultsStore, summarize_run, trade_rows, downsample
+from data_manager import fetch_historical_data
+
+# 規格中 fees 區塊可覆寫的 config 參數
+FEE_OVERRIDES = {'fee_rate': 'FEE_RATE', 'leverage_fee_rate': 'LEVERAGE_FEE_RATE'}
+
+# --- 規格 ---
+
+def load_spec(path: str) -> dict:
+    """讀取 JSON 或 YAML 規格 (YAML 需要 PyYAML)"""
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("讀取 YAML 規格需要 PyYAML：pip install pyyaml")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    if not spec.get('tickers'):
+        raise ValueError("規格需包含 tickers")
+    if spec.get('asset_type', 'Stock') not in config.ASSET_CONFIGS:
+        raise ValueError(f"未知的資產類型: {spec.get('asset_type')}")
+    rules = spec.get('rules', {'strategy': 'buy_and_hold'})
+    spec['rules'] = rules if isinstance(rules, list) else [rules]
+    for rule in spec['rules']:
+        strategies.validate_rule(rule)
+    regime = spec.get('windows', {}).get('regime')
+    if regime is not None and regime not in regimes.REGIMES:
+        raise ValueError(f"未知的情境: {regime} (可用: {', '.join(regimes.REGIMES)})")
+    fees = spec.get('fees') or {}
+    unknown = sorted(set(fees) - set(FEE_OVERRIDES))
+    if unknown:
+        raise ValueError(f"fees 中有未知的欄位: {', '.join(unknown)} (可用: {', '.join(FEE_OVERRIDES)})")
+    for key, value in fees.items():
+        try:
+            if float(value) < 0: raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(f"fees.{key} 需為非負數 (收到 {value!r})")
+    return spec
+
+def expand_jobs(spec: dict) -> list[dict]:
+    """展開成單次回測工作：代碼 × 視窗 × 規則"""
+    windows = spec.get('windows', {})
+    count = int(windows.get('count', 1))
+    base_seed = int(windows.get('seed', 0))
+    regime = windows.get('regime')
+    return [
+        {'ticker': ticker.upper(), 'seed': base_seed + i, 'rule': rule, 'rule_index': r, 'regime': regime}
+        for ticker in spec['tickers']
+        for i in range(count)
+        for r, rule in enumerate(spec['rules'])
+    ]
+
+@contextmanager
+def fee_overrides(fees: dict | None):
+    """暫時覆寫手續費設定，結束後還原"""
+    saved = {name: getattr(config, name) for name in FEE_OVERRIDES.values()}
+    try:
+        for key, value in (fees or {}).items():
+            setattr(config, FEE_OVERRIDES[key], float(value))
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+# --- 單次回測 ---
+
+def run_job(job: dict, data, asset_type: str, fees: dict | None = None, detail: bool = False) -> dict:
+    """在獨立的 HeadlessState 上執行一次回測並回傳結果列 (detail=True 時附帶交易紀錄與降採樣權益曲線)"""
+    t0 = time.perf_counter()
+    record = {'ticker': job['ticker'], 'asset_type': asset_type, 'seed': job['seed'],
+              'rule_index': job['rule_index'], 'strategy': job['rule']['strategy'],
+              'leverage': float(job['rule'].get('leverage', 1.0))}
+    regime = job.get('regime')
+    if regime:
+        record['regime'] = regime
+
+    try:
+        if data is None:
+            window = None
+        elif regime:
+            window = regimes.select_regime_window(job['ticker'], data, regime, job['seed'])
+        else:
+            window = logic.select_window(data, job['seed'])
+    except ValueError as e:
+        record['error'] = str(e)
+        return record
+    if window is None:
+        record['error'] = '資料不足或無法載入'
+        return record
+
+    state = logic.HeadlessState(ticker=job['ticker'], asset_type=asset_type)
+    with fee_overrides(fees), logic.bind_state(state):
+        logic.reset_state()
+        logic.start_simulation(window, asset_type, job['seed'])
+        equity = strategies.run_rule(state, job['rule'])
+
+    record.update(summarize_run(state, equity))
+    record['elapsed_ms'] = (time.perf_counter() - t0) * 1000
+    if detail:
+        record['detail'] = {'trades': trade_rows(state.transactions), 'equity': downsample(equity + [record['final_asset']])}
+    return record
+
+# --- 平行執行 (每個 worker 行程只接收一次資料) ---
+
+_worker_datasets = {}
+_worker_spec = {}
+
+def _init_worker(datasets, spec):
+    _worker_datasets.update(datasets)
+    _worker_spec.update(spec)
+
+def _run_in_worker(job):
+    return run_job(job, _worker_datasets.get(job['ticker']), _worker_spec.get('asset_type', 'Stock'),
+                   _worker_spec.get('fees'), _worker_spec.get('detail', False))
+
+# --- 輸出 ---
+
+class JsonlSink:
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ParquetSink:
+    """分批寫入 Parquet (需要 pyarrow)"""
+    def __init__(self, path, batch_size=256):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("輸出 Parquet 需要 pyarrow：pip install pyarrow")
+        self._pa, self._pq = pa, pq
+        self._path = path
+        self._writer = None
+        self._schema = None
+        self._buffer = []
+        self._batch_size = batch_size
+
+    def write(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer: return
+        if self._schema is None:
+            # 以第一批資料推斷 schema，並保證 error 欄位存在
+            rows = [{'error': None, **r} for r in self._buffer]
+            self._schema = self._pa.Table.from_pylist(rows).schema
+        table = self._pa.Table.from_pylist(self._buffer, schema=self._schema)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._path, self._schema)
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+class ResultsStoreSink:
+    """分批寫入 SQLite 結果庫 (每批一次交易)"""
+    def __init__(self, path, batch_size=500):
+        self._store = ResultsStore(path)
+        self._buffer = []
+        self._batch_size = batch_size
+
+    def write(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        self._store.add_runs(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._store.close()
+
+def open_sink(path: str):
+    return ParquetSink(path) if path.lower().endswith('.parquet') else JsonlSink(path)
+
+# --- 主流程 ---
+
+def run_batch(spec: dict, output: str, workers: int | None = None, db: str | None = None) -> dict:
+    """執行整批回測，結果逐筆串流寫入 output (與選用的結果庫 db)，回傳吞吐量統計"""
+    jobs = expand_jobs(spec)
+    asset_type = spec.get('asset_type', 'Stock')
+    workers = workers or spec.get('workers') or os.cpu_count() or 1
+
+    datasets = {}
+    for ticker in {job['ticker'] for job in jobs}:
+        datasets[ticker] = fetch_historical_data(ticker)
+        if datasets[ticker] is None:
+            print(f"⚠️ 無法載入 {ticker}", file=sys.stderr)
+        elif spec.get('windows', {}).get('regime'):
+            # 先建好情境索引並寫檔，worker 行程直接讀取
+            regimes.get_index(ticker, datasets[ticker])
+
+    sink = open_sink(output)
+    store_sink = ResultsStoreSink(db) if db else None
+    t0 = time.perf_counter()
+    done = 0
+
+    def emit(record):
+        nonlocal done
+        if store_sink is not None:
+            store_sink.write(record)
+        # 交易明細只寫進結果庫，輸出檔維持一列一次回測
+        sink.write({k: v for k, v in record.items() if k != 'detail'})
+        done += 1
+
+    try:
+        if workers <= 1:
+            for job in jobs:
+                emit(run_job(job, datasets.get(job['ticker']), asset_type, spec.get('fees'), detail=bool(db)))
+        else:
+            worker_spec = {'asset_type': asset_type, 'fees': spec.get('fees'), 'detail': bool(db)}
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(datasets, worker_spec)) as pool:
+                chunksize = max(1, len(jobs) // (workers * 8))
+                for record in pool.map(_run_in_worker, jobs, chunksize=chunksize):
+                    emit(record)
+                    if done % 100 == 0:
+                        elapsed = time.perf_counter() - t0
+                        print(f"  {done}/{len(jobs)} ({done / elapsed:,.1f} runs/sec)", file=sys.stderr)
+    finally:
+        sink.close()
+        if store_sink is not None:
+            store_sink.close()
+
+    elapsed = time.perf_counter() - t0
+    return {'runs': done, 'elapsed_sec': elapsed, 'runs_per_sec': done / elapsed if elapsed > 0 else 0.0, 'workers': workers}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 無頭批次回測")
+    parser.add_argument('spec', help="JSON / YAML 規格檔")
+    parser.add_argument('--workers', type=int, help="平行行程數 (預設為規格中的 workers 或 CPU 核心數)")
+    parser.add_argument('--output', help="輸出路徑 (.jsonl 或 .parquet)")
+    parser.add_argument('--db', help="同時寫入的 SQLite 結果庫 (見 results_store.py)")
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    output = args.output or spec.get('output', 'results.jsonl')
+    summary = run_batch(spec, output, args.workers, args.db or spec.get('db'))
+    print(f"✅ {summary['runs']} 次回測 / {summary['elapsed_sec']:.1f} 秒 = "
+          f"{summary['runs_per_sec']:,.1f} runs/sec ({summary['workers']} workers) → {output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
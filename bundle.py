@@ -0,0 +1,194 @@
+# bundle.py
+# 離線資料包 (Universe Bundle)：把多檔代碼的 OHLCV + 指標 (MA / RSI) 打包成版本化的欄式檔案
+#
+# 目錄結構：
+#   <root>/CURRENT                  目前使用的版本名稱
+#   <root>/<version>/manifest.json  格式版本、欄位、代碼索引 (offset / length / 日期範圍)
+#   <root>/<version>/<欄位>.npy      所有代碼依序串接的連續陣列，以 memory-map 讀取
+#   <root>/<version>/regimes/        各代碼的市場情境索引 (見 regimes.py)
+#
+# 用法：
+#   python bundle.py build <root> --tickers TSLA JPY=X BTC-USD --files data/*.csv data/*.parquet
+#   python bundle.py info <root>
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import config
+from data_manager import OHLCV_COLUMNS, add_indicators, download_ohlcv
+from regimes import RegimeIndex, index_filename
+
+FORMAT_VERSION = 1
+
+def bundle_columns():
+    """資料包欄位：與 fetch_historical_data 的輸出欄位一致"""
+    return OHLCV_COLUMNS + [f'MA{p}' for p in config.MA_PERIODS] + ['RSI']
+
+# --- 讀取 ---
+
+class Bundle:
+    """唯讀資料包：欄位以 np.load(mmap_mode='r') 開啟，取單一代碼只是切片，不複製資料"""
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.symbols = manifest['symbols']
+        self._columns = {}
+        self._frames = {}
+
+    @classmethod
+    def open(cls, root):
+        """開啟資料包：root 可以是版本目錄本身，或含 CURRENT 指標檔的上層目錄"""
+        path = root
+        current_file = os.path.join(root, 'CURRENT')
+        if os.path.exists(current_file):
+            with open(current_file, encoding='utf-8') as f:
+                path = os.path.join(root, f.read().strip())
+
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"不支援的資料包格式版本: {manifest.get('format_version')}")
+        return cls(path, manifest)
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+        return self._columns[name]
+
+    def frame(self, symbol):
+        """回傳該代碼的 DataFrame，各欄為 memory-map 陣列的唯讀切片 (zero-copy)"""
+        if symbol not in self._frames:
+            info = self.symbols[symbol]
+            start, end = info['offset'], info['offset'] + info['length']
+            columns = {name: self.column(name)[start:end] for name in self.manifest['columns']}
+            self._frames[symbol] = pd.DataFrame(columns, copy=False)
+        return self._frames[symbol]
+
+# --- 建立 ---
+
+def load_local_file(path: str) -> pd.DataFrame:
+    """讀取本地 CSV / Parquet，欄位名稱不分大小寫 (需含 Date, Open, High, Low, Close, Volume)"""
+    if path.lower().endswith('.parquet'):
+        raw = pd.read_parquet(path)  # 需要 pyarrow 或 fastparquet
+    else:
+        raw = pd.read_csv(path)
+
+    lookup = {str(c).strip().lower(): c for c in raw.columns}
+    missing = [c for c in OHLCV_COLUMNS if c.lower() not in lookup]
+    if missing:
+        raise ValueError(f"{path} 缺少欄位: {', '.join(missing)}")
+
+    data = raw[[lookup[c.lower()] for c in OHLCV_COLUMNS]].copy()
+    data.columns = OHLCV_COLUMNS
+    data['Date'] = pd.to_datetime(data['Date'])
+    return data.sort_values('Date').reset_index(drop=True)
+
+def build_bundle(root: str, sources: dict[str, pd.DataFrame]) -> str:
+    """
+    把 {代碼: OHLCV DataFrame} 寫成新版本的資料包並更新 CURRENT，回傳版本目錄
+    指標與市場情境索引在此一次算好，載入時不需重算
+    """
+    path, version = _new_version_dir(root)
+
+    columns = bundle_columns()
+    frames, symbols, offset = [], {}, 0
+    for symbol, raw in sorted(sources.items()):
+        data = add_indicators(raw[OHLCV_COLUMNS].copy())
+        if data.empty: continue
+        frames.append(data)
+        symbols[symbol] = {
+            'offset': offset, 'length': len(data),
+            'first_date': data['Date'].iloc[0].strftime('%Y-%m-%d'),
+            'last_date': data['Date'].iloc[-1].strftime('%Y-%m-%d'),
+        }
+        offset += len(data)
+        index = RegimeIndex.build(data)
+        if index is not None:
+            index.save(os.path.join(path, 'regimes', index_filename(symbol)))
+
+    for name in columns:
+        if name == 'Date':
+            arr = np.concatenate([f['Date'].to_numpy(dtype='datetime64[ns]') for f in frames]) if frames else np.array([], dtype='datetime64[ns]')
+        else:
+            arr = np.concatenate([f[name].to_numpy(dtype=np.float64) for f in frames]) if frames else np.array([], dtype=np.float64)
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(arr))
+
+    manifest = {
+        'format_version': FORMAT_VERSION, 'version': version,
+        'columns': columns, 'ma_periods': list(config.MA_PERIODS), 'symbols': symbols,
+    }
+    with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+    # 最後才切換 CURRENT，讀取端不會看到寫到一半的版本
+    # 暫存檔名各自獨立，同時建置時不會互相覆寫；CURRENT 指向最後完成的版本
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=root, prefix='CURRENT.', suffix='.tmp', delete=False) as f:
+        f.write(version)
+    os.replace(f.name, os.path.join(root, 'CURRENT'))
+    return path
+
+def _new_version_dir(root: str) -> tuple[str, str]:
+    """建立新的版本目錄 (時間戳記到微秒；同時建置撞名時加上流水號)，回傳 (路徑, 版本名稱)"""
+    os.makedirs(root, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    for n in range(1000):
+        version = stamp if n == 0 else f"{stamp}-{n}"
+        path = os.path.join(root, version)
+        try:
+            os.makedirs(path)
+            return path, version
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"無法建立資料包版本目錄: {root}/{stamp}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 離線資料包工具")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_build = sub.add_parser('build', help="建立新版本資料包")
+    p_build.add_argument('root', help="資料包根目錄")
+    p_build.add_argument('--tickers', nargs='*', default=[], help="從 Yahoo Finance 下載的代碼")
+    p_build.add_argument('--files', nargs='*', default=[], help="本地 CSV / Parquet (檔名即代碼)")
+
+    p_info = sub.add_parser('info', help="顯示資料包內容")
+    p_info.add_argument('root')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        bundle = Bundle.open(args.root)
+        print(f"版本 {bundle.manifest['version']} / {len(bundle.symbols)} 檔代碼")
+        for symbol, info in bundle.symbols.items():
+            print(f"  {symbol:<12} {info['first_date']} ~ {info['last_date']} ({info['length']} 筆)")
+        return 0
+
+    sources = {}
+    for ticker in args.tickers:
+        data = download_ohlcv(ticker)
+        if data is None:
+            print(f"⚠️ 無法下載 {ticker}，略過")
+            continue
+        sources[ticker.upper()] = data
+    for path in args.files:
+        symbol = os.path.splitext(os.path.basename(path))[0].upper()
+        sources[symbol] = load_local_file(path)
+
+    if not sources:
+        print("沒有任何資料來源")
+        return 1
+
+    os.makedirs(args.root, exist_ok=True)
+    path = build_bundle(args.root, sources)
+    print(f"✅ 已建立 {path} ({len(sources)} 檔代碼)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
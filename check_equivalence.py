@@ -0,0 +1,230 @@
+# check_equivalence.py
+# 差分等價檢查：產生大量隨機情境，讓 logic.py 的參考規則與各加速路徑並排執行，逐項比對結果
+#   batch   批次多帳戶引擎 (batch_engine.run_accounts) vs 逐帳戶 strategies.run_rule
+#           比對 最終資產 / ROI / 最大回撤 / 交易數 / 勝率 / 手續費 / 強平 / 根數
+#   stream  串流模擬 (streaming.StreamSession，增量指標 + 環形緩衝) vs strategies.run_rule
+#           比對 餘額 / 每筆交易紀錄 (含強平成交價與手續費) / 權益曲線
+#   rewind  逐根快照回溯 (logic.rewind_to) vs 從頭重跑：隨機操作序列 (開平倉、SL/TP 修改、移動止損、掛單 / OCO / 撤單、
+#           推進 1 / 10 天) 跑完後回到中途某根，狀態需與當時完全相同；再接著重放剩下的操作，結果需與原本一致
+#
+# 價格路徑為隨機種子的合成資料 (GBM / 跳躍擴散，見 synthetic.py)，資產類型、槓桿 (至 50x)、SL/TP、資金比例皆隨機
+# 任一差異超過浮點容差即列出情境編號與重現指令
+#
+# 用法：python check_equivalence.py [--scenarios 50] [--seed 0] [--engines batch stream rewind] [--tol 1e-9]
+#       python check_equivalence.py --engines rewind --seed 0 --scenario 17     (只重跑單一情境)
+# 專案沒有測試套件，此腳本可直接放進 CI (失敗時 exit code 為 1)
+
+import sys
+import copy
+import time
+import random
+import argparse
+import numpy as np
+import config
+import logic
+import strategies
+import batch_engine
+import streaming
+from results_store import summarize_run
+from synthetic import fetch_synthetic_data
+
+LEVERAGES = [1, 2, 3, 5, 10, 20]   # 上限為 config.MAX_LEVERAGE
+SUMMARY_KEYS = ('final_asset', 'roi', 'max_drawdown', 'n_trades', 'win_rate', 'total_fees', 'liquidated', 'bars')
+
+# --- 比對 ---
+
+def diff(expected, actual, tol: float, path: str = '') -> list[str]:
+    """遞迴比對 (dict / list / 數值)，浮點數以相對容差比較，回傳差異描述"""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if expected.keys() != actual.keys():
+            return [f"{path}: 欄位不同 {sorted(expected.keys() ^ actual.keys())}"]
+        return [d for key in expected for d in diff(expected[key], actual[key], tol, f"{path}.{key}")]
+    if isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)):
+        if len(expected) != len(actual):
+            return [f"{path}: 長度 {len(expected)} / {len(actual)}"]
+        return [d for i, (e, a) in enumerate(zip(expected, actual)) for d in diff(e, a, tol, f"{path}[{i}]")]
+    if isinstance(expected, (float, np.floating)) or isinstance(actual, (float, np.floating)):
+        if expected == actual or abs(expected - actual) <= tol * max(1.0, abs(expected)):
+            return []
+        return [f"{path}: 參考 {expected!r} / 加速 {actual!r}"]
+    return [] if expected == actual else [f"{path}: 參考 {expected!r} / 加速 {actual!r}"]
+
+def state_view(state) -> dict:
+    """比對用的帳戶狀態 (與回溯快照涵蓋的欄位相同)"""
+    return {
+        'sim_index': state.current_sim_index, 'sim_active': state.sim_active, 'balance': state.balance,
+        'positions': copy.deepcopy(state.positions), 'transactions': list(state.transactions),
+        'equity': list(state.equity_curve), 'orders': state.order_book.to_list(),
+        'position_seq': state.position_seq,
+    }
+
+# --- 隨機情境 ---
+
+def random_window(rng: random.Random):
+    """隨機合成價格路徑上的一段回測視窗"""
+    ticker = f"{config.SYNTHETIC_PREFIX}{rng.choice(['GBM', 'JUMP', 'JUMP'])}:{rng.randrange(10_000)}"
+    return ticker, logic.select_window(fetch_synthetic_data(ticker), rng.randrange(2 ** 32))
+
+def random_rule(rng: random.Random, strategy=None) -> dict:
+    return {
+        'strategy': strategy or rng.choice(list(strategies.RULES)),
+        'mode': rng.choice(list(config.TRADE_MODE_MAP)),
+        'leverage': float(rng.choice(LEVERAGES)),
+        'size_pct': float(rng.choice([10, 25, 50, 80, 100])),
+        'sl_pct': rng.choice([0.0, 0.0, round(rng.uniform(1, 10), 2)]),
+        'tp_pct': rng.choice([0.0, 0.0, round(rng.uniform(2, 20), 2)]),
+        'trail_pct': rng.choice([0.0, 0.0, round(rng.uniform(1, 8), 2)]),
+    }
+
+def reference_run(window, asset_type: str, rule: dict):
+    state = logic.HeadlessState(ticker='REF', asset_type=asset_type)
+    with logic.bind_state(state):
+        logic.reset_state()
+        logic.start_simulation(window, asset_type, 0)
+    equity = strategies.run_rule(state, rule)
+    return state, equity
+
+def random_action(state, rng: random.Random, asset_type: str):
+    """依目前狀態產生一個合理的使用者操作 (與 UI 送出的參數形式相同)"""
+    data, idx = state.core_data, state.current_sim_index
+    price = logic._bar_value(data, 'Open', idx)
+    min_qty = config.ASSET_CONFIGS[asset_type]['min_qty']
+    mode = rng.choice(list(config.TRADE_MODE_MAP))
+    leverage = float(rng.choice(LEVERAGES)) if config.TRADE_MODE_MAP[mode]['type'] == 'Margin' else 1.0
+    qty = strategies.position_size(state.balance, price, rng.choice([5, 20, 50]), leverage, config.LEVERAGE_FEE_RATE, min_qty)
+
+    roll = rng.random()
+    if roll < 0.45:
+        return ['next_day']
+    if roll < 0.55:
+        return ['next_ten_days']
+    if roll < 0.67 and qty > 0:
+        return ['open', mode, qty, price, leverage]
+    if roll < 0.77 and qty > 0:
+        order_type = rng.choice(['Limit', 'Stop'])
+        offset = rng.uniform(0.005, 0.08) * rng.choice([-1, 1])
+        return ['order', mode, order_type, qty, price * (1 + offset), leverage]
+    if roll < 0.81 and qty > 0:
+        span = rng.uniform(0.01, 0.1)
+        limit, stop = (price * (1 - span), price * (1 + span)) if rng.random() < 0.5 else (price * (1 + span), price * (1 - span))
+        return ['oco', mode, qty, limit, stop, leverage]
+    if roll < 0.84 and len(state.order_book):
+        return ['cancel_order', rng.choice([o['id'] for o in state.order_book])]
+    if state.positions:
+        pos = rng.choice(state.positions)
+        sign = 1.0 if config.TRADE_MODE_MAP[pos['pos_mode_key']]['direction'] == 'Long' else -1.0
+        if roll < 0.90:
+            sl = price * (1 - sign * rng.uniform(0.01, 0.15)) if rng.random() < 0.7 else 0.0
+            tp = price * (1 + sign * rng.uniform(0.01, 0.3)) if rng.random() < 0.7 else 0.0
+            return ['sl_tp', pos['id'], sl, tp]
+        if roll < 0.93:
+            return ['trail', pos['id'], round(rng.uniform(1, 10), 2)]
+        if roll < 0.99:
+            part = pos['qty'] if rng.random() < 0.6 else max(min_qty, np.floor(pos['qty'] / 2 / min_qty) * min_qty)
+            return ['close', pos['id'], float(part), price]
+        return ['close_all']
+    return ['next_day']
+
+# --- 各加速路徑的檢查 (回傳差異描述；空串列表示一致) ---
+
+def check_batch(rng: random.Random, tol: float) -> tuple[str, list[str]]:
+    ticker, window = random_window(rng)
+    asset_type = rng.choice(list(config.ASSET_CONFIGS))
+    rules = [random_rule(rng, 'buy_and_hold') for _ in range(rng.randint(4, 24))]
+    results = batch_engine.run_accounts(window, asset_type, batch_engine.make_params(rules))
+    for k, rule in enumerate(rules):
+        state, equity = reference_run(window, asset_type, rule)
+        expected = summarize_run(state, equity)
+        problems = [d for key in SUMMARY_KEYS for d in diff(expected[key], results[key][k].item(), tol, key)]
+        if problems:
+            return f"{ticker} {asset_type} 帳戶 {k} {rule}", problems
+    return f"{ticker} {asset_type} {len(rules)} 個帳戶", []
+
+def check_stream(rng: random.Random, tol: float) -> tuple[str, list[str]]:
+    ticker, window = random_window(rng)
+    asset_type = rng.choice(list(config.ASSET_CONFIGS))
+    rule = random_rule(rng)
+    label = f"{ticker} {asset_type} {rule}"
+    state, _ = reference_run(window, asset_type, rule)
+
+    session = streaming.StreamSession(ticker, asset_type, warmup=config.INITIAL_OBSERVATION_DAYS, rule=rule)
+    for bar in streaming.FrameSource(window):
+        session.on_bar(bar)
+    if session.live:
+        session.act('settle')
+
+    live = session.state
+    problems = diff(state.balance, live.balance, tol, 'balance')
+    problems += diff(list(state.transactions), list(live.transactions), tol, 'transactions')
+    # 串流的權益曲線只保留最近 capacity 點
+    tail = len(live.equity_curve)
+    problems += diff(list(state.equity_curve)[-tail:], list(live.equity_curve), tol, 'equity')
+    return label, problems
+
+def check_rewind(rng: random.Random, tol: float) -> tuple[str, list[str]]:
+    ticker, window = random_window(rng)
+    asset_type = rng.choice(list(config.ASSET_CONFIGS))
+    state = logic.HeadlessState(ticker=ticker, asset_type=asset_type)
+    with logic.bind_state(state):
+        logic.reset_state()
+        logic.start_simulation(window, asset_type, 0)
+        # 每次推進後 (使用者尚未操作) 的狀態都可作為回溯目標
+        script, checkpoints = [], [(0, state_view(state))]
+        for _ in range(rng.randint(20, 200)):
+            if not state.sim_active: break
+            script.append(random_action(state, rng, asset_type))
+            logic.perform_action(*script[-1])
+            if script[-1][0] in ('next_day', 'next_ten_days') and state.sim_active:
+                checkpoints.append((len(script), state_view(state)))
+        if state.sim_active:
+            script.append(['settle'])
+            logic.perform_action('settle')
+        final = state_view(state)
+
+        n_done, expected = rng.choice(checkpoints)
+        label = f"{ticker} {asset_type} {len(script)} 個操作，回溯到第 {expected['sim_index']} 根"
+        logic.rewind_to(expected['sim_index'])
+        problems = diff(expected, state_view(state), tol, 'rewound')
+        if problems:
+            return label, problems
+
+        # 回溯後重放剩下的操作，結果需與原本相同
+        for action in script[n_done:]:
+            logic.perform_action(*action)
+    return label, diff(final, state_view(state), tol, 'final')
+
+CHECKS = {'batch': check_batch, 'stream': check_stream, 'rewind': check_rewind}
+
+# --- 主流程 ---
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 加速路徑差分等價檢查")
+    parser.add_argument('--scenarios', type=int, default=50, help="每個加速路徑的隨機情境數")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', type=int, help="只執行此編號的情境 (重現用)")
+    parser.add_argument('--engines', nargs='+', choices=list(CHECKS), default=list(CHECKS))
+    parser.add_argument('--tol', type=float, default=1e-9, help="浮點相對容差")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for engine in args.engines:
+        t0 = time.perf_counter()
+        numbers = [args.scenario] if args.scenario is not None else range(args.scenarios)
+        for i in numbers:
+            label, problems = CHECKS[engine](random.Random(f"{engine}:{args.seed}:{i}"), args.tol)
+            if problems:
+                failures += 1
+                print(f"❌ {engine} 情境 {i}：{label}")
+                for line in problems[:10]:
+                    print(f"     {line}")
+                print(f"     重現：python check_equivalence.py --engines {engine} --seed {args.seed} --scenario {i}")
+        print(f"{engine}: {len(numbers)} 個情境 ({time.perf_counter() - t0:.1f} 秒)", flush=True)
+
+    if failures:
+        print(f"❌ {failures} 個情境不一致")
+        return 1
+    print("✅ 加速路徑與參考規則一致")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
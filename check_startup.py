@@ -0,0 +1,85 @@
+# check_startup.py
+# 冷啟動檢查：在乾淨的子行程中渲染首頁 (側邊欄代碼表單)，確認
+#   1. 沒有匯入 yfinance，也沒有建立任何 Plotly 圖表 (本專案未載入 plotly.graph_objects / plotly.subplots，頁面上沒有圖表元件)
+#      Streamlit 本身在匯入時就可能載入 plotly.graph_objects (註冊圖表主題)，這部分列為基準、不算本專案載入
+#   2. 本專案模組的匯入時間與首頁渲染時間都在預算內
+#
+# 用法：python check_startup.py [--import-budget 0.2] [--render-budget 5.0]
+# 專案沒有測試套件，此腳本可直接放進 CI (失敗時 exit code 為 1)
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# 不應出現在首頁的重量級模組
+HEAVY_MODULES = ('yfinance', 'plotly.graph_objects', 'plotly.subplots')
+
+_PROBE = r'''
+import sys, time, json
+# Streamlit 與其核心依賴 (pandas / numpy) 的匯入成本不計入本專案預算
+import streamlit, pandas, numpy
+from streamlit.testing.v1 import AppTest
+baseline = [m for m in HEAVY_MODULES if m in sys.modules]
+
+t0 = time.perf_counter()
+import config, data_manager, logic, charts
+import_time = time.perf_counter() - t0
+
+t0 = time.perf_counter()
+at = AppTest.from_file('app.py', default_timeout=60)
+at.run()
+render_time = time.perf_counter() - t0
+
+print(json.dumps({
+    'import_time': import_time,
+    'render_time': render_time,
+    'exception': [str(e.value) for e in at.exception],
+    'baseline': baseline,
+    'loaded': [m for m in HEAVY_MODULES if m in sys.modules and m not in baseline],
+    'charts': len(at.get('plotly_chart')),
+}))
+'''
+
+def run_probe() -> dict:
+    """在新的 Python 行程中量測 (避免沿用本行程已匯入的模組)"""
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n" + _PROBE
+    root = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run(
+        [sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 冷啟動預算檢查")
+    parser.add_argument('--import-budget', type=float, default=0.2, help="本專案模組匯入時間上限 (秒)")
+    parser.add_argument('--render-budget', type=float, default=5.0, help="首頁渲染時間上限 (秒)")
+    args = parser.parse_args(argv)
+
+    result = run_probe()
+    print(f"模組匯入: {result['import_time'] * 1000:.0f} ms (預算 {args.import_budget * 1000:.0f} ms)")
+    print(f"首頁渲染: {result['render_time'] * 1000:.0f} ms (預算 {args.render_budget * 1000:.0f} ms)")
+    if result['baseline']:
+        print(f"Streamlit 匯入時已載入 (不計): {', '.join(result['baseline'])}")
+
+    errors = []
+    if result['exception']:
+        errors.append(f"首頁執行錯誤: {result['exception']}")
+    if result['loaded']:
+        errors.append(f"首頁載入了重量級模組: {', '.join(result['loaded'])}")
+    if result['charts']:
+        errors.append(f"首頁建立了 {result['charts']} 個 Plotly 圖表")
+    if result['import_time'] > args.import_budget:
+        errors.append("模組匯入超出預算")
+    if result['render_time'] > args.render_budget:
+        errors.append("首頁渲染超出預算")
+
+    for e in errors:
+        print(f"❌ {e}")
+    if not errors:
+        print("✅ 冷啟動檢查通過")
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
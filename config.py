@@ -1,76 +1,140 @@
-# config.py
-# 用於存放全域常數、交易規則與設定
-
-# --- 回測參數 (Backtest Parameters) ---
-VIEW_DAYS = 100                # 圖表可視範圍 (天)：決定圖表預設顯示多寬，設 100 讓 K 線比較清楚
-INITIAL_OBSERVATION_DAYS = 250 # 初始觀察期 (天)：模擬開始前保留的天數 (為了讓 MA120 等長天期指標能算出來)
-
-MIN_SIMULATION_DAYS = 720      # 最少需要多少天數據才能跑模擬
-MA_PERIODS = [5, 10, 20, 60, 120]  # 移動平均線週期
-
-# --- 預設值 (Defaults) ---
-DEFAULT_TICKER = "TSLA"      # 預設載入的股票代號
-INITIAL_CAPITAL = 100000.0   # 初始本金 (USD)
-
-# --- 圖表顏色配置 (Moving Average Colors) ---
-MA_COLORS = {
-    5: 'lightgray', 
-    10: 'gray', 
-    20: 'red',      
-    60: 'blue',     
-    120: 'white'    
-}
-
-# --- 交易費率設定 (Transaction Fees) ---
-FEE_RATE = 0.005           # 現貨手續費 (0.5%)
-LEVERAGE_FEE_RATE = 0.01   # 槓桿手續費 (1%)
-MIN_MARGIN_RATE = 0.05     # 最小保證金比例 (5%)
-
-# --- 資產類型配置 (Asset Configurations) ---
-ASSET_CONFIGS = {
-    'Stock': {
-        'unit': '股', 
-        'mode_spot': '現貨',          
-        'mode_margin_long': '融資',   
-        'mode_margin_short': '融券',  
-        'default_qty': 1000.0, 
-        'min_qty': 1.0
-    }, 
-    'Forex': {
-        'unit': '點', 
-        'mode_spot': '現貨',          
-        'mode_margin_long': '做多',   
-        'mode_margin_short': '做空',  
-        'default_qty': 100.0, 
-        'min_qty': 100.0
-    }, 
-    'Crypto': {
-        'unit': '顆', 
-        'mode_spot': '現貨',          
-        'mode_margin_long': '合約做多', 
-        'mode_margin_short': '合約做空', 
-        'default_qty': 1.0, 
-        'min_qty': 0.001
-    }
-}
-
-# --- 輔助集合：用於邏輯判斷 ---
-LONG_MODES = {'現貨', '融資', '做多', '合約做多'}
-SHORT_MODES = {'融券', '做空', '合約做空'}
-LEVERAGE_MODES = {'融資', '融券', '做多', '做空', '合約做多', '合約做空'}
-
-# --- 交易模式映射表 ---
-TRADE_MODE_MAP = {
-    'Spot_Buy': {
-        'type': 'Spot', 
-        'direction': 'Long'
-    },
-    'Margin_Long': {
-        'type': 'Margin', 
-        'direction': 'Long'
-    },
-    'Margin_Short': {
-        'type': 'Margin', 
-        'direction': 'Short'
-    },
+# config.py
+# 用於存放全域常數、交易規則與設定
+
+import os
+
+# --- 回測參數 (Backtest Parameters) ---
+VIEW_DAYS = 100                # 圖表可視範圍 (天)：決定圖表預設顯示多寬，設 100 讓 K 線比較清楚
+INITIAL_OBSERVATION_DAYS = 250 # 初始觀察期 (天)：模擬開始前保留的天數 (為了讓 MA120 等長天期指標能算出來)
+
+MIN_SIMULATION_DAYS = 720      # 最少需要多少天數據才能跑模擬
+MA_PERIODS = [5, 10, 20, 60, 120]  # 移動平均線週期
+WARMUP_BARS = max(MA_PERIODS)  # 指標暖機所需的 K 線數 (最長均線)
+WINDOWED_FETCH = True          # Yahoo 代碼只下載抽中的回測區段 (+ 暖機)，不下載完整歷史
+
+SINGLE_FLIGHT_TTL = 30.0       # 同時下載合併：完成的下載結果保留秒數，緊接著的相同請求直接共用
+
+# --- 預設值 (Defaults) ---
+DEFAULT_TICKER = "TSLA"      # 預設載入的股票代號
+INITIAL_CAPITAL = 100000.0   # 初始本金 (USD)
+
+# --- API 伺服器 (api_server.py) ---
+API_HOST = '127.0.0.1'
+API_PORT = 8600
+API_MAX_SESSIONS = 2000        # 同時存在的 session 上限
+API_SESSION_TTL = 1800         # 閒置多久 (秒) 後回收 session
+API_OFFLOAD_DAYS = 50          # 一次推進超過此天數時交給 worker 行程池執行，避免卡住事件迴圈
+API_MAX_DATASETS = 32          # 共用價格資料最多保留幾個代碼 (超過時移除最久未使用的)
+
+# --- 本地資料包 (Offline Bundle) ---
+BUNDLE_DIR = os.environ.get('KSIM_BUNDLE_DIR')  # 由 bundle.py 建立；設定後優先從本地資料包載入 (離線 / CI)
+
+# --- 代碼目錄 (symbols.py) ---
+SYMBOL_DIRECTORY = os.environ.get('KSIM_SYMBOLS', 'ksim_symbols.json')  # 本地代碼目錄檔 (自動完成、資產類型預選)；空字串則只用內建清單
+SYMBOL_STRICT = False          # True：只接受目錄中的代碼 (完全不對未知代碼發出下載)
+
+# --- 合成資料 (synthetic.py) ---
+SYNTHETIC_PREFIX = 'SYN:'      # 代碼以此開頭時改用合成資料，例如 SYN:GBM:7、SYN:JUMP、SYN:BOOT:TSLA
+SYNTHETIC_BARS = 5000          # 每個合成代碼產生的日線數量
+SYNTHETIC_START = '1990-01-01' # 合成資料的起始日期
+
+# --- 市場情境索引 (regimes.py) ---
+REGIME_DIR = os.environ.get('KSIM_REGIME_DIR', 'ksim_regimes')  # 情境索引 (.npz) 存放目錄 (本地資料包代碼改存在資料包內)；空字串則只保留在記憶體
+REGIME_QUANTILE = 0.9          # 各情境取該代碼歷史中最極端的 10% 視窗 (回撤 / 報酬 / 波動)
+REGIME_CRASH_DRAWDOWN = 0.25   # 崩盤：模擬期最大回撤至少 25%
+REGIME_RALLY_RETURN = 0.30     # 大漲：模擬期總報酬至少 +30%
+REGIME_MAX_AGE_DAYS = 7        # 只下載回測區段時沿用既有索引的天數，過期後重新下載完整歷史重建
+
+# --- SL/TP 假設分析 (outcomes.py) ---
+OUTCOME_GRID_SIZE = 50             # 止損 / 止盈各取幾個百分比 (網格為 N × N)
+OUTCOME_SL_RANGE = (0.5, 25.0)     # 止損距離範圍 (%)
+OUTCOME_TP_RANGE = (0.5, 50.0)     # 止盈距離範圍 (%)
+
+# --- 盤中路徑判定 (intrabar.py) ---
+INTRABAR_RESOLUTION = False    # True：同一根日線同時觸及多個出場價時，載入當天盤中 K 線判定先觸及哪一個 (False 則固定 強平 → 止損 → 止盈)
+INTRABAR_INTERVAL = '1h'       # Yahoo 盤中週期 (1h 約保留最近 730 天，更細的週期保留更短)
+INTRABAR_CACHE_SIZE = 4096     # 記憶體中保留的 (代碼, 日期) 盤中資料筆數
+INTRABAR_SYNTHETIC_STEPS = 78  # 合成代碼每天模擬的盤中步數 (約等於 5 分鐘線)
+
+# --- 背景工作 (jobs.py) ---
+JOB_WORKERS = None             # 背景工作行程池大小 (None = CPU 核心數)
+JOB_MAX_PER_USER = 2           # 每位使用者同時執行的工作數，其餘排隊
+JOB_MAX_QUEUED = 5             # 每位使用者未完成 (執行中 + 排隊) 的工作上限
+JOB_CHUNKS_IN_FLIGHT = 2       # 每個工作同時送進行程池的塊數 (讓多個工作交錯執行)
+JOB_RETENTION_SECONDS = 600    # 已結束的工作保留多久 (秒) 供 UI 讀取結果
+JOB_POLL_SECONDS = 1.0         # UI 輪詢進度的間隔 (秒)
+JOB_FAST_FORWARD_CHUNK = 20    # 背景快轉每塊推進的天數
+JOB_SWEEP_CHUNK = 4            # 參數掃描每塊執行的規則數
+
+# --- 串流模擬 (streaming.py) ---
+STREAM_BUFFER_BARS = 500       # 串流模式在記憶體中保留的最近 K 線數 (環形緩衝)，需大於 WARMUP_BARS + VIEW_DAYS
+STREAM_MAX_RECORDS = 1000      # 交易紀錄 / 操作日誌最多保留的筆數 (長時間執行時不持續成長)
+
+# --- 回測結果資料庫 (Results Store) ---
+RESULTS_DB = os.environ.get('KSIM_RESULTS_DB', 'ksim_results.db')  # 每次回測結束後寫入的 SQLite 檔；設為空字串則停用
+RESULTS_EQUITY_POINTS = 200            # 權益曲線降採樣後保留的點數
+LEVERAGE_BUCKETS = [1, 2, 5, 10, 20]   # 跨回測統計的槓桿分組 (各組下界)
+
+# --- 圖表顏色配置 (Moving Average Colors) ---
+MA_COLORS = {
+    5: 'lightgray', 
+    10: 'gray', 
+    20: 'red',      
+    60: 'blue',     
+    120: 'white'    
+}
+
+# --- 交易費率設定 (Transaction Fees) ---
+FEE_RATE = 0.005           # 現貨手續費 (0.5%)
+LEVERAGE_FEE_RATE = 0.01   # 槓桿手續費 (1%)
+MIN_MARGIN_RATE = 0.05     # 最小保證金比例 (5%)
+MAX_LEVERAGE = 20.0        # 槓桿倍數上限 (槓桿模式可用 1 ~ 20 倍；現貨一律 1 倍)
+
+# --- 資產類型配置 (Asset Configurations) ---
+ASSET_CONFIGS = {
+    'Stock': {
+        'unit': '股', 
+        'mode_spot': '現貨',          
+        'mode_margin_long': '融資',   
+        'mode_margin_short': '融券',  
+        'default_qty': 1000.0, 
+        'min_qty': 1.0
+    }, 
+    'Forex': {
+        'unit': '點', 
+        'mode_spot': '現貨',          
+        'mode_margin_long': '做多',   
+        'mode_margin_short': '做空',  
+        'default_qty': 100.0, 
+        'min_qty': 100.0
+    }, 
+    'Crypto': {
+        'unit': '顆', 
+        'mode_spot': '現貨',          
+        'mode_margin_long': '合約做多', 
+        'mode_margin_short': '合約做空', 
+        'default_qty': 1.0, 
+        'min_qty': 0.001
+    }
+}
+
+# --- 輔助集合：用於邏輯判斷 ---
+LONG_MODES = {'現貨', '融資', '做多', '合約做多'}
+SHORT_MODES = {'融券', '做空', '合約做空'}
+LEVERAGE_MODES = {'融資', '融券', '做多', '做空', '合約做多', '合約做空'}
+
+# --- 交易模式映射表 ---
+TRADE_MODE_MAP = {
+    'Spot_Buy': {
+        'type': 'Spot', 
+        'direction': 'Long'
+    },
+    'Margin_Long': {
+        'type': 'Margin', 
+        'direction': 'Long'
+    },
+    'Margin_Short': {
+        'type': 'Margin', 
+        'direction': 'Short'
+    },
 }
\ No newline at end of file
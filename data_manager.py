@@ -1,103 +1,268 @@
-# data_manager.py
-# 負責獲取 Yahoo Finance 數據與計算技術指標
-
-import yfinance as yf
-import pandas as pd
-import streamlit as st
-from datetime import datetime
-import random
-import config  # 導入配置檔
-
-# --- 技術指標計算 ---
-
-def calculate_rsi(data: pd.DataFrame, window: int = 14) -> pd.Series:
-    """計算 RSI (Wilder's Smoothing)"""
-    delta = data['Close'].diff()
-    gain = (delta.where(delta > 0, 0))
-    loss = (-delta.where(delta < 0, 0))
-    
-    avg_gain = gain.ewm(com=window - 1, min_periods=window).mean()
-    avg_loss = loss.ewm(com=window - 1, min_periods=window).mean()
-    
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
-
-# --- 資料獲取與處理 (ETL) ---
-
-@st.cache_data(ttl=3600, show_spinner="📈 正在載入並計算指標 (MA, RSI)...")
-def fetch_historical_data(ticker: str = "TSLA") -> pd.DataFrame | None:
-    """從 Yahoo Finance 下載歷史數據並進行預處理"""
-    period = 'max'
-
-    try:
-        data = yf.download(ticker.upper(), period=period, interval='1d', progress=False)
-        
-        if data.empty:
-            return None
-            
-        data = data[['Open', 'High', 'Low', 'Close', 'Volume']].reset_index()
-        data.columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-        data['Date'] = pd.to_datetime(data['Date'])
-        
-        for p in config.MA_PERIODS:
-            data[f'MA{p}'] = data['Close'].rolling(window=p).mean()
-            
-        data['RSI'] = calculate_rsi(data, window=14)
-        
-        data.dropna(inplace=True) 
-        data = data.reset_index(drop=True)
-        return data
-
-    except Exception as e:
-        st.error(f"數據載入錯誤: {e}")
-        return None
-    
-# --- 模擬輔助函式 ---
-
-def select_random_start_index(data: pd.DataFrame) -> tuple[int, int] | None:
-    """
-    隨機挑選一段歷史區間
-    """
-    total_days = len(data)
-    
-    # 計算需要的最少總天數 = 觀察期 + 模擬期
-    required_days = config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
-    
-    if total_days < config.INITIAL_OBSERVATION_DAYS:
-         return None
-         
-    # 如果資料剛好只夠跑一點點
-    if total_days < required_days:
-        max_start_index = total_days - config.INITIAL_OBSERVATION_DAYS
-        start_view_index = 0
-        # 模擬起始點 = 起始索引 + 觀察期
-        sim_start_index = start_view_index + config.INITIAL_OBSERVATION_DAYS
-        
-        return start_view_index, sim_start_index
-    
-    # 正常情況
-    max_start_index = total_days - required_days
-    
-    start_view_index = random.randint(0, max_start_index)
-    sim_start_index = start_view_index + config.INITIAL_OBSERVATION_DAYS
-    
-    return start_view_index, sim_start_index
-
-def get_price_info_by_index(data: pd.DataFrame, index: int) -> tuple[datetime, float, float]:
-    """根據索引取得某一天的價格資訊"""
-    if data is not None and index < len(data):
-        current_row = data.iloc[index]
-        
-        date_timestamp = current_row['Date']
-        if isinstance(date_timestamp, pd.Series):
-             date_timestamp = date_timestamp.iloc[0]
-        
-        date = pd.to_datetime(date_timestamp).to_pydatetime()
-        
-        open_price = current_row['Open'].item() if hasattr(current_row['Open'], 'item') else current_row['Open']
-        close_price = current_row['Close'].item() if hasattr(current_row['Close'], 'item') else current_row['Close']
-        
-        return date, open_price, close_price
-
-    return datetime.now(), 0.0, 0.0
+# data_manager.py
+# 負責獲取 Yahoo Finance 數據與計算技術指標
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from datetime import datetime
+import functools
+import random
+import threading
+import time
+from concurrent.futures import Future
+import config  # 導入配置檔
+
+# --- 技術指標計算 ---
+
+def calculate_rsi(data: pd.DataFrame, window: int = 14) -> pd.Series:
+    """計算 RSI (Wilder's Smoothing)"""
+    delta = data['Close'].diff()
+    gain = (delta.where(delta > 0, 0))
+    loss = (-delta.where(delta < 0, 0))
+    
+    avg_gain = gain.ewm(com=window - 1, min_periods=window).mean()
+    avg_loss = loss.ewm(com=window - 1, min_periods=window).mean()
+    
+    rs = avg_gain / avg_loss
+    rsi = 100 - (100 / (1 + rs))
+    return rsi
+
+# --- 資料獲取與處理 (ETL) ---
+
+OHLCV_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+def add_indicators(data: pd.DataFrame) -> pd.DataFrame:
+    """計算 MA / RSI 並移除指標暖機期 (輸入需含 OHLCV_COLUMNS)"""
+    for p in config.MA_PERIODS:
+        data[f'MA{p}'] = data['Close'].rolling(window=p).mean()
+        
+    data['RSI'] = calculate_rsi(data, window=14)
+    
+    data.dropna(inplace=True) 
+    data = data.reset_index(drop=True)
+    return data
+
+# --- 同時下載合併 (Single-flight) ---
+# 多個 session 同時選了同一檔代碼 (例如開盤時)，st.cache_data 寫入前的 cache miss 會各自發出 yf.download
+# 這裡以行程為範圍合併：相同 (代碼, 週期, 區間) 只有第一個請求真的下載，其餘等待並共用解析後的結果
+
+class SingleFlight:
+    """
+    do(key, fn)：同一 key 同時只執行一次 fn，其餘呼叫等待同一個結果 (例外也一併傳給等待者)
+    完成後的結果保留 ttl 秒，緊接著到達的請求直接取用；回傳的 DataFrame 都是複本，呼叫端可自由修改
+    統計：requests / hits (取用剛完成的結果) / misses (實際下載) / coalesced (等待進行中的下載) / errors
+    """
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calls = {}     # key -> 進行中的 Future
+        self._recent = {}    # key -> (完成時間, 結果)
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    @staticmethod
+    def _share(result):
+        return result.copy() if isinstance(result, pd.DataFrame) else result
+
+    def do(self, key, fn):
+        with self._lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            recent = self._recent.get(key)
+            if recent is not None and now - recent[0] <= self.ttl:
+                self.stats['hits'] += 1
+                return self._share(recent[1])
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            return self._share(call.result())
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self.stats['errors'] += 1
+                del self._calls[key]
+            call.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._calls[key]
+            if self.ttl > 0:
+                self._recent = {k: v for k, v in self._recent.items() if now - v[0] <= self.ttl}
+                self._recent[key] = (time.monotonic(), result)
+        call.set_result(result)
+        return self._share(result)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, 'in_flight': len(self._calls)}
+
+_download_flight = SingleFlight(ttl=config.SINGLE_FLIGHT_TTL)
+
+def download_stats() -> dict:
+    """下載合併的統計 (供監控：API 伺服器 GET /stats)"""
+    return _download_flight.snapshot()
+
+def download_ohlcv(ticker: str, **kwargs) -> pd.DataFrame | None:
+    """從 Yahoo Finance 下載 (預設日線、完整歷史) 並整理成 OHLCV_COLUMNS 格式 (未計算指標)；同時的相同請求只下載一次"""
+    if 'start' not in kwargs:
+        kwargs.setdefault('period', 'max')
+    kwargs.setdefault('interval', '1d')
+    key = (ticker.upper(), tuple(sorted(kwargs.items())))
+    return _download_flight.do(key, lambda: _download_ohlcv(ticker, **kwargs))
+
+def _download_ohlcv(ticker: str, **kwargs) -> pd.DataFrame | None:
+    import yfinance as yf  # 延遲載入：首頁不需要 yfinance，省下冷啟動的匯入時間
+    data = yf.download(ticker.upper(), progress=False, **kwargs)
+    
+    if data.empty:
+        return None
+        
+    data = data[['Open', 'High', 'Low', 'Close', 'Volume']].reset_index()
+    data.columns = OHLCV_COLUMNS
+    data['Date'] = pd.to_datetime(data['Date'])
+    return data
+
+@functools.lru_cache(maxsize=None)
+def _load_bundle(path: str):
+    from bundle import Bundle
+    return Bundle.open(path)
+
+def get_bundle():
+    """取得設定中的本地資料包 (config.BUNDLE_DIR)，未設定則回傳 None"""
+    return _load_bundle(config.BUNDLE_DIR) if config.BUNDLE_DIR else None
+
+def uses_local_data(ticker: str) -> bool:
+    """合成代碼與本地資料包內的代碼不需連網，直接從完整資料截取即可"""
+    if ticker.upper().startswith(config.SYNTHETIC_PREFIX):
+        return True
+    bundle = get_bundle()
+    return bundle is not None and ticker.upper() in bundle
+
+def fetch_historical_data(ticker: str = "TSLA") -> pd.DataFrame | None:
+    """取得歷史數據：合成代碼 (SYN:...) 由 synthetic.py 產生；其餘優先由本地資料包 (memory-mapped) 提供，否則從 Yahoo Finance 下載"""
+    if ticker.upper().startswith(config.SYNTHETIC_PREFIX):
+        from synthetic import fetch_synthetic_data
+        return fetch_synthetic_data(ticker.upper())
+    bundle = get_bundle()
+    if bundle is not None and ticker.upper() in bundle:
+        return bundle.frame(ticker.upper())
+    return _download_historical_data(ticker)
+
+@st.cache_data(ttl=3600, show_spinner="📈 正在載入並計算指標 (MA, RSI)...")
+def _download_historical_data(ticker: str) -> pd.DataFrame | None:
+    """從 Yahoo Finance 下載歷史數據並進行預處理"""
+    try:
+        data = download_ohlcv(ticker)
+        if data is None:
+            return None
+        return add_indicators(data)
+
+    except Exception as e:
+        st.error(f"數據載入錯誤: {e}")
+        return None
+
+# --- 視窗下載 (只下載回測區段) ---
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def fetch_date_range(ticker: str) -> tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    取得代碼可用的日期範圍 (以月線查詢，資料量約為日線的 1/20)
+    連線錯誤與空結果都直接丟出，不寫入快取：yfinance 遇到限流 / 暫時性錯誤時回傳空資料而非例外，
+    若把空結果快取一天，這段期間該代碼每次都得改下載完整歷史
+    """
+    data = download_ohlcv(ticker, interval='1mo')
+    if data is None or data.empty:
+        raise ValueError(f"查無 {ticker} 的日期範圍")
+    return data['Date'].iloc[0], data['Date'].iloc[-1]
+
+def pick_window_start(date_range, rng: random.Random, n_bars: int) -> pd.Timestamp | None:
+    """
+    在日期範圍內隨機挑選回測起點，保留前方的指標暖機與後方的 n_bars 根 K 線
+    以工作日估算 (再多留假日與月線邊界的餘裕)，範圍不夠時回傳 None
+    """
+    first, last = date_range
+    earliest = np.busday_offset(first.date(), config.WARMUP_BARS + 25, roll='forward')
+    latest = np.busday_offset(last.date(), -(int(n_bars * 1.05) + 5), roll='backward')
+    span = int(np.busday_count(earliest, latest))
+    if span < 0:
+        return None
+    return pd.Timestamp(np.busday_offset(earliest, rng.randint(0, span), roll='forward'))
+
+@st.cache_data(ttl=3600, show_spinner="📈 正在載入回測區段並計算指標 (MA, RSI)...")
+def fetch_window_data(ticker: str, start_date: str, n_bars: int) -> pd.DataFrame | None:
+    """
+    只下載 start_date 起的 n_bars 根日線 (前面多下載 WARMUP_BARS 根供指標暖機)
+    回傳從 start_date (或其後第一個交易日) 開始、已計算指標的資料
+    """
+    start = pd.Timestamp(start_date)
+    fetch_start = start - pd.Timedelta(days=int(config.WARMUP_BARS * 1.6) + 15)
+    fetch_end = start + pd.Timedelta(days=int(n_bars * 1.5) + 20)
+    try:
+        data = download_ohlcv(ticker, start=fetch_start.strftime('%Y-%m-%d'), end=fetch_end.strftime('%Y-%m-%d'))
+        if data is None:
+            return None
+        data = add_indicators(data)
+    except Exception as e:
+        st.error(f"數據載入錯誤: {e}")
+        return None
+
+    data = data[data['Date'] >= start].iloc[:n_bars].reset_index(drop=True)
+    return data if not data.empty else None
+    
+# --- 模擬輔助函式 ---
+
+def select_random_start_index(data: pd.DataFrame, rng: random.Random | None = None) -> tuple[int, int] | None:
+    """
+    隨機挑選一段歷史區間
+    rng: 指定亂數產生器 (帶種子即可重現)，預設使用全域 random
+    """
+    rng = rng or random
+    total_days = len(data)
+    
+    # 計算需要的最少總天數 = 觀察期 + 模擬期
+    required_days = config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
+    
+    if total_days < config.INITIAL_OBSERVATION_DAYS:
+         return None
+         
+    # 如果資料剛好只夠跑一點點
+    if total_days < required_days:
+        max_start_index = total_days - config.INITIAL_OBSERVATION_DAYS
+        start_view_index = 0
+        # 模擬起始點 = 起始索引 + 觀察期
+        sim_start_index = start_view_index + config.INITIAL_OBSERVATION_DAYS
+        
+        return start_view_index, sim_start_index
+    
+    # 正常情況
+    max_start_index = total_days - required_days
+    
+    start_view_index = rng.randint(0, max_start_index)
+    sim_start_index = start_view_index + config.INITIAL_OBSERVATION_DAYS
+    
+    return start_view_index, sim_start_index
+
+def get_price_info_by_index(data: pd.DataFrame, index: int) -> tuple[datetime, float, float]:
+    """根據索引取得某一天的價格資訊"""
+    if data is not None and index < len(data):
+        current_row = data.iloc[index]
+        
+        date_timestamp = current_row['Date']
+        if isinstance(date_timestamp, pd.Series):
+             date_timestamp = date_timestamp.iloc[0]
+        
+        date = pd.to_datetime(date_timestamp).to_pydatetime()
+        
+        open_price = current_row['Open'].item() if hasattr(current_row['Open'], 'item') else current_row['Open']
+        close_price = current_row['Close'].item() if hasattr(current_row['Close'], 'item') else current_row['Close']
+        
+        return date, open_price, close_price
+
+    return datetime.now(), 0.0, 0.0
@@ -0,0 +1,105 @@
+# intrabar.py
+# 盤中路徑判定：同一根日線同時觸及多個出場價 (止損 + 止盈、強平 + 止盈...) 時，日線的高低點看不出先後
+# 開啟 config.INTRABAR_RESOLUTION 後，logic.check_sl_tp_trigger 只在這種少數日子向這裡查詢，
+# 按需載入當天的盤中 K 線 (依 (代碼, 日期) 快取)，找出第一個被觸及的價位；整段視窗不需要盤中資料
+#
+# 盤中資料來源：
+#   Yahoo 代碼    下載當天的 config.INTRABAR_INTERVAL K 線 (Yahoo 只保留近期的盤中資料，較舊的日子取不到)
+#   合成代碼      沒有真實盤中資料：以 代碼 + 日期 為種子，產生一條通過當日 開 → 高 / 低 → 收 的路徑
+#   本地資料包    離線使用，不連網
+# 取不到資料、或盤中同一根 K 線仍同時觸及 (跳空) 時回傳 None，由呼叫端沿用日線的優先順序
+#
+# 用法：
+#   choice = intrabar.resolve('TSLA', date, (open, high, low, close), [(sl, True), (tp, False)])
+#   # levels 為 (價位, 是否向下觸及)；回傳最先觸及的索引或 None
+
+import zlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import config
+from data_manager import download_ohlcv, get_bundle
+
+_cache = OrderedDict()   # (代碼, 日期) -> (highs, lows) 或 None，最近使用的在最後
+_cache_lock = threading.Lock()
+stats = {'lookups': 0, 'loads': 0, 'resolved': 0, 'unresolved': 0}
+
+def _day(date) -> str:
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+def synthetic_path(ticker: str, day: str, bar) -> tuple[np.ndarray, np.ndarray]:
+    """
+    合成代碼的盤中路徑 (可重現)：隨機決定先到高點或低點及其時間，各段以布朗橋連接並限制在當日高低範圍內
+    回傳每一步的 (高, 低)
+    """
+    open_, high, low, close = bar
+    n = config.INTRABAR_SYNTHETIC_STEPS
+    rng = np.random.default_rng(zlib.crc32(f"{ticker}|{day}".encode()))
+    t1, t2 = np.sort(rng.choice(np.arange(1, n), size=2, replace=False))
+    first, second = (high, low) if rng.random() < 0.5 else (low, high)
+
+    knots_t, knots_p = [0, t1, t2, n], [open_, first, second, close]
+    path = np.interp(np.arange(n + 1), knots_t, knots_p)
+    noise = rng.normal(0.0, (high - low) * 0.05, n + 1).cumsum()
+    # 布朗橋：每段扣除端點間的線性漂移，節點上的雜訊歸零
+    for a, b in zip(knots_t[:-1], knots_t[1:]):
+        seg = np.arange(a, b + 1)
+        path[seg] += noise[seg] - np.interp(seg, [a, b], [noise[a], noise[b]])
+    path = np.clip(path, low, high)
+    return np.maximum(path[:-1], path[1:]), np.minimum(path[:-1], path[1:])
+
+def _load(ticker: str, day: str, bar):
+    if ticker.startswith(config.SYNTHETIC_PREFIX):
+        return synthetic_path(ticker, day, bar)
+    bundle = get_bundle()
+    if bundle is not None and ticker in bundle:
+        return None
+    start = pd.Timestamp(day)
+    try:
+        data = download_ohlcv(ticker, start=day, end=(start + pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+                              interval=config.INTRABAR_INTERVAL)
+    except Exception:
+        return None
+    if data is None or data.empty:
+        return None
+    return data['High'].to_numpy(dtype=float), data['Low'].to_numpy(dtype=float)
+
+def intraday_bars(ticker: str, date, bar=None) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    取得某代碼某一天的盤中 (高, 低) 序列，依 (代碼, 日期) 快取 (取不到的結果也快取，離線時不重複嘗試)
+    bar: 當天日線的 (開, 高, 低, 收)，合成代碼產生路徑時使用
+    """
+    key = (ticker.upper(), _day(date))
+    with _cache_lock:
+        stats['lookups'] += 1
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    bars = _load(*key, bar)
+    with _cache_lock:
+        stats['loads'] += 1
+        _cache[key] = bars
+        while len(_cache) > config.INTRABAR_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return bars
+
+def first_touch(highs: np.ndarray, lows: np.ndarray, levels: list[tuple[float, bool]]) -> int | None:
+    """levels 中最先被觸及的索引；都沒觸及，或最早的那一根同時觸及多個價位時回傳 None"""
+    n = len(highs)
+    touches = []
+    for price, below in levels:
+        hit = lows <= price if below else highs >= price
+        touches.append(int(hit.argmax()) if hit.any() else n)
+    earliest = min(touches)
+    if earliest == n or touches.count(earliest) > 1:
+        return None
+    return touches.index(earliest)
+
+def resolve(ticker: str, date, bar, levels: list[tuple[float, bool]]) -> int | None:
+    """以盤中路徑判定同一根日線觸及的多個出場價中哪一個先發生；無法判定時回傳 None"""
+    bars = intraday_bars(ticker, date, bar)
+    choice = first_touch(*bars, levels) if bars is not None else None
+    with _cache_lock:
+        stats['resolved' if choice is not None else 'unresolved'] += 1
+    return choice
@@ -0,0 +1,285 @@
+# jobs.py
+# 背景工作佇列：把 UI 觸發的重計算 (長距離快轉、策略掃描、批次下載...) 交給行程池，Streamlit 腳本執行緒不被阻塞
+#
+# 工作切成小塊送進共用的行程池，每個工作同時最多 config.JOB_CHUNKS_IN_FLIGHT 塊在池中：
+#   map    各塊獨立 (掃描、下載)，每完成一塊就多一筆部分結果
+#   chain  各塊依序相依 (快轉)：上一塊的輸出是下一塊的輸入
+# 進度 = 已完成塊數 / 總塊數；取消只是不再送出後續的塊 (已在執行的那一塊跑完後結果直接丟棄)
+# 多個工作的塊交錯進入行程池，大工作不會卡住其他人；每位使用者同時執行的工作數上限為 config.JOB_MAX_PER_USER，其餘排隊
+# UI 端只保留工作 id，由 st.fragment 定時輪詢 get_manager().get(id) 的進度與部分結果
+#
+# 用法：
+#   manager = jobs.get_manager()
+#   job = manager.submit_map(owner, "策略掃描", jobs.run_rules_chunk, chunks, args=(jobs.window_key(ticker, window), 'Stock'))
+#   job.progress, job.partial_results(), job.cancel()
+
+import os
+import sys
+import time
+import types
+import uuid
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+import logic
+import strategies
+from replay import load_logged_window
+from results_store import summarize_run
+
+FINISHED = ('done', 'cancelled', 'error')
+
+# Streamlit 伺服器是多執行緒行程，不直接 fork，改用 forkserver (不支援時用 spawn)
+_BASE_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+class _WorkerProcess(_BASE_CONTEXT.Process):
+    """
+    行程池的 worker 行程：Streamlit 把執行中的 app.py 登記為 __main__，spawn / forkserver 的子行程會重新執行它；
+    啟動子行程的瞬間換成空的主模組，子行程只匯入工作函式所在的模組
+    """
+    def start(self):
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            super().start()
+        finally:
+            sys.modules['__main__'] = main
+
+class _WorkerContext(type(_BASE_CONTEXT)):
+    Process = _WorkerProcess
+
+class Job:
+    """單一背景工作的狀態 (由 JobManager 在鎖內更新，UI 只讀取)"""
+    def __init__(self, manager, owner, label, fn, args, items=None, carry=None, steps=0, until=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.owner = owner
+        self.label = label
+        self.kind = 'map' if items is not None else 'chain'
+        self.total = len(items) if items is not None else steps
+        self.done = 0
+        self.status = 'queued'
+        self.error = None
+        self.results = {}      # map：塊編號 -> 結果
+        self.carry = carry     # chain：目前的中間結果
+        self.created_at = time.time()
+        self.finished_at = None
+        self._manager = manager
+        self._fn, self._args = fn, args
+        self._items = list(items) if items is not None else None
+        self._next = 0
+        self._in_flight = set()
+        self._until = until
+
+    @property
+    def progress(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def partial_results(self) -> list:
+        """map 工作目前已完成的各塊結果 (依塊的順序)"""
+        with self._manager._lock:
+            return [self.results[i] for i in sorted(self.results)]
+
+    def result(self):
+        return self.partial_results() if self.kind == 'map' else self.carry
+
+    def cancel(self):
+        self._manager.cancel(self.id)
+
+class JobManager:
+    def __init__(self, workers=None):
+        self.workers = workers or config.JOB_WORKERS or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.RLock()  # 已完成的 future 會在 submit 的執行緒內直接呼叫回呼
+        self._jobs = {}
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_WorkerContext())
+        return self._pool
+
+    def close(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished:
+                    self._finish(job, 'cancelled')
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- 提交 ---
+
+    def submit_map(self, owner, label, fn, items, args=()) -> Job:
+        """fn(item, *args) 對每個 item 各執行一次 (item 通常是一小批參數)"""
+        return self._add(Job(self, owner, label, fn, args, items=items))
+
+    def submit_chain(self, owner, label, fn, carry, steps, args=(), until=None) -> Job:
+        """carry = fn(carry, *args) 依序執行 steps 次；until(carry) 為真時提早完成"""
+        return self._add(Job(self, owner, label, fn, args, carry=carry, steps=steps, until=until))
+
+    def _add(self, job):
+        with self._lock:
+            self._purge()
+            pending = sum(1 for j in self._jobs.values() if j.owner == job.owner and not j.finished)
+            if pending >= config.JOB_MAX_QUEUED:
+                raise ValueError(f"背景工作已達上限 ({config.JOB_MAX_QUEUED} 個)，請等待完成或取消後再送出")
+            self._jobs[job.id] = job
+            self._schedule()
+        return job
+
+    # --- 查詢 / 取消 ---
+
+    def get(self, job_id) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def jobs_for(self, owner) -> list[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished: return
+            for future in job._in_flight:
+                future.cancel()
+            self._finish(job, 'cancelled')
+            self._schedule()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {'workers': self.workers, **counts}
+
+    # --- 排程 (皆在鎖內呼叫) ---
+
+    def _schedule(self):
+        """依提交順序啟動排隊中的工作 (每位使用者最多 JOB_MAX_PER_USER 個同時執行)"""
+        running = {}
+        for job in self._jobs.values():
+            if job.status == 'running':
+                running[job.owner] = running.get(job.owner, 0) + 1
+        for job in self._jobs.values():
+            if job.status == 'queued' and running.get(job.owner, 0) < config.JOB_MAX_PER_USER:
+                job.status = 'running'
+                running[job.owner] = running.get(job.owner, 0) + 1
+                if job.total == 0:
+                    self._finish(job, 'done')
+                else:
+                    self._feed(job)
+
+    def _feed(self, job):
+        pool = self._executor()
+        if job.kind == 'map':
+            while job.status == 'running' and job._next < job.total and len(job._in_flight) < config.JOB_CHUNKS_IN_FLIGHT:
+                index = job._next
+                job._next += 1
+                self._submit(pool, job, index, job._items[index])
+        elif not job._in_flight and job.done < job.total:
+            self._submit(pool, job, job.done, job.carry)
+
+    def _submit(self, pool, job, index, payload):
+        try:
+            future = pool.submit(job._fn, payload, *job._args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            # 行程池已損毀 (例如 worker 被系統終止)：此工作失敗，之後的工作改用新的行程池
+            self._pool = None
+            job.error = f"{type(e).__name__}: {e}"
+            self._finish(job, 'error')
+            return
+        job._in_flight.add(future)
+        future.add_done_callback(functools.partial(self._on_done, job.id, index))
+
+    def _on_done(self, job_id, index, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None: return
+            job._in_flight.discard(future)
+            if job.status != 'running' or future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                job.error = f"{type(error).__name__}: {error}"
+                for other in job._in_flight:
+                    other.cancel()
+                self._finish(job, 'error')
+            else:
+                if job.kind == 'map':
+                    job.results[index] = future.result()
+                else:
+                    job.carry = future.result()
+                    if job._until is not None and job._until(job.carry):
+                        job.total = job.done + 1
+                job.done += 1
+                if job.done >= job.total:
+                    self._finish(job, 'done')
+                else:
+                    self._feed(job)
+            if job.finished:
+                self._schedule()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+
+    def _purge(self):
+        cutoff = time.time() - config.JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager() -> JobManager:
+    """行程內共用的工作管理器 (所有 session 共用同一個行程池)"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# --- 工作函式 (在 worker 行程中執行，需為模組層級函式) ---
+# 價格視窗不隨每一塊傳送：只傳視窗鍵，由 worker 自行載入並快取 (與 api_server 相同)
+
+def window_key(ticker: str, core_data) -> tuple[str, str, int]:
+    """價格視窗的識別鍵 (代碼, 起始日, 根數)，與操作日誌的 window_start / window_length 相同"""
+    return ticker, core_data['Date'].iloc[0].strftime('%Y-%m-%d'), len(core_data)
+
+@functools.lru_cache(maxsize=8)
+def _window(key):
+    ticker, window_start, window_length = key
+    return load_logged_window({'ticker': ticker, 'window_start': window_start, 'window_length': window_length})
+
+def advance_chunk(account: dict, key, days: int, target_index: int) -> dict:
+    """快轉的一塊：推進最多 days 天、不超過 target_index (與按下「下一天」相同，會寫入操作日誌)"""
+    state = logic.HeadlessState(account)
+    state.core_data = _window(key)
+    with logic.bind_state(state):
+        for _ in range(days):
+            if not state.sim_active or state.current_sim_index >= target_index: break
+            logic.perform_action('next_day')
+    del state['core_data']
+    return dict(state)
+
+def run_rules_chunk(rules: list[dict], key, asset_type: str) -> list[dict]:
+    """掃描的一塊：在同一段視窗上依序跑多組規則，回傳 規則 + 結果摘要"""
+    window = _window(key)
+    records = []
+    for rule in rules:
+        state = logic.HeadlessState(ticker='SWEEP', asset_type=asset_type)
+        with logic.bind_state(state):
+            logic.reset_state()
+            logic.start_simulation(window, asset_type, 0)
+        equity = strategies.run_rule(state, rule)
+        records.append({**rule, **summarize_run(state, equity)})
+    return records
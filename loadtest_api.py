@@ -0,0 +1,166 @@
+# loadtest_api.py
+# api_server.py 負載測試：N 個並行客戶端各自建立 session 並重複 下單 / 推進 / 設定 SL/TP / 快照，最後長距離推進並結算
+# 回報每種請求的 p50 / p95 / p99 延遲、整體吞吐量與每個 session 的記憶體成本
+#
+# 用法：python loadtest_api.py --sessions 300 --steps 30 --ticker TSLA [--url http://127.0.0.1:8600] [--no-memory]
+# 省略 --url 時會在本行程內啟動一個伺服器 (隨機埠)；記憶體在計時結束後另跑一輪量測 (tracemalloc 會拖慢執行，不混進延遲)
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+from urllib.parse import urlparse
+import numpy as np
+import config
+import api_server
+
+class HttpClient:
+    """最小的 keep-alive HTTP/1.1 JSON 客戶端"""
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n").encode() + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        payload = json.loads(await self.reader.readexactly(length)) if length else None
+        return status, payload
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def _client(host, port, ticker, asset_type, steps, seed, latencies, errors):
+    rng = random.Random(seed)
+    client = HttpClient(host, port)
+    await client.connect()
+
+    async def call(kind, method, path, body=None):
+        t0 = time.perf_counter()
+        status, payload = await client.request(method, path, body)
+        latencies.setdefault(kind, []).append(time.perf_counter() - t0)
+        if status != 200:
+            errors.append(f"{kind}: {status} {payload}")
+        return payload
+
+    try:
+        snap = await call('create', 'POST', '/sessions', {'ticker': ticker, 'asset_type': asset_type, 'seed': seed})
+        if not snap or 'session_id' not in snap:
+            return
+        base = f"/sessions/{snap['session_id']}"
+        qty = config.ASSET_CONFIGS[asset_type]['default_qty']
+
+        for _ in range(steps):
+            action = rng.random()
+            if action < 0.5:
+                snap = await call('advance', 'POST', f"{base}/advance", {'days': rng.choice((1, 1, 1, 10))})
+            elif action < 0.7:
+                mode = rng.choice(('Spot_Buy', 'Margin_Long', 'Margin_Short'))
+                leverage = 2.0 if config.TRADE_MODE_MAP[mode]['type'] == 'Margin' else 1.0
+                snap = await call('order', 'POST', f"{base}/order", {'mode': mode, 'qty': qty, 'leverage': leverage})
+            elif action < 0.85 and snap.get('positions'):
+                pos = snap['positions'][0]
+                direction = 1.0 if pos['pos_mode_key'] != 'Margin_Short' else -1.0
+                snap = await call('sl_tp', 'POST', f"{base}/sl_tp", {
+                    'position_id': pos['id'], 'sl': pos['cost'] * (1 - 0.05 * direction), 'tp': pos['cost'] * (1 + 0.1 * direction)
+                })
+            else:
+                snap = await call('snapshot', 'GET', base)
+            if not snap.get('sim_active', True):
+                break
+
+        await call('fast_forward', 'POST', f"{base}/advance", {'days': config.API_OFFLOAD_DAYS * 4})
+        await call('settle', 'POST', f"{base}/settle")
+    finally:
+        await client.close()
+
+def _percentiles(values):
+    arr = np.asarray(values) * 1000
+    return np.percentile(arr, 50), np.percentile(arr, 95), np.percentile(arr, 99)
+
+async def _run_clients(host, port, ticker, asset_type, steps, sessions):
+    latencies, errors = {}, []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, ticker, asset_type, steps, seed, latencies, errors)
+                           for seed in range(1, sessions + 1)))
+    return latencies, errors, time.perf_counter() - t0
+
+async def run_load_test(sessions, steps, ticker, asset_type, url=None, workers=None, measure_memory=True):
+    server = manager = None
+    if url:
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port or config.API_PORT
+    else:
+        server, manager = await api_server.start_server('127.0.0.1', 0, workers)
+        host, port = server.sockets[0].getsockname()[:2]
+
+    # 先載入一次價格資料，避免第一批請求的下載時間混進延遲統計
+    warm = HttpClient(host, port)
+    await warm.connect()
+    await warm.request('POST', '/sessions', {'ticker': ticker, 'asset_type': asset_type, 'seed': 0})
+    await warm.close()
+
+    latencies, errors, elapsed = await _run_clients(host, port, ticker, asset_type, steps, sessions)
+
+    mem_per_session = None
+    if server is not None and measure_memory:
+        # 記憶體另跑一輪 (同樣的客戶端與 session 數)，這一輪的延遲不列入統計
+        tracemalloc.start()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        await _run_clients(host, port, ticker, asset_type, steps, sessions)
+        mem_per_session = (tracemalloc.get_traced_memory()[0] - mem_before) / max(1, sessions)
+        tracemalloc.stop()
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+        manager.close()
+
+    total_requests = sum(len(v) for v in latencies.values())
+    print(f"並行 session: {sessions} / 請求數: {total_requests} / 耗時 {elapsed:.2f} 秒 / {total_requests / elapsed:,.0f} req/s")
+    print(f"{'請求':<14}{'次數':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, values in sorted(latencies.items()):
+        p50, p95, p99 = _percentiles(values)
+        print(f"{kind:<14}{len(values):>8}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+    p50, p95, p99 = _percentiles([v for values in latencies.values() for v in values])
+    print(f"{'全部':<14}{total_requests:>8}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+    if mem_per_session is not None:
+        print(f"每個 session 記憶體 (本行程): {mem_per_session / 1024:,.1f} KiB")
+    if errors:
+        print(f"❌ {len(errors)} 個錯誤，例如: {errors[0]}")
+    return {'requests': total_requests, 'elapsed': elapsed, 'p99_ms': p99, 'errors': len(errors)}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim API 伺服器負載測試")
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--ticker', default=config.DEFAULT_TICKER)
+    parser.add_argument('--asset-type', default='Stock')
+    parser.add_argument('--url', help="測試既有的伺服器 (省略則在本行程內啟動)")
+    parser.add_argument('--workers', type=int, help="本行程伺服器的 worker 行程數")
+    parser.add_argument('--no-memory', action='store_true', help="不量測記憶體 (省下額外一輪)")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run_load_test(args.sessions, args.steps, args.ticker.upper(), args.asset_type, args.url,
+                                       args.workers, not args.no_memory))
+    return 1 if result['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
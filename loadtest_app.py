@@ -0,0 +1,180 @@
+# loadtest_app.py
+# Streamlit app 並行負載測試：以 AppTest 在同一個行程內同時保有 N 個 session，模擬 N 個同時操作的使用者
+# 每個 session：開始回測 → 開倉 → 推進天數 → 編輯 SL/TP → 結算
+# 回報每次 rerun 的 p50 / p95 / p99 延遲與每個 session 的記憶體，觀察 N 放大時的退化情形
+#
+# 用法：python loadtest_app.py --sessions 1 10 50 [--ticker SYN:GBM:1] [--rounds 3] [--no-memory]
+# 每個 N 在獨立的子行程中執行，互不影響快取與記憶體量測
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+# --- 單一 session 的操作流程 ---
+
+def _click(elements, label):
+    button = next((b for b in elements if label in b.label), None)
+    if button is None:
+        raise RuntimeError(f"找不到按鈕「{label}」")
+    button.click()
+
+def _session_steps(index, ticker, rounds):
+    """
+    一個 session 的操作流程 (generator)：每次 next() 執行一次 rerun，產出 (步驟, 耗時秒數)
+    開始回測 → [開倉 → 下一天 → 編輯 SL/TP → 下十天] × rounds → 結算
+    """
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+
+    def rerun(step):
+        t0 = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - t0
+        if at.exception:
+            raise RuntimeError(f"{step}: {at.exception[0].value}")
+        return step, elapsed
+
+    yield rerun('load')
+    at.sidebar.text_input[0].set_value(ticker)
+    at.sidebar.number_input[0].set_value(index + 1)
+    _click(at.sidebar.button, '開始')
+    yield rerun('start')
+
+    state = at.session_state
+    for _ in range(rounds):
+        if not state['sim_active']: break
+        _click(at.button, '執行開倉')
+        yield rerun('open')
+        _click(at.button, '下一天')
+        yield rerun('next_day')
+
+        positions = state['positions']
+        if positions and state['sim_active']:
+            # data_editor 無法在 AppTest 中直接操作，改以與前端相同格式的編輯狀態模擬
+            edits = {}
+            for row, pos in enumerate(positions):
+                sign = -1.0 if pos['pos_mode_key'] == 'Margin_Short' else 1.0
+                edits[row] = {'SL': round(pos['cost'] * (1 - 0.08 * sign), 2), 'TP': round(pos['cost'] * (1 + 0.15 * sign), 2)}
+            state['pos_editor'] = {'edited_rows': edits, 'added_rows': [], 'deleted_rows': []}
+            _click(at.button, '儲存 SL/TP')
+            yield rerun('sl_tp')
+
+        if state['sim_active']:
+            _click(at.button, '下十天')
+            yield rerun('next_ten_days')
+
+    if state['sim_active']:
+        _click(at.button, '提早結算')
+        yield rerun('settle')
+
+# --- 子行程：執行一個 N ---
+
+def _percentiles(values):
+    arr = np.asarray(values) * 1000
+    if not len(arr): return {}
+    return {'p50': float(np.percentile(arr, 50)), 'p95': float(np.percentile(arr, 95)), 'p99': float(np.percentile(arr, 99))}
+
+def run_level(sessions, ticker, rounds, measure_memory=True) -> dict:
+    """
+    同時保有 sessions 個 session，輪流推進 (每一輪每個 session 各 rerun 一次)
+    AppTest 共用全域 Runtime，無法在多執行緒中同時執行；Streamlit 伺服器的腳本執行緒也受 GIL 限制，
+    因此以「同一輪內所有使用者同時點擊、依序被處理」模擬並行：
+      service   = 單次 rerun 本身的耗時
+      perceived = 從該輪開始到自己的 rerun 完成 (含排隊) 的耗時，即使用者感受到的延遲
+    """
+    # 先跑一個完整 session 暖機 (模組匯入、資料快取)，不計入統計
+    for _ in _session_steps(-1, ticker, 1):
+        pass
+
+    service, perceived, errors = {}, [], []
+    if measure_memory:
+        tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0] if measure_memory else 0
+
+    flows = [_session_steps(i, ticker, rounds) for i in range(sessions)]
+    t0 = time.perf_counter()
+    while flows:
+        tick = time.perf_counter()
+        alive = []
+        for flow in flows:
+            try:
+                step, elapsed = next(flow)
+            except StopIteration:
+                continue
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            service.setdefault(step, []).append(elapsed)
+            perceived.append(time.perf_counter() - tick)
+            alive.append(flow)
+        flows = alive
+    elapsed = time.perf_counter() - t0
+
+    # 所有 session 的 AppTest 物件在 generator 結束前仍存活；取峰值估算每個 session 的常駐記憶體
+    mem_peak = tracemalloc.get_traced_memory()[1] if measure_memory else 0
+    if measure_memory:
+        tracemalloc.stop()
+
+    return {
+        'sessions': sessions, 'elapsed': elapsed,
+        'reruns': sum(len(v) for v in service.values()),
+        'service': _percentiles([v for values in service.values() for v in values]),
+        'perceived': _percentiles(perceived),
+        'steps': {step: _percentiles(values) for step, values in service.items()},
+        'mem_per_session': (mem_peak - mem_before) / sessions if measure_memory else None,
+        'errors': errors,
+    }
+
+def _run_child(sessions, ticker, rounds, measure_memory) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', str(sessions), '--ticker', ticker, '--rounds', str(rounds)]
+    if not measure_memory:
+        cmd.append('--no-memory')
+    out = subprocess.run(cmd, cwd=os.path.dirname(APP_PATH), capture_output=True, text=True)
+    lines = out.stdout.strip().splitlines()
+    if out.returncode != 0 or not lines:
+        raise RuntimeError(f"N={sessions} 子行程失敗：{out.stderr.strip()[-500:]}")
+    return json.loads(lines[-1])
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim Streamlit app 並行 session 負載測試")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 25])
+    parser.add_argument('--ticker', default='SYN:GBM:1', help="預設使用合成資料，不需連網")
+    parser.add_argument('--rounds', type=int, default=3, help="每個 session 重複 開倉/推進/SL-TP 的次數")
+    parser.add_argument('--no-memory', action='store_true', help="不量測記憶體 (tracemalloc 會拖慢執行)")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # 結算時寫入的結果庫放在暫存目錄 (結束後刪除)，不污染工作目錄
+        with tempfile.TemporaryDirectory(prefix='ksim_load_', ignore_cleanup_errors=True) as tmp:
+            os.environ['KSIM_RESULTS_DB'] = os.path.join(tmp, 'results.db')
+            print(json.dumps(run_level(args.child, args.ticker.upper(), args.rounds, not args.no_memory)))
+        return 0
+
+    print(f"{'N':>5}{'reruns':>8}{'rerun p50/p95/p99 ms':>24}{'使用者感受 p50/p95/p99 ms':>30}{'記憶體/session':>16}")
+    failed = False
+    for sessions in args.sessions:
+        result = _run_child(sessions, args.ticker, args.rounds, not args.no_memory)
+        service, perceived = result['service'], result['perceived']
+        fmt = lambda p: f"{p.get('p50', 0):.0f} / {p.get('p95', 0):.0f} / {p.get('p99', 0):.0f}"
+        mem = f"{result['mem_per_session'] / 1024 / 1024:,.2f} MiB" if result['mem_per_session'] is not None else '-'
+        print(f"{sessions:>5}{result['reruns']:>8}{fmt(service):>24}{fmt(perceived):>30}{mem:>16}")
+        slowest = max(result['steps'].items(), key=lambda kv: kv[1].get('p95', 0), default=None)
+        if slowest:
+            print(f"{'':>5}  最慢步驟: {slowest[0]} (rerun p95 {slowest[1]['p95']:.0f} ms)")
+        if result['errors']:
+            failed = True
+            print(f"{'':>5}  ❌ {len(result['errors'])} 個 session 失敗，例如: {result['errors'][0]}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
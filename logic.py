@@ -1,402 +1,910 @@
-# logic.py
-# 核心業務邏輯：包含狀態管理、交易執行、資金計算與回測控制
-# 這裡處理所有跟錢、部位、訂單執行有關的後端邏輯
-
-import streamlit as st
-import pandas as pd
-import numpy as np
-import uuid
-from datetime import datetime
-import config
-from data_manager import (
-    fetch_historical_data, 
-    select_random_start_index, 
-    get_price_info_by_index
-)
-
-# --- 輔助函式：核心損益計算 ---
-
-def calculate_pnl_value(direction, qty, open_avg, current_price):
-    """
-    統一損益 (PnL) 計算邏輯
-    公式：(價差) * 數量
-    """
-    price_diff = 0.0
-    if direction == 'Long':
-        price_diff = current_price - open_avg
-    else: # Short
-        price_diff = open_avg - current_price
-
-    return price_diff * qty
-
-# --- 資金計算函式 ---
-
-def get_current_asset_value(core_data, current_idx):
-    """計算當前總資產價值"""
-    if st.session_state.core_data is None or st.session_state.core_data.empty:
-         return st.session_state.balance
-         
-    if st.session_state.sim_active and current_idx < len(core_data):
-        price = core_data['Open'].iloc[current_idx].item() if 'Open' in core_data.columns else 0.0
-    else:
-        return st.session_state.balance
-    
-    total_position_net_value = 0.0
-    
-    for pos in st.session_state.positions:
-        qty = pos['qty']
-        cost = pos['cost']
-        leverage = pos.get('leverage', 1.0)
-        pos_mode_key = pos['pos_mode_key']
-        
-        mode_info = config.TRADE_MODE_MAP.get(pos_mode_key, {})
-        is_margin = mode_info.get('type') == 'Margin'
-        direction = mode_info.get('direction', 'Long')
-        
-        if not is_margin: # Spot
-             total_position_net_value += (qty * price)
-        else: # Margin
-             initial_margin = (cost * qty) / leverage
-             unrealized_pnl = calculate_pnl_value(direction, qty, cost, price)
-             total_position_net_value += (initial_margin + unrealized_pnl)
-            
-    return st.session_state.balance + total_position_net_value
-
-def get_total_unrealized_pnl(price):
-    """計算投資組合的總未實現損益"""
-    total_pnl = 0.0
-    for pos in st.session_state.positions:
-        qty = pos['qty']
-        cost = pos['cost']
-        pos_mode_key = pos['pos_mode_key']
-        mode_info = config.TRADE_MODE_MAP.get(pos_mode_key, {})
-        direction = mode_info.get('direction', 'Long')
-        pnl = calculate_pnl_value(direction, qty, cost, price)
-        total_pnl += pnl
-    return total_pnl
-
-def get_spot_summary(core_data, current_idx):
-    """彙總現貨部位資訊"""
-    if not st.session_state.sim_active or core_data is None or current_idx >= len(core_data):
-        return {'qty': 0.0, 'avg_cost': 0.0, 'unrealized_pnl': 0.0}
-
-    price = core_data['Open'].iloc[current_idx].item()
-    spot_positions = []
-    for pos in st.session_state.positions:
-        mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
-        if mode_info.get('type') == 'Spot':
-            spot_positions.append(pos)
-    
-    if not spot_positions:
-        return {'qty': 0.0, 'avg_cost': 0.0, 'unrealized_pnl': 0.0}
-
-    total_qty = sum(pos['qty'] for pos in spot_positions)
-    total_cost = sum(pos['qty'] * pos['cost'] for pos in spot_positions)
-    avg_cost = total_cost / total_qty if total_qty > 0 else 0.0
-    unrealized_pnl = sum((pos['qty'] * price) - (pos['qty'] * pos['cost']) for pos in spot_positions)
-    
-    return {'qty': total_qty, 'avg_cost': avg_cost, 'unrealized_pnl': unrealized_pnl}
-
-def check_and_end_simulation(asset_value):
-    """風險控制：破產檢測"""
-    if asset_value <= 0:
-        if st.session_state.sim_active: 
-            settle_portfolio(force_end=True) 
-            msg = "🚨 風險控制警告！總資產歸零，模擬強制結束！"
-            st.session_state.last_event_msg = {'text': msg, 'type': 'error'}
-        return True
-    return False
-
-# --- 交易執行函式 ---
-
-def close_position_lot(pos_id: str, settle_qty: float, settle_price: float, reason: str, mode: str = '自動'):
-    """核心平倉邏輯"""
-    pos_index = next((i for i, pos in enumerate(st.session_state.positions) if pos['id'] == pos_id), -1)
-    
-    if pos_index == -1: return False
-    pos = st.session_state.positions[pos_index]
-    
-    if settle_qty <= 0 or settle_qty > pos['qty'] * 1.000001: return False
-    if abs(settle_qty - pos['qty']) < 1e-9: settle_qty = pos['qty']
-
-    current_datetime, _, _ = get_price_info_by_index(st.session_state.core_data, st.session_state.current_sim_index)
-    pos_mode_key = pos['pos_mode_key']
-    mode_info = config.TRADE_MODE_MAP.get(pos_mode_key, {})
-    is_margin = mode_info.get('type') == 'Margin'
-    direction = mode_info.get('direction', 'Long')
-    asset_type = st.session_state.asset_type
-    
-    # 計算費用與資金
-    fee_rate_used = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
-    close_amount = settle_qty * settle_price
-    close_fee = close_amount * fee_rate_used
-    
-    st.session_state.balance -= close_fee
-    
-    is_fully_closed = (settle_qty == pos['qty'])
-    leverage = pos.get('leverage', 1.0)
-    margin_released = (pos['cost'] * settle_qty) / leverage
-    realized_pnl = calculate_pnl_value(direction, settle_qty, pos['cost'], settle_price)
-
-    st.session_state.balance += (margin_released + realized_pnl)
-    
-    # 紀錄
-    prorated_open_fee = pos['total_open_fee'] * (settle_qty / pos['initial_qty'])
-    total_fee = prorated_open_fee + close_fee
-    display_name = pos['display_name']
-    type_display = f"{display_name} ({leverage}x)" if is_margin else display_name
-    if "強平" in reason: type_display += " [強平]"
-    
-    trade_record = {
-        'ID': pos['id'], 'asset': asset_type, 'mode_name': display_name,
-        'type_display': type_display, 'leverage': leverage, 'direction': direction,
-        'open_date': pos['open_date'], 'close_date': current_datetime,
-        'qty': settle_qty, 'open_price': pos['cost'], 'close_price': settle_price,
-        'pnl': realized_pnl, 'fees': total_fee, 'net_pnl': realized_pnl - total_fee,
-        'reason': reason
-    }
-    st.session_state.transactions.append(trade_record)
-    
-    if mode == '自動':
-        icon = "💰" if realized_pnl > 0 else "📉"
-        msg_text = f"{icon} {reason}：{display_name} {settle_qty:.3f} 單位 @ ${settle_price:,.2f} (損益: ${realized_pnl:,.2f})"
-        st.session_state.last_event_msg = {'text': msg_text, 'type': 'success' if realized_pnl > 0 else 'error'}
-    
-    if is_fully_closed:
-        st.session_state.positions.pop(pos_index)
-        if mode == '手動': st.toast(f"✅ {display_name} 已完全平倉", icon="💰")
-    else: 
-        pos['qty'] -= settle_qty
-        pos['total_open_fee'] -= prorated_open_fee
-        if mode == '手動': st.toast(f"✅ {display_name} 已部分平倉", icon="💰")
-
-    total_asset_new = get_current_asset_value(st.session_state.core_data, st.session_state.current_sim_index)
-    check_and_end_simulation(total_asset_new)
-    return True
-
-def execute_trade(trade_mode_key, quantity, price, leverage=1.0):
-    """執行開倉交易"""
-    if not st.session_state.sim_active: return False
-    if quantity <= 0 or price <= 0: return False
-
-    mode_conf = config.TRADE_MODE_MAP.get(trade_mode_key)
-    if not mode_conf: return False
-    
-    is_margin = mode_conf['type'] == 'Margin'
-    direction = mode_conf['direction']
-    asset_type = st.session_state.asset_type
-    asset_conf = config.ASSET_CONFIGS[asset_type]
-    
-    display_name = ""
-    if trade_mode_key == 'Spot_Buy': display_name = asset_conf['mode_spot']
-    elif trade_mode_key == 'Margin_Long': display_name = asset_conf['mode_margin_long']
-    elif trade_mode_key == 'Margin_Short': display_name = asset_conf['mode_margin_short']
-
-    if is_margin:
-        for pos in st.session_state.positions:
-            pos_mode_conf = config.TRADE_MODE_MAP.get(pos['pos_mode_key'])
-            if pos_mode_conf and pos_mode_conf['type'] == 'Margin' and pos_mode_conf['direction'] == direction:
-                 st.toast(f"🚫 限制：{display_name} 最多只能持有一個倉位！", icon="🛑")
-                 return False
-
-    transaction_amount = quantity * price
-    fee_rate_used = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
-    open_fee = transaction_amount * fee_rate_used
-    
-    st.session_state.balance -= open_fee
-    if check_and_end_simulation(get_current_asset_value(st.session_state.core_data, st.session_state.current_sim_index)):
-        return False
-
-    margin_required = transaction_amount / leverage if is_margin else transaction_amount
-    liquidation_price = 0.0
-    
-    if is_margin:
-        if direction == 'Long': liquidation_price = price * (1.0 - (1.0 / leverage))
-        else: liquidation_price = price * (1.0 + (1.0 / leverage))
-            
-    if st.session_state.balance < margin_required:
-            st.session_state.balance += open_fee 
-            st.toast(f"💸 餘額不足！需保證金 ${margin_required:,.0f}", icon="❌")
-            return False
-    
-    st.session_state.balance -= margin_required
-    current_datetime, _, _ = get_price_info_by_index(st.session_state.core_data, st.session_state.current_sim_index)
-    
-    new_position = {
-        'id': str(uuid.uuid4())[:8], 'open_date': current_datetime, 
-        'pos_mode_key': trade_mode_key, 'display_name': display_name,     
-        'qty': quantity, 'initial_qty': quantity,          
-        'cost': price, 'initial_cost': transaction_amount, 
-        'leverage': leverage, 'liquidation_price': liquidation_price, 
-        'sl': 0.0, 'tp': 0.0, 'total_open_fee': open_fee        
-    }
-    st.session_state.positions.append(new_position)
-    st.toast(f"✅ {display_name} 成功！開倉 {quantity:,.3f} {asset_conf['unit']}", icon="🎉")
-    return True
-
-def settle_portfolio(force_end=False):
-    """結算功能"""
-    if not st.session_state.sim_active and not force_end: return
-
-    current_idx = st.session_state.current_sim_index
-    core_data = st.session_state.core_data
-    if core_data is None or core_data.empty: return
-
-    settle_price = core_data['Close'].iloc[-1].item() if current_idx >= len(core_data) else \
-                   (core_data['Close'].iloc[current_idx].item() if force_end else core_data['Open'].iloc[current_idx].item())
-
-    positions_to_close = list(st.session_state.positions) 
-    if positions_to_close:
-        msg = "強制結算" if force_end else "手動全平"
-        for pos in positions_to_close:
-            close_position_lot(pos['id'], pos['qty'], settle_price, reason=msg, mode='自動結算')
-
-    if force_end:
-        st.session_state.sim_active = False
-        st.session_state.end_sim_index_on_settle = current_idx
-        
-        final_asset = get_current_asset_value(core_data, current_idx)
-        initial_cap = config.INITIAL_CAPITAL
-        total_pnl = final_asset - initial_cap
-        roi = (total_pnl / initial_cap) * 100
-        
-        start_date = st.session_state.start_date
-        end_date, _, _ = get_price_info_by_index(core_data, current_idx)
-        
-        st.session_state.settlement_stats = {
-            'final_asset': final_asset, 'total_pnl': total_pnl, 'roi': roi,
-            'start_date': start_date, 'end_date': end_date
-        }
-
-# --- 模擬控制函式 ---
-
-def check_sl_tp_trigger(core_data, current_idx):
-    """檢查 SL/TP 與強平"""
-    if not st.session_state.sim_active: return
-    if current_idx >= len(core_data): return
-
-    high = core_data['High'].iloc[current_idx].item()
-    low = core_data['Low'].iloc[current_idx].item()
-    positions_to_close_info = [] 
-    
-    for pos in st.session_state.positions:
-        sl = pos['sl']
-        tp = pos['tp']
-        triggered = False
-        settle_price = 0.0
-        reason = ''
-        
-        liq_price = pos.get('liquidation_price', 0.0)
-        mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
-        is_margin = mode_info.get('type') == 'Margin'
-        direction = mode_info.get('direction', 'Long')
-
-        # 強平檢查
-        if is_margin and liq_price > 0:
-            if direction == 'Long' and low <= liq_price:
-                settle_price = liq_price; triggered = True; reason = '⚡ 強制平倉(多)'
-            elif direction == 'Short' and high >= liq_price:
-                settle_price = liq_price; triggered = True; reason = '⚡ 強制平倉(空)'
-        
-        # SL/TP 檢查
-        if not triggered:
-            if direction == 'Long' and pos['qty'] > 0:
-                if sl > 0 and low <= sl: settle_price = sl; triggered = True; reason = '🛑 止損賣出'
-                elif tp > 0 and high >= tp: settle_price = tp; triggered = True; reason = '🎯 止盈賣出'
-            elif direction == 'Short' and pos['qty'] > 0:
-                if sl > 0 and high >= sl: settle_price = sl; triggered = True; reason = '🛑 止損買回'
-                elif tp > 0 and low <= tp: settle_price = tp; triggered = True; reason = '🎯 止盈買回'
-        
-        if triggered and settle_price > 0:
-            positions_to_close_info.append({'id': pos['id'], 'qty': pos['qty'], 'price': settle_price, 'reason': reason})
-
-    for info in positions_to_close_info:
-        close_position_lot(info['id'], info['qty'], info['price'], info['reason'], mode='自動')
-
-def _advance_one_day():
-    if not st.session_state.sim_active: return False
-
-    if st.session_state.current_sim_index < st.session_state.max_sim_index:
-        st.session_state.current_sim_index += 1
-        if 'last_event_msg' in st.session_state: del st.session_state.last_event_msg
-            
-        check_sl_tp_trigger(st.session_state.core_data, st.session_state.current_sim_index)
-        total_asset_new = get_current_asset_value(st.session_state.core_data, st.session_state.current_sim_index)
-        return not check_and_end_simulation(total_asset_new)
-    else:
-        settle_portfolio(force_end=True)
-        return False
-
-def next_day():
-    if not st.session_state.sim_active: return
-    _advance_one_day()
-
-def next_ten_days():
-    if not st.session_state.sim_active: return
-    days_to_advance = min(10, st.session_state.max_sim_index - st.session_state.current_sim_index)
-    if days_to_advance <= 0: settle_portfolio(force_end=True); return
-    for _ in range(days_to_advance):
-        if not _advance_one_day(): break
-    if st.session_state.sim_active and st.session_state.current_sim_index >= st.session_state.max_sim_index:
-        settle_portfolio(force_end=True)
-        st.session_state.last_event_msg = {'text': "回測結束。", 'type': 'info'}
-
-def reset_state():
-    """重置 Session State"""
-    st.session_state.setdefault('ticker', config.DEFAULT_TICKER)
-    st.session_state.setdefault('asset_type', 'Stock') 
-    st.session_state.initialized = False
-    st.session_state.core_data = None
-    st.session_state.start_view_index = 0
-    st.session_state.current_sim_index = 0
-    st.session_state.max_sim_index = 0
-    st.session_state.sim_active = True
-    st.session_state.balance = config.INITIAL_CAPITAL
-    st.session_state.transactions = [] 
-    st.session_state.start_date = None
-    st.session_state.end_sim_index_on_settle = None 
-    st.session_state.positions = []
-    st.session_state.plot_layout = None 
-    st.session_state.settlement_stats = None 
-    st.session_state.last_event_msg = None
-
-def initialize_data_and_simulation(asset_type):
-    """
-    初始化資料與模擬環境
-    """
-    ticker = st.session_state.ticker.upper()
-    data = fetch_historical_data(ticker) 
-
-    if data is None: 
-        st.error(f"無法載入 {ticker} 的數據。")
-        return
-        
-    st.session_state.core_data = data
-    total_days = len(data)
-    
-    # 這裡改成用 INITIAL_OBSERVATION_DAYS 來判斷資料是否足夠
-    required_days = config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
-    
-    if total_days < required_days:
-        st.warning(f"注意：{ticker} 數據不足。")
-            
-    start_indices = select_random_start_index(st.session_state.core_data)
-    if start_indices is not None:
-        start_view_idx, _ = start_indices
-        data_end_idx = start_view_idx + required_days
-        truncated_data = st.session_state.core_data.iloc[start_view_idx:data_end_idx].reset_index(drop=True)
-
-        st.session_state.core_data = truncated_data
-        st.session_state.start_view_index = 0
-        
-        st.session_state.current_sim_index = config.INITIAL_OBSERVATION_DAYS
-        
-        st.session_state.max_sim_index = len(truncated_data) - 1
-        st.session_state.initialized = True
-        st.session_state.sim_active = True
-        st.session_state.asset_type = asset_type
-        
-        date_ts = st.session_state.core_data['Date'].iloc[st.session_state.current_sim_index]
-        st.session_state.start_date = date_ts.to_pydatetime()
-        st.session_state.settlement_stats = None
-        st.session_state.last_event_msg = None
\ No newline at end of file
+# logic.py
+# 核心業務邏輯：包含狀態管理、交易執行、資金計算與回測控制
+# 這裡處理所有跟錢、部位、訂單執行有關的後端邏輯
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+import random
+import weakref
+import contextvars
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+import config
+import regimes
+import intrabar
+from orderbook import ORDER_TYPES, OrderBook, fill_price
+from data_manager import (
+    fetch_historical_data, 
+    fetch_date_range,
+    fetch_window_data,
+    pick_window_start,
+    uses_local_data,
+    select_random_start_index, 
+    get_price_info_by_index
+)
+
+# --- 狀態綁定 (Session State / Headless State) ---
+
+class HeadlessState(dict):
+    """
+    脫離 Streamlit 執行時使用的狀態容器
+    介面與 st.session_state 相同 (屬性存取、in、get、setdefault、del)
+    """
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __delattr__(self, key):
+        try:
+            del self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+_bound_state = contextvars.ContextVar('ksim_bound_state', default=None)
+
+def _state():
+    """取得目前作用中的狀態：有綁定 HeadlessState 時使用它，否則使用 st.session_state"""
+    bound = _bound_state.get()
+    return st.session_state if bound is None else bound
+
+def is_headless():
+    return _bound_state.get() is not None
+
+@contextmanager
+def bind_state(state):
+    """在 with 區塊內讓所有 logic 函式改用指定的狀態 (回放、批次執行用)"""
+    token = _bound_state.set(state)
+    try:
+        yield state
+    finally:
+        _bound_state.reset(token)
+
+def _toast(text, icon=None):
+    """UI 提示：無頭模式下不輸出"""
+    if not is_headless():
+        st.toast(text, icon=icon)
+
+# --- 輔助函式：核心損益計算 ---
+
+def calculate_pnl_value(direction, qty, open_avg, current_price):
+    """
+    統一損益 (PnL) 計算邏輯
+    公式：(價差) * 數量
+    """
+    price_diff = 0.0
+    if direction == 'Long':
+        price_diff = current_price - open_avg
+    else: # Short
+        price_diff = open_avg - current_price
+
+    return price_diff * qty
+
+# 逐根推進時每根 K 線要讀好幾次價格，pandas 的 core_data['Open'].iloc[i] 每次約數十微秒；
+# 這裡把欄位轉成 numpy 陣列後依 DataFrame 快取 (DataFrame 被回收時自動清除)
+_column_cache = {}
+
+def _bar_value(core_data, column, idx):
+    """讀取單根 K 線的欄位值 (float)"""
+    key = id(core_data)
+    entry = _column_cache.get(key)
+    if entry is None or entry[0]() is not core_data:
+        entry = (weakref.ref(core_data, lambda _, key=key: _column_cache.pop(key, None)), {})
+        _column_cache[key] = entry
+    columns = entry[1]
+    if column not in columns:
+        columns[column] = core_data[column].to_numpy()
+    return columns[column][idx].item()
+
+# --- 帳戶版本與估值快取 ---
+
+def _touch(state):
+    """帳戶有變動 (餘額、倉位、止損 / 止盈、掛單)：版本號 +1，衍生估值的快取隨之失效"""
+    state.portfolio_version = state.get('portfolio_version', 0) + 1
+
+class _ValuationCache:
+    """
+    依 (帳戶版本, K 線索引) 快取的衍生估值 (總資產、未實現損益、現貨彙總、保證金占用)
+    同一根 K 線內重複讀取不再逐倉重算；價格視窗換了物件 (串流模式每根都換) 也視為失效
+    序列化 (送往 worker 行程) 時只留空殼，不帶走價格視窗
+    """
+    __slots__ = ('key', 'core_data', 'values')
+
+    def __init__(self):
+        self.key = None
+        self.core_data = None
+        self.values = {}
+
+    def __reduce__(self):
+        return (_ValuationCache, ())
+
+def _memoized(state, name, core_data, idx, compute):
+    cache = state.get('valuation_cache')
+    if cache is None:
+        cache = state.valuation_cache = _ValuationCache()
+    key = (state.get('portfolio_version', 0), idx, state.get('sim_active'))
+    if cache.key != key or cache.core_data is not core_data:
+        cache.key, cache.core_data, cache.values = key, core_data, {}
+    if name not in cache.values:
+        cache.values[name] = compute()
+    return cache.values[name]
+
+# --- 資金計算函式 ---
+
+def get_current_asset_value(core_data, current_idx):
+    """計算當前總資產價值"""
+    state = _state()
+    return _memoized(state, 'asset_value', core_data, current_idx,
+                     lambda: _asset_value(state, core_data, current_idx))
+
+def _asset_value(state, core_data, current_idx):
+    if state.core_data is None or state.core_data.empty:
+         return state.balance
+         
+    if not (state.sim_active and current_idx < len(core_data)):
+        return state.balance
+    price = _bar_value(core_data, 'Open', current_idx) if 'Open' in core_data.columns else 0.0
+    total_position_net_value = 0.0
+    
+    for pos in state.positions:
+        qty = pos['qty']
+        cost = pos['cost']
+        leverage = pos.get('leverage', 1.0)
+        pos_mode_key = pos['pos_mode_key']
+        
+        mode_info = config.TRADE_MODE_MAP.get(pos_mode_key, {})
+        is_margin = mode_info.get('type') == 'Margin'
+        direction = mode_info.get('direction', 'Long')
+        
+        if not is_margin: # Spot
+             total_position_net_value += (qty * price)
+        else: # Margin
+             initial_margin = (cost * qty) / leverage
+             unrealized_pnl = calculate_pnl_value(direction, qty, cost, price)
+             total_position_net_value += (initial_margin + unrealized_pnl)
+            
+    return state.balance + total_position_net_value
+
+def get_total_unrealized_pnl(price):
+    """計算投資組合的總未實現損益"""
+    state = _state()
+    return _memoized(state, ('unrealized_pnl', price), state.get('core_data'), state.get('current_sim_index'),
+                     lambda: _total_unrealized_pnl(state, price))
+
+def _total_unrealized_pnl(state, price):
+    total_pnl = 0.0
+    for pos in state.positions:
+        qty = pos['qty']
+        cost = pos['cost']
+        pos_mode_key = pos['pos_mode_key']
+        mode_info = config.TRADE_MODE_MAP.get(pos_mode_key, {})
+        direction = mode_info.get('direction', 'Long')
+        pnl = calculate_pnl_value(direction, qty, cost, price)
+        total_pnl += pnl
+    return total_pnl
+
+def get_spot_summary(core_data, current_idx):
+    """彙總現貨部位資訊"""
+    state = _state()
+    return dict(_memoized(state, 'spot_summary', core_data, current_idx,
+                          lambda: _spot_summary(state, core_data, current_idx)))
+
+def _spot_summary(state, core_data, current_idx):
+    if not state.sim_active or core_data is None or current_idx >= len(core_data):
+        return {'qty': 0.0, 'avg_cost': 0.0, 'unrealized_pnl': 0.0}
+
+    price = _bar_value(core_data, 'Open', current_idx)
+    spot_positions = []
+    for pos in state.positions:
+        mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
+        if mode_info.get('type') == 'Spot':
+            spot_positions.append(pos)
+    
+    if not spot_positions:
+        return {'qty': 0.0, 'avg_cost': 0.0, 'unrealized_pnl': 0.0}
+
+    total_qty = sum(pos['qty'] for pos in spot_positions)
+    total_cost = sum(pos['qty'] * pos['cost'] for pos in spot_positions)
+    avg_cost = total_cost / total_qty if total_qty > 0 else 0.0
+    unrealized_pnl = sum((pos['qty'] * price) - (pos['qty'] * pos['cost']) for pos in spot_positions)
+    
+    return {'qty': total_qty, 'avg_cost': avg_cost, 'unrealized_pnl': unrealized_pnl}
+
+def get_margin_usage(core_data, current_idx):
+    """槓桿倉位占用的保證金，以及占總資產的比例 (%)"""
+    state = _state()
+    return dict(_memoized(state, 'margin_usage', core_data, current_idx,
+                          lambda: _margin_usage(state, core_data, current_idx)))
+
+def _margin_usage(state, core_data, current_idx):
+    if not state.sim_active or core_data is None or current_idx >= len(core_data):
+        return {'used_margin': 0.0, 'ratio': 0.0}
+    used_margin = 0.0
+    for pos in state.positions:
+        if config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {}).get('type') == 'Margin':
+            used_margin += (pos['cost'] * pos['qty']) / pos.get('leverage', 1.0)
+    total_asset = get_current_asset_value(core_data, current_idx)
+    ratio = used_margin / total_asset * 100 if total_asset > 0 else 0.0
+    return {'used_margin': used_margin, 'ratio': ratio}
+
+def check_and_end_simulation(asset_value):
+    """風險控制：破產檢測"""
+    state = _state()
+    if asset_value <= 0:
+        if state.sim_active: 
+            settle_portfolio(force_end=True) 
+            msg = "🚨 風險控制警告！總資產歸零，模擬強制結束！"
+            state.last_event_msg = {'text': msg, 'type': 'error'}
+        return True
+    return False
+
+# --- 交易執行函式 ---
+
+def _next_position_id(state):
+    """依 session 內的流水號產生倉位 ID (可重現，回放時 ID 會完全一致)"""
+    state.position_seq = state.get('position_seq', 0) + 1
+    return f"{state.position_seq:08d}"
+
+def close_position_lot(pos_id: str, settle_qty: float, settle_price: float, reason: str, mode: str = '自動'):
+    """核心平倉邏輯"""
+    state = _state()
+    pos_index = next((i for i, pos in enumerate(state.positions) if pos['id'] == pos_id), -1)
+    
+    if pos_index == -1: return False
+    pos = state.positions[pos_index]
+    
+    if settle_qty <= 0 or settle_qty > pos['qty'] * 1.000001: return False
+    if abs(settle_qty - pos['qty']) < 1e-9: settle_qty = pos['qty']
+
+    current_datetime, _, _ = get_price_info_by_index(state.core_data, state.current_sim_index)
+    pos_mode_key = pos['pos_mode_key']
+    mode_info = config.TRADE_MODE_MAP.get(pos_mode_key, {})
+    is_margin = mode_info.get('type') == 'Margin'
+    direction = mode_info.get('direction', 'Long')
+    asset_type = state.asset_type
+    
+    # 計算費用與資金
+    fee_rate_used = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
+    close_amount = settle_qty * settle_price
+    close_fee = close_amount * fee_rate_used
+    
+    _touch(state)
+    state.balance -= close_fee
+    
+    is_fully_closed = (settle_qty == pos['qty'])
+    leverage = pos.get('leverage', 1.0)
+    margin_released = (pos['cost'] * settle_qty) / leverage
+    realized_pnl = calculate_pnl_value(direction, settle_qty, pos['cost'], settle_price)
+
+    state.balance += (margin_released + realized_pnl)
+    
+    # 紀錄
+    prorated_open_fee = pos['total_open_fee'] * (settle_qty / pos['initial_qty'])
+    total_fee = prorated_open_fee + close_fee
+    display_name = pos['display_name']
+    type_display = f"{display_name} ({leverage}x)" if is_margin else display_name
+    if "強制平倉" in reason: type_display += " [強平]"
+    
+    trade_record = {
+        'ID': pos['id'], 'asset': asset_type, 'mode_name': display_name,
+        'type_display': type_display, 'leverage': leverage, 'direction': direction,
+        'open_date': pos['open_date'], 'close_date': current_datetime,
+        'qty': settle_qty, 'open_price': pos['cost'], 'close_price': settle_price,
+        'pnl': realized_pnl, 'fees': total_fee, 'net_pnl': realized_pnl - total_fee,
+        'reason': reason
+    }
+    state.transactions.append(trade_record)
+    
+    if mode == '自動':
+        icon = "💰" if realized_pnl > 0 else "📉"
+        msg_text = f"{icon} {reason}：{display_name} {settle_qty:.3f} 單位 @ ${settle_price:,.2f} (損益: ${realized_pnl:,.2f})"
+        state.last_event_msg = {'text': msg_text, 'type': 'success' if realized_pnl > 0 else 'error'}
+    
+    if is_fully_closed:
+        state.positions.pop(pos_index)
+        if mode == '手動': _toast(f"✅ {display_name} 已完全平倉", icon="💰")
+    else: 
+        pos['qty'] -= settle_qty
+        pos['total_open_fee'] -= prorated_open_fee
+        if mode == '手動': _toast(f"✅ {display_name} 已部分平倉", icon="💰")
+
+    total_asset_new = get_current_asset_value(state.core_data, state.current_sim_index)
+    check_and_end_simulation(total_asset_new)
+    return True
+
+def validate_leverage(trade_mode_key, leverage):
+    """檢查槓桿倍數 (UI / API / 規則共用)：槓桿模式需在 1 ~ MAX_LEVERAGE 倍之間，現貨不使用槓桿；回傳錯誤訊息，沒有問題時回傳 None"""
+    mode_conf = config.TRADE_MODE_MAP.get(trade_mode_key)
+    if mode_conf is None:
+        return f"未知的交易模式: {trade_mode_key}"
+    if mode_conf['type'] == 'Margin' and not 1.0 <= leverage <= config.MAX_LEVERAGE:
+        return f"槓桿倍數需在 1 ~ {config.MAX_LEVERAGE:g} 倍之間 (收到 {leverage})"
+    return None
+
+def _effective_leverage(trade_mode_key, leverage):
+    """實際使用的槓桿：不合法時回傳 None；現貨一律 1 倍 (保證金與平倉釋放金額才會一致)"""
+    if validate_leverage(trade_mode_key, leverage) is not None: return None
+    return float(leverage) if config.TRADE_MODE_MAP[trade_mode_key]['type'] == 'Margin' else 1.0
+
+def execute_trade(trade_mode_key, quantity, price, leverage=1.0):
+    """執行開倉交易"""
+    state = _state()
+    if not state.sim_active: return False
+    if quantity <= 0 or price <= 0: return False
+
+    mode_conf = config.TRADE_MODE_MAP.get(trade_mode_key)
+    if not mode_conf: return False
+    leverage = _effective_leverage(trade_mode_key, leverage)
+    if leverage is None: return False
+    
+    is_margin = mode_conf['type'] == 'Margin'
+    direction = mode_conf['direction']
+    asset_type = state.asset_type
+    asset_conf = config.ASSET_CONFIGS[asset_type]
+    
+    display_name = ""
+    if trade_mode_key == 'Spot_Buy': display_name = asset_conf['mode_spot']
+    elif trade_mode_key == 'Margin_Long': display_name = asset_conf['mode_margin_long']
+    elif trade_mode_key == 'Margin_Short': display_name = asset_conf['mode_margin_short']
+
+    if is_margin:
+        for pos in state.positions:
+            pos_mode_conf = config.TRADE_MODE_MAP.get(pos['pos_mode_key'])
+            if pos_mode_conf and pos_mode_conf['type'] == 'Margin' and pos_mode_conf['direction'] == direction:
+                 _toast(f"🚫 限制：{display_name} 最多只能持有一個倉位！", icon="🛑")
+                 return False
+
+    transaction_amount = quantity * price
+    fee_rate_used = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
+    open_fee = transaction_amount * fee_rate_used
+    
+    _touch(state)
+    state.balance -= open_fee
+    if check_and_end_simulation(get_current_asset_value(state.core_data, state.current_sim_index)):
+        return False
+
+    margin_required = transaction_amount / leverage if is_margin else transaction_amount
+    liquidation_price = 0.0
+    
+    if is_margin:
+        if direction == 'Long': liquidation_price = price * (1.0 - (1.0 / leverage))
+        else: liquidation_price = price * (1.0 + (1.0 / leverage))
+            
+    if state.balance < margin_required:
+            state.balance += open_fee 
+            _touch(state)
+            _toast(f"💸 餘額不足！需保證金 ${margin_required:,.0f}", icon="❌")
+            return False
+    
+    _touch(state)
+    state.balance -= margin_required
+    current_datetime, _, _ = get_price_info_by_index(state.core_data, state.current_sim_index)
+    
+    new_position = {
+        'id': _next_position_id(state), 'open_date': current_datetime, 
+        'pos_mode_key': trade_mode_key, 'display_name': display_name,     
+        'qty': quantity, 'initial_qty': quantity,          
+        'cost': price, 'initial_cost': transaction_amount, 
+        'leverage': leverage, 'liquidation_price': liquidation_price, 
+        'sl': 0.0, 'tp': 0.0, 'trail_pct': 0.0, 'total_open_fee': open_fee        
+    }
+    state.positions.append(new_position)
+    _toast(f"✅ {display_name} 成功！開倉 {quantity:,.3f} {asset_conf['unit']}", icon="🎉")
+    return True
+
+def settle_portfolio(force_end=False):
+    """結算功能"""
+    state = _state()
+    if not state.sim_active and not force_end: return
+
+    current_idx = state.current_sim_index
+    core_data = state.core_data
+    if core_data is None or core_data.empty: return
+
+    settle_price = _bar_value(core_data, 'Close', -1) if current_idx >= len(core_data) else \
+                   (_bar_value(core_data, 'Close', current_idx) if force_end else _bar_value(core_data, 'Open', current_idx))
+
+    positions_to_close = list(state.positions) 
+    if positions_to_close:
+        msg = "強制結算" if force_end else "手動全平"
+        for pos in positions_to_close:
+            close_position_lot(pos['id'], pos['qty'], settle_price, reason=msg, mode='自動結算')
+
+    if force_end:
+        state.sim_active = False
+        state.end_sim_index_on_settle = current_idx
+        
+        final_asset = get_current_asset_value(core_data, current_idx)
+        initial_cap = config.INITIAL_CAPITAL
+        total_pnl = final_asset - initial_cap
+        roi = (total_pnl / initial_cap) * 100
+        
+        start_date = state.start_date
+        end_date, _, _ = get_price_info_by_index(core_data, current_idx)
+        
+        state.settlement_stats = {
+            'final_asset': final_asset, 'total_pnl': total_pnl, 'roi': roi,
+            'start_date': start_date, 'end_date': end_date
+        }
+
+# --- 模擬控制函式 ---
+
+def check_sl_tp_trigger(core_data, current_idx):
+    """檢查 SL/TP 與強平"""
+    state = _state()
+    if not state.sim_active: return
+    if current_idx >= len(core_data): return
+
+    high = _bar_value(core_data, 'High', current_idx)
+    low = _bar_value(core_data, 'Low', current_idx)
+    positions_to_close_info = [] 
+    
+    for pos in state.positions:
+        liq_price = pos.get('liquidation_price', 0.0)
+        mode_info = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {})
+        is_margin = mode_info.get('type') == 'Margin'
+        long_ = mode_info.get('direction', 'Long') == 'Long'
+
+        # 本根觸及的出場價 (價格, 原因, 是否向下觸及)，依日線的優先順序：強平 → 止損 → 止盈
+        hits = []
+        if is_margin and liq_price > 0 and (low <= liq_price if long_ else high >= liq_price):
+            hits.append((liq_price, '⚡ 強制平倉(多)' if long_ else '⚡ 強制平倉(空)', long_))
+        if pos['qty'] > 0:
+            sl, tp = pos['sl'], pos['tp']
+            if sl > 0 and (low <= sl if long_ else high >= sl):
+                hits.append((sl, '🛑 止損賣出' if long_ else '🛑 止損買回', long_))
+            if tp > 0 and (high >= tp if long_ else low <= tp):
+                hits.append((tp, '🎯 止盈賣出' if long_ else '🎯 止盈買回', not long_))
+        if not hits: continue
+
+        settle_price, reason, _ = hits[0] if len(hits) == 1 else _first_exit(core_data, current_idx, hits)
+        if settle_price > 0:
+            positions_to_close_info.append({'id': pos['id'], 'qty': pos['qty'], 'price': settle_price, 'reason': reason})
+
+    for info in positions_to_close_info:
+        close_position_lot(info['id'], info['qty'], info['price'], info['reason'], mode='自動')
+
+    # 移動止損：以本根 K 線收完後的極值上調 (下調) 止損，下一根起生效
+    for pos in state.positions:
+        _trail_stop(pos, high, low)
+
+    # 掛單撮合：與 SL/TP 同一輪檢查
+    if state.sim_active:
+        _fill_pending_orders(core_data, current_idx, high, low)
+
+def _first_exit(core_data, current_idx, hits):
+    """同一根日線觸及多個出場價：開啟盤中判定時以當天盤中路徑找出最先觸及者，否則 (或無法判定) 取優先順序第一個"""
+    if not config.INTRABAR_RESOLUTION:
+        return hits[0]
+    bar = tuple(_bar_value(core_data, col, current_idx) for col in ('Open', 'High', 'Low', 'Close'))
+    choice = intrabar.resolve(_state().ticker, core_data['Date'].iloc[current_idx], bar,
+                              [(price, below) for price, _, below in hits])
+    return hits[0] if choice is None else hits[choice]
+
+def _trail_stop(pos, high, low):
+    trail_pct = pos.get('trail_pct', 0.0)
+    if trail_pct <= 0: return
+    direction = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {}).get('direction', 'Long')
+    if direction == 'Long':
+        new_sl = high * (1.0 - trail_pct / 100.0)
+        if new_sl <= pos['sl']: return
+    else:
+        new_sl = low * (1.0 + trail_pct / 100.0)
+        if pos['sl'] > 0 and new_sl >= pos['sl']: return
+    pos['sl'] = new_sl
+    _touch(_state())
+
+def _fill_pending_orders(core_data, current_idx, high, low):
+    """以 OrderBook 找出本根 K 線被穿越的掛單並開倉"""
+    state = _state()
+    book = state.get('order_book')
+    if not book: return
+
+    open_price = _bar_value(core_data, 'Open', current_idx)
+    matched = book.match(high, low)
+    if matched: _touch(state)
+    for order in matched:
+        if not state.sim_active: break
+        price = fill_price(order, open_price)
+        type_name = '限價單' if order['order_type'] == 'Limit' else '停損單'
+        if execute_trade(order['pos_mode_key'], order['qty'], price, order['leverage']):
+            msg = f"📥 {type_name}成交：{order['qty']:,.3f} 單位 @ ${price:,.2f}"
+            state.last_event_msg = {'text': msg, 'type': 'info'}
+        else:
+            msg = f"⚠️ {type_name}觸發但無法成交 (已撤單)：{order['qty']:,.3f} 單位 @ ${price:,.2f}"
+            state.last_event_msg = {'text': msg, 'type': 'error'}
+
+def _advance_one_day():
+    state = _state()
+    if not state.sim_active: return False
+
+    if state.current_sim_index < state.max_sim_index:
+        state.current_sim_index += 1
+        if 'last_event_msg' in state: del state.last_event_msg
+            
+        check_sl_tp_trigger(state.core_data, state.current_sim_index)
+        total_asset_new = get_current_asset_value(state.core_data, state.current_sim_index)
+        state.equity_curve.append(total_asset_new)
+        if check_and_end_simulation(total_asset_new): return False
+        _take_snapshot(state)
+        return True
+    else:
+        settle_portfolio(force_end=True)
+        return False
+
+def next_day():
+    state = _state()
+    if not state.sim_active: return
+    _advance_one_day()
+
+def next_ten_days():
+    state = _state()
+    if not state.sim_active: return
+    days_to_advance = min(10, state.max_sim_index - state.current_sim_index)
+    if days_to_advance <= 0: settle_portfolio(force_end=True); return
+    for _ in range(days_to_advance):
+        if not _advance_one_day(): break
+    if state.sim_active and state.current_sim_index >= state.max_sim_index:
+        settle_portfolio(force_end=True)
+        state.last_event_msg = {'text': "回測結束。", 'type': 'info'}
+
+def reset_state():
+    """重置 Session State"""
+    state = _state()
+    state.setdefault('ticker', config.DEFAULT_TICKER)
+    state.setdefault('asset_type', 'Stock') 
+    state.initialized = False
+    state.core_data = None
+    state.start_view_index = 0
+    state.current_sim_index = 0
+    state.max_sim_index = 0
+    state.sim_active = True
+    state.balance = config.INITIAL_CAPITAL
+    state.transactions = [] 
+    state.start_date = None
+    state.end_sim_index_on_settle = None 
+    state.positions = []
+    state.plot_layout = None 
+    state.settlement_stats = None 
+    state.last_event_msg = None
+    state.order_book = OrderBook()
+    state.seed = None
+    state.position_seq = 0
+    state.action_log = []
+    state.equity_curve = []
+    state.snapshots = []
+    state.result_saved = False
+    state.valuation_cache = None
+    _touch(state)
+
+# 帳戶狀態 (不含價格視窗 core_data)：背景工作在 worker 行程推進時整組搬移
+ACCOUNT_KEYS = (
+    'ticker', 'asset_type', 'initialized', 'start_view_index', 'current_sim_index', 'max_sim_index', 'sim_active',
+    'balance', 'transactions', 'start_date', 'end_sim_index_on_settle', 'positions', 'settlement_stats',
+    'last_event_msg', 'order_book', 'seed', 'position_seq', 'action_log', 'equity_curve', 'snapshots', 'result_saved',
+    'portfolio_version',
+)
+
+def export_account_state():
+    state = _state()
+    return {key: state.get(key) for key in ACCOUNT_KEYS}
+
+def import_account_state(account):
+    state = _state()
+    for key in ACCOUNT_KEYS:
+        if key in account:
+            state[key] = account[key]
+    _touch(state)
+
+def initialize_data_and_simulation(asset_type, seed=None, regime=None):
+    """
+    初始化資料與模擬環境
+    seed: 隨機種子，None 表示隨機產生；相同種子 + 相同資料 = 相同的回測區間
+    regime: 市場情境 (regimes.REGIMES，例如 'crash')，None 表示不限情境
+    """
+    state = _state()
+    ticker = state.ticker.upper()
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+
+    notice = None
+    try:
+        truncated_data = load_window(ticker, seed, regime)
+    except ValueError as e:
+        # 該代碼沒有此情境的區間：改為不限情境抽樣
+        notice = f"⚠️ {e}，已改為隨機區間。"
+        truncated_data = load_window(ticker, seed)
+    if truncated_data is None:
+        st.error(f"無法載入 {ticker} 的數據。")
+        return
+
+    # 這裡改成用 INITIAL_OBSERVATION_DAYS 來判斷資料是否足夠
+    required_days = config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
+    if len(truncated_data) < required_days:
+        st.warning(f"注意：{ticker} 數據不足。")
+
+    start_simulation(truncated_data, asset_type, seed)
+    if notice is not None:
+        state.last_event_msg = {'text': notice, 'type': 'info'}
+
+def load_window(ticker, seed, regime=None):
+    """
+    依種子取得回測視窗 (觀察期 + 模擬期)
+    Yahoo 代碼：先查日期範圍、抽出起點，只下載該區段 (+ 指標暖機)；
+    範圍查詢失敗、資料不足，或合成 / 本地資料包代碼，則從完整歷史截取
+    指定 regime 時從情境索引抽起點：Yahoo 代碼有未過期的索引就只下載該區段，否則載入完整歷史建立索引
+    """
+    required_days = config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
+    if config.WINDOWED_FETCH and not uses_local_data(ticker):
+        start_date = None
+        if regime:
+            index = regimes.get_index(ticker)
+            start_date = index.sample_date(regime, random.Random(seed)) if index else None
+        else:
+            try:
+                date_range = fetch_date_range(ticker)
+            except Exception:
+                date_range = None
+            start_date = pick_window_start(date_range, random.Random(seed), required_days) if date_range else None
+        if start_date is not None:
+            window = fetch_window_data(ticker, start_date.strftime('%Y-%m-%d'), required_days)
+            if window is not None and len(window) == required_days:
+                return window
+
+    data = fetch_historical_data(ticker)
+    if data is None: return None
+    if regime:
+        return regimes.select_regime_window(ticker, data, regime, seed)
+    return select_window(data, seed)
+
+def select_window(data, seed):
+    """依種子從完整歷史中截取回測視窗 (觀察期 + 模擬期)，資料不足時回傳 None"""
+    start_indices = select_random_start_index(data, random.Random(seed))
+    if start_indices is None: return None
+    start_view_idx, _ = start_indices
+    data_end_idx = start_view_idx + config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
+    return data.iloc[start_view_idx:data_end_idx].reset_index(drop=True)
+
+def start_simulation(window_data, asset_type, seed):
+    """以截取好的資料視窗啟動模擬 (UI 初始化與無頭回放共用)"""
+    state = _state()
+    state.core_data = window_data
+    state.start_view_index = 0
+    
+    state.current_sim_index = config.INITIAL_OBSERVATION_DAYS
+    
+    state.max_sim_index = len(window_data) - 1
+    state.initialized = True
+    state.sim_active = True
+    state.asset_type = asset_type
+    state.seed = seed
+    state.position_seq = 0
+    state.action_log = []
+    state.order_book = OrderBook()
+    state.equity_curve = [config.INITIAL_CAPITAL]
+    state.result_saved = False
+    
+    date_ts = state.core_data['Date'].iloc[state.current_sim_index]
+    state.start_date = date_ts.to_pydatetime()
+    state.settlement_stats = None
+    state.last_event_msg = None
+    state.snapshots = []
+    _touch(state)
+    _take_snapshot(state)
+
+# --- 逐根快照與回溯 (Rewind) ---
+
+# 每根 K 線開始時 (自動觸發處理完、使用者操作前) 的帳戶狀態
+# 交易紀錄與權益曲線只會附加，快照只記長度；倉位與掛單沒變動時直接沿用上一根快照的物件 (結構共享)
+# 因此每根 K 線只多一個小 tuple，回溯不需重播，與回溯的根數無關
+BarSnapshot = namedtuple('BarSnapshot', [
+    'sim_index', 'balance', 'positions', 'n_transactions', 'n_equity',
+    'position_seq', 'orders', 'order_seq', 'order_version'
+])
+
+def _take_snapshot(state):
+    snapshots = state.get('snapshots')
+    if snapshots is None: return   # 串流模式不保留逐根快照
+    prev = snapshots[-1] if snapshots else None
+    shared = {p['id']: p for p in prev.positions} if prev else {}
+    positions = tuple(shared[p['id']] if shared.get(p['id']) == p else dict(p) for p in state.positions)
+    if prev and len(positions) == len(prev.positions) and all(a is b for a, b in zip(positions, prev.positions)):
+        positions = prev.positions
+
+    book = state.order_book
+    orders = prev.orders if prev and prev.order_version == book.version else tuple(book.to_list())
+    snapshots.append(BarSnapshot(
+        state.current_sim_index, state.balance, positions, len(state.transactions), len(state.equity_curve),
+        state.get('position_seq', 0), orders, book._next_seq, book.version
+    ))
+
+def rewind_to(sim_index):
+    """回到第 sim_index 根 K 線剛開始時的狀態 (之後的交易、權益曲線與快照一併捨棄)；結算後也可回溯"""
+    state = _state()
+    snapshots = state.get('snapshots') or []
+    k = sim_index - config.INITIAL_OBSERVATION_DAYS
+    if not 0 <= k < len(snapshots) or sim_index > state.current_sim_index: return False
+
+    snap = snapshots[k]
+    del snapshots[k + 1:]
+    state.current_sim_index = snap.sim_index
+    state.balance = snap.balance
+    state.positions = [dict(p) for p in snap.positions]
+    del state.transactions[snap.n_transactions:]
+    del state.equity_curve[snap.n_equity:]
+    state.position_seq = snap.position_seq
+    state.order_book = OrderBook.from_list(snap.orders, snap.order_seq, snap.order_version)
+    _touch(state)
+
+    state.sim_active = True
+    state.end_sim_index_on_settle = None
+    state.settlement_stats = None
+    state.result_saved = False
+    current_datetime, _, _ = get_price_info_by_index(state.core_data, sim_index)
+    state.last_event_msg = {'text': f"⏪ 已回到 {current_datetime:%Y/%m/%d}", 'type': 'info'}
+    return True
+
+def rewind_range():
+    """可回溯的 sim_index 範圍 (最早, 最晚)；沒有快照時回傳 None"""
+    state = _state()
+    snapshots = state.get('snapshots') or []
+    if not snapshots: return None
+    return snapshots[0].sim_index, min(snapshots[-1].sim_index, state.current_sim_index)
+
+# --- 使用者操作與操作日誌 (Action Log) ---
+
+ACTION_LOG_VERSION = 1
+
+def validate_sl_tp(pos, sl, tp):
+    """檢查止損/止盈價格是否合理 (UI 與 API 共用)，回傳錯誤訊息；沒有問題時回傳 None"""
+    if sl < 0 or tp < 0:
+        return "止損 / 止盈價格不能為負數 (0 = 不設定)"
+    liq_price = pos.get('liquidation_price', 0.0)
+    cost_price = pos.get('cost', 0.0)
+    direction = config.TRADE_MODE_MAP.get(pos['pos_mode_key'], {}).get('direction', 'Long')
+
+    if liq_price > 0 and sl > 0:
+        if direction == 'Long' and sl <= liq_price:
+            return f"多頭止損 ({sl}) 不能低於強制平倉價 ({liq_price:.2f})！"
+        if direction == 'Short' and sl >= liq_price:
+            return f"空頭止損 ({sl}) 不能高於強制平倉價 ({liq_price:.2f})！"
+    if tp > 0:
+        if direction == 'Long' and tp <= cost_price:
+            return f"多頭止盈 ({tp}) 必須高於開倉價 ({cost_price:.2f})！"
+        if direction == 'Short' and tp >= cost_price:
+            return f"空頭止盈 ({tp}) 必須低於開倉價 ({cost_price:.2f})！"
+    return None
+
+def set_sl_tp(pos_id, sl, tp):
+    """更新倉位的止損/止盈價格 (價格驗證見 validate_sl_tp，由呼叫端負責)"""
+    state = _state()
+    pos = next((p for p in state.positions if p['id'] == pos_id), None)
+    if pos is None: return False
+    pos['sl'] = sl
+    pos['tp'] = tp
+    _touch(state)
+    return True
+
+def set_trailing_stop(pos_id, trail_pct):
+    """設定移動止損百分比 (0 = 關閉)，並以目前開盤價給定初始止損"""
+    state = _state()
+    pos = next((p for p in state.positions if p['id'] == pos_id), None)
+    if pos is None or trail_pct < 0: return False
+    pos['trail_pct'] = trail_pct
+    _touch(state)
+
+    _, open_price, _ = get_price_info_by_index(state.core_data, state.current_sim_index)
+    if trail_pct > 0 and open_price > 0:
+        _trail_stop(pos, open_price, open_price)
+    return True
+
+# --- 掛單 (Pending Orders) ---
+
+def place_order(trade_mode_key, order_type, quantity, price, leverage=1.0, oco=None):
+    """送出限價 / 停損進場委託，於之後的 K 線觸價時成交；回傳委託 ID"""
+    state = _state()
+    if not state.sim_active: return None
+    if quantity <= 0 or price <= 0: return None
+    if trade_mode_key not in config.TRADE_MODE_MAP: return None
+    if order_type not in ORDER_TYPES: return None
+    leverage = _effective_leverage(trade_mode_key, leverage)
+    if leverage is None: return None
+
+    current_datetime, _, _ = get_price_info_by_index(state.core_data, state.current_sim_index)
+    order_id = state.order_book.add(trade_mode_key, order_type, quantity, price, leverage, oco, current_datetime)
+    _touch(state)
+    _toast(f"📝 委託已送出：{quantity:,.3f} @ ${price:,.2f}", icon="📋")
+    return order_id
+
+def place_oco_order(trade_mode_key, quantity, limit_price, stop_price, leverage=1.0):
+    """OCO：同時掛一張限價單與一張停損單，其中一張成交即撤銷另一張"""
+    state = _state()
+    if not state.sim_active: return None
+    if quantity <= 0 or limit_price <= 0 or stop_price <= 0: return None
+    if trade_mode_key not in config.TRADE_MODE_MAP: return None
+    leverage = _effective_leverage(trade_mode_key, leverage)
+    if leverage is None: return None
+
+    current_datetime, _, _ = get_price_info_by_index(state.core_data, state.current_sim_index)
+    group = state.order_book.add_oco(trade_mode_key, quantity, limit_price, stop_price, leverage, current_datetime)
+    _touch(state)
+    _toast(f"📝 OCO 委託已送出：限價 ${limit_price:,.2f} / 停損 ${stop_price:,.2f}", icon="📋")
+    return group
+
+def cancel_order(order_id):
+    state = _state()
+    if state.order_book.cancel(order_id) is None: return False
+    _touch(state)
+    return True
+
+_ACTION_HANDLERS = {
+    'open': execute_trade,
+    'close': lambda pos_id, qty, price: close_position_lot(pos_id, qty, price, reason='手動平倉', mode='手動'),
+    'close_all': lambda: settle_portfolio(),
+    'settle': lambda: settle_portfolio(force_end=True),
+    'sl_tp': set_sl_tp,
+    'trail': set_trailing_stop,
+    'order': place_order,
+    'oco': place_oco_order,
+    'cancel_order': cancel_order,
+    'next_day': next_day,
+    'next_ten_days': next_ten_days,
+    'rewind': rewind_to,
+}
+
+# 連續重複的推進操作合併成 [op, 次數]，讓日誌保持精簡
+_REPEATABLE_ACTIONS = {'next_day', 'next_ten_days'}
+
+def _record_action(state, op, args):
+    log = state.action_log
+    if op in _REPEATABLE_ACTIONS:
+        if log and log[-1][0] == op:
+            log[-1][1] += 1
+        else:
+            log.append([op, 1])
+    else:
+        log.append([op, *(a.item() if isinstance(a, np.generic) else a for a in args)])
+
+def perform_action(op, *args):
+    """執行一個使用者操作並寫入操作日誌 (UI 與回放共用的唯一入口)；操作丟出例外時不寫入日誌，回放才不會重演失敗的操作"""
+    state = _state()
+    handler = _ACTION_HANDLERS[op]
+    result = handler(*args)
+    _record_action(state, op, args)
+    return result
+
+def apply_logged_action(entry):
+    """回放一筆日誌紀錄"""
+    op, *args = entry
+    if op in _REPEATABLE_ACTIONS:
+        for _ in range(args[0]):
+            perform_action(op)
+    else:
+        perform_action(op, *args)
+
+def export_session_log():
+    """匯出可重現本次 session 的精簡日誌 (資料視窗 + 種子 + 操作序列 + 結果摘要)"""
+    state = _state()
+    core_data = state.core_data
+    return {
+        'version': ACTION_LOG_VERSION,
+        'ticker': state.ticker.upper(),
+        'asset_type': state.asset_type,
+        'seed': state.seed,
+        'window_start': core_data['Date'].iloc[0].strftime('%Y-%m-%d'),
+        'window_length': len(core_data),
+        'actions': [list(a) for a in state.action_log],
+        'result': {
+            'sim_index': state.current_sim_index,
+            'balance': state.balance,
+            'asset_value': get_current_asset_value(core_data, state.current_sim_index),
+            'n_transactions': len(state.transactions),
+        },
+    }
\ No newline at end of file
@@ -0,0 +1,157 @@
+# orderbook.py
+# 掛單簿：限價 / 停損進場單與 OCO 委託
+# 依觸發價排序存放，每根 K 線只撮合真正被 High/Low 穿越的委託
+
+import heapq
+
+ORDER_TYPES = ('Limit', 'Stop')
+
+def _side(pos_mode_key):
+    """Spot_Buy / Margin_Long 為買方，Margin_Short 為賣方"""
+    return 'Sell' if pos_mode_key == 'Margin_Short' else 'Buy'
+
+def triggers_on_drop(pos_mode_key, order_type):
+    """
+    買進限價、賣出停損：價格跌到觸發價 (Low <= price) 時成交
+    買進停損、賣出限價：價格漲到觸發價 (High >= price) 時成交
+    """
+    return (_side(pos_mode_key) == 'Buy') == (order_type == 'Limit')
+
+def fill_price(order, open_price):
+    """成交價：開盤跳空越過觸發價時，改以開盤價成交"""
+    price = order['price']
+    if triggers_on_drop(order['pos_mode_key'], order['order_type']):
+        return min(price, open_price)
+    return max(price, open_price)
+
+class OrderBook:
+    """
+    兩個依觸發價排序的堆積，元素為 (排序鍵, seq)：
+    - _drop_heap：Low <= price 觸發，鍵為 -price (價格最高的最先被穿越)
+    - _rise_heap：High >= price 觸發，鍵為 price (價格最低的最先被穿越)
+    撤單只從 _orders 移除 (延遲刪除)，堆積中失效的元素在撮合時跳過、累積過多時整批重建
+    新增 / 撤單 / 每筆成交皆為 O(log n)，撮合成本 O((成交數 + 失效數) log n)，不需掃描全部掛單
+    """
+    def __init__(self):
+        self._orders = {}      # seq -> order dict
+        self._groups = {}      # OCO 群組 -> [seq, ...]
+        self._drop_heap = []
+        self._rise_heap = []
+        self._next_seq = 0
+        self.version = 0       # 每次新增 / 移除掛單 +1 (快照據此判斷掛單是否變動)
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __iter__(self):
+        """依下單順序列出掛單"""
+        return iter(self._orders[seq] for seq in sorted(self._orders))
+
+    def _push(self, order):
+        if triggers_on_drop(order['pos_mode_key'], order['order_type']):
+            heapq.heappush(self._drop_heap, (-order['price'], order['seq']))
+        else:
+            heapq.heappush(self._rise_heap, (order['price'], order['seq']))
+
+    def add(self, pos_mode_key, order_type, qty, price, leverage=1.0, oco=None, placed_date=None):
+        """新增掛單，回傳委託 ID"""
+        if order_type not in ORDER_TYPES:
+            raise ValueError(f"未知的委託類型: {order_type}")
+
+        self._next_seq += 1
+        seq = self._next_seq
+        order = {
+            'id': f"O{seq:07d}", 'seq': seq, 'pos_mode_key': pos_mode_key, 'order_type': order_type,
+            'qty': qty, 'price': price, 'leverage': leverage, 'oco': oco, 'placed_date': placed_date
+        }
+        self._insert(order)
+        return order['id']
+
+    def add_oco(self, pos_mode_key, qty, limit_price, stop_price, leverage=1.0, placed_date=None):
+        """同時掛一張限價單與一張停損單，其中一張成交即撤銷另一張；回傳群組 ID"""
+        group = f"G{self._next_seq + 1:07d}"
+        self.add(pos_mode_key, 'Limit', qty, limit_price, leverage, group, placed_date)
+        self.add(pos_mode_key, 'Stop', qty, stop_price, leverage, group, placed_date)
+        return group
+
+    def get(self, order_id):
+        try:
+            return self._orders.get(int(order_id[1:]))
+        except (TypeError, ValueError):
+            return None
+
+    def _insert(self, order):
+        self.version += 1
+        self._orders[order['seq']] = order
+        self._push(order)
+        if order['oco'] is not None:
+            self._groups.setdefault(order['oco'], []).append(order['seq'])
+
+    def _remove(self, seq):
+        self.version += 1
+        order = self._orders.pop(seq)
+        if order['oco'] is not None:
+            members = self._groups[order['oco']]
+            members.remove(seq)
+            if not members: del self._groups[order['oco']]
+        if len(self._drop_heap) + len(self._rise_heap) > 2 * len(self._orders) + 64:
+            self._compact()
+        return order
+
+    def _compact(self):
+        """失效元素超過一半時，以現存掛單重建兩個堆積 (攤提 O(1))"""
+        self._drop_heap = [(k, seq) for k, seq in self._drop_heap if seq in self._orders]
+        self._rise_heap = [(k, seq) for k, seq in self._rise_heap if seq in self._orders]
+        heapq.heapify(self._drop_heap)
+        heapq.heapify(self._rise_heap)
+
+    @staticmethod
+    def _pop_crossed(heap, limit, live):
+        """彈出鍵 <= limit 的元素，回傳其中仍有效的 seq"""
+        crossed = []
+        while heap and heap[0][0] <= limit:
+            _, seq = heapq.heappop(heap)
+            if seq in live: crossed.append(seq)
+        return crossed
+
+    def cancel(self, order_id):
+        """取消掛單 (同一 OCO 群組的另一邊不受影響)"""
+        order = self.get(order_id)
+        if order is None: return None
+        return self._remove(order['seq'])
+
+    def cancel_group(self, oco):
+        """取消整個 OCO 群組"""
+        for seq in list(self._groups.get(oco, ())):
+            self._remove(seq)
+
+    def match(self, high, low):
+        """
+        取出本根 K 線被穿越的掛單 (依下單順序)
+        OCO：同群組只保留最先下單的一筆，其餘同群組掛單一併撤銷
+        """
+        crossed = sorted(self._pop_crossed(self._drop_heap, -low, self._orders) +
+                         self._pop_crossed(self._rise_heap, high, self._orders))
+
+        filled = []
+        for seq in crossed:
+            if seq not in self._orders: continue   # 已被同群組的 OCO 撤銷
+            order = self._remove(seq)
+            if order['oco'] is not None:
+                self.cancel_group(order['oco'])
+            filled.append(order)
+        return filled
+
+    # --- 序列化 (供快照與匯出使用) ---
+
+    def to_list(self):
+        return [dict(o) for o in self]
+
+    @classmethod
+    def from_list(cls, orders, next_seq=None, version=None):
+        book = cls()
+        for o in orders:
+            book._insert(dict(o))
+        book._next_seq = next_seq if next_seq is not None else max(book._orders, default=0)
+        if version is not None: book.version = version
+        return book
@@ -0,0 +1,103 @@
+# outcomes.py
+# 結算後的 SL/TP 假設分析：每筆已平倉交易若改用不同的止損 / 止盈距離，會在哪一根出場、損益多少
+#
+# 對每筆交易只掃一次剩餘的高低價路徑：累積最低價 / 最高價是單調序列，
+# 任一價位的「第一次觸及」都能以 searchsorted 找到，整個 SL × TP 網格再以廣播一次算完
+# 觸發規則與 logic.check_sl_tp_trigger 相同：進場後下一根起檢查，同一根內 強平 → 止損 → 止盈，以該價位成交；
+# 都沒觸及則持有到模擬結束，以最後一根收盤價結算 (不含移動止損、破產檢查與盤中路徑判定)
+#
+# 用法：
+#   result = outcomes.sltp_outcomes(state.core_data, state.transactions, end_idx)
+#   fig = charts.render_outcome_heatmap(result)
+
+import numpy as np
+import pandas as pd
+import config
+
+def default_grid() -> tuple[np.ndarray, np.ndarray]:
+    """config 設定的 SL / TP 百分比網格"""
+    n = config.OUTCOME_GRID_SIZE
+    return np.linspace(*config.OUTCOME_SL_RANGE, n), np.linspace(*config.OUTCOME_TP_RANGE, n)
+
+def first_touch(path: np.ndarray, levels: np.ndarray, below: bool) -> np.ndarray:
+    """
+    各價位在 path 中第一次被觸及的位置 (below=True：path <= 價位；否則 path >= 價位)，從未觸及為 len(path)
+    """
+    if below:
+        # 累積最低價單調遞減，取負號後即可二分搜尋
+        return np.searchsorted(-np.minimum.accumulate(path), -levels, side='left')
+    return np.searchsorted(np.maximum.accumulate(path), levels, side='left')
+
+def _is_margin(record: dict) -> bool:
+    return record['mode_name'] != config.ASSET_CONFIGS[record['asset']]['mode_spot']
+
+def trade_outcomes(highs, lows, close_end, record: dict, sl_pcts, tp_pcts):
+    """
+    單筆交易在整個網格上的結果：回傳 (淨損益, 出場根數) 兩個 len(sl_pcts) × len(tp_pcts) 陣列
+    highs / lows 為進場後 (下一根起) 到模擬結束的價格路徑
+    """
+    cost, qty = record['open_price'], record['qty']
+    long_ = record['direction'] == 'Long'
+    sign = 1.0 if long_ else -1.0
+    is_margin = _is_margin(record)
+    fee_rate = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
+    n = len(highs)
+
+    sl_prices = cost * (1.0 - sign * sl_pcts / 100.0)
+    tp_prices = cost * (1.0 + sign * tp_pcts / 100.0)
+    # 多單：止損看低價、止盈看高價；空單相反
+    sl_bar = first_touch(lows if long_ else highs, sl_prices, below=long_)[:, None]
+    tp_bar = first_touch(highs if long_ else lows, tp_prices, below=not long_)[None, :]
+    liq_bar = n
+    if is_margin:
+        liq_price = cost * (1.0 - sign / record['leverage'])
+        if liq_price > 0:
+            liq_bar = int(first_touch(lows if long_ else highs, np.array([liq_price]), below=long_)[0])
+
+    # 同一根同時觸及時的優先順序：強平 → 止損 → 止盈
+    exit_bar = np.minimum(np.minimum(sl_bar, tp_bar), liq_bar)
+    exit_price = np.where(exit_bar == liq_bar, liq_price if liq_bar < n else close_end,
+                          np.where(exit_bar == sl_bar, sl_prices[:, None], tp_prices[None, :]))
+    pnl = sign * (exit_price - cost) * qty
+    net_pnl = pnl - qty * cost * fee_rate - qty * exit_price * fee_rate
+    return net_pnl, np.minimum(exit_bar + 1, n)
+
+def sltp_outcomes(core_data: pd.DataFrame, transactions: list[dict], end_idx: int,
+                  sl_pcts: np.ndarray | None = None, tp_pcts: np.ndarray | None = None) -> dict | None:
+    """
+    所有已平倉交易 (部分平倉的每一筆各自計算) 在 SL × TP 網格上的合計結果；沒有交易時回傳 None
+    回傳：sl_pcts, tp_pcts, net_pnl (合計淨損益)、win_rate (%)、avg_bars (平均持有根數)、actual_net_pnl、n_trades
+    """
+    if not transactions:
+        return None
+    if sl_pcts is None or tp_pcts is None:
+        sl_pcts, tp_pcts = default_grid()
+    sl_pcts, tp_pcts = np.asarray(sl_pcts, dtype=float), np.asarray(tp_pcts, dtype=float)
+
+    dates = core_data['Date'].to_numpy(dtype='datetime64[ns]')
+    highs = core_data['High'].to_numpy(dtype=float)
+    lows = core_data['Low'].to_numpy(dtype=float)
+    close_end = float(core_data['Close'].iloc[end_idx])
+
+    shape = (len(sl_pcts), len(tp_pcts))
+    net_total, wins, bars_total = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    for record in transactions:
+        entry_idx = int(np.searchsorted(dates, np.datetime64(pd.Timestamp(record['open_date']), 'ns')))
+        path = slice(entry_idx + 1, end_idx + 1)
+        net_pnl, held = trade_outcomes(highs[path], lows[path], close_end, record, sl_pcts, tp_pcts)
+        net_total += net_pnl
+        wins += net_pnl > 0
+        bars_total += held
+
+    n_trades = len(transactions)
+    return {
+        'sl_pcts': sl_pcts, 'tp_pcts': tp_pcts, 'net_pnl': net_total,
+        'win_rate': wins / n_trades * 100, 'avg_bars': bars_total / n_trades,
+        'actual_net_pnl': float(sum(t['net_pnl'] for t in transactions)), 'n_trades': n_trades,
+    }
+
+def best_cell(result: dict) -> dict:
+    """網格中合計淨損益最高的 SL / TP 組合"""
+    i, j = np.unravel_index(np.argmax(result['net_pnl']), result['net_pnl'].shape)
+    return {'sl_pct': float(result['sl_pcts'][i]), 'tp_pct': float(result['tp_pcts'][j]),
+            'net_pnl': float(result['net_pnl'][i, j]), 'win_rate': float(result['win_rate'][i, j])}
@@ -0,0 +1,250 @@
+# regimes.py
+# 市場情境索引：把每個候選回測視窗依模擬期的走勢標記為 崩盤 / 大漲 / 高波動 / 盤整，可直接依情境抽視窗
+#
+# 對完整歷史做一次向量化掃描 (報酬、最大回撤、已實現波動、RSI 平均)，每個情境存成一組起點陣列，
+# 抽樣只是 randrange + 取值 (O(1))，不需重掃歷史或拒絕抽樣
+# 索引存成 .npz：本地資料包代碼放在資料包版本目錄的 regimes/ 下，其餘放在 config.REGIME_DIR
+#
+# 用法：
+#   python regimes.py build TSLA SYN:JUMP        建立 (或更新) 索引
+#   python regimes.py show TSLA                  各情境的視窗數與範例起點
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+import config
+from data_manager import fetch_historical_data, get_bundle
+
+# 情境代碼 (索引中的 labels 陣列)：0 為未分類
+REGIMES = {'crash': '崩盤', 'rally': '大漲', 'high_vol': '高波動', 'sideways': '盤整'}
+_CODES = {name: code for code, name in enumerate(REGIMES, start=1)}
+
+FORMAT_VERSION = 1
+
+# --- 特徵與分類 ---
+
+def window_features(data: pd.DataFrame, obs_days: int, sim_days: int) -> dict[str, np.ndarray] | None:
+    """
+    每個候選起點 s 的模擬期 [s + obs_days, s + obs_days + sim_days) 特徵：
+    ret 總報酬、drawdown 最大回撤、vol 年化波動、rsi 平均 RSI；資料不足時回傳 None
+    """
+    close = data['Close'].to_numpy(dtype=float)
+    n_starts = len(close) - (obs_days + sim_days) + 1
+    if n_starts <= 0:
+        return None
+
+    a = np.arange(n_starts) + obs_days  # 模擬期第一根
+    b = a + sim_days - 1                # 模擬期最後一根
+    log_close = np.log(close)
+    ret = np.expm1(log_close[b] - log_close[a])
+
+    # 日報酬的前綴和：任一區間的平均 / 變異數都是 O(1)
+    r = np.diff(log_close)
+    cs = np.concatenate([[0.0], np.cumsum(r)])
+    cs2 = np.concatenate([[0.0], np.cumsum(r * r)])
+    m = sim_days - 1
+    mean = (cs[b] - cs[a]) / m
+    vol = np.sqrt(np.maximum((cs2[b] - cs2[a]) / m - mean * mean, 0.0) * 252)
+
+    rsi = np.nan_to_num(data['RSI'].to_numpy(dtype=float), nan=50.0) if 'RSI' in data else np.full(len(close), 50.0)
+    cs_rsi = np.concatenate([[0.0], np.cumsum(rsi)])
+    rsi_mean = (cs_rsi[b + 1] - cs_rsi[a]) / sim_days
+
+    # 最大回撤：滑動視窗上的累積最高價，分塊處理限制暫存陣列大小
+    windows = np.lib.stride_tricks.sliding_window_view(close[obs_days:], sim_days)
+    drawdown = np.empty(n_starts)
+    chunk = max(1, 2 ** 21 // sim_days)
+    for lo in range(0, n_starts, chunk):
+        block = windows[lo:lo + chunk]
+        drawdown[lo:lo + chunk] = (1.0 - block / np.maximum.accumulate(block, axis=1)).max(axis=1)
+
+    return {'ret': ret, 'drawdown': drawdown, 'vol': vol, 'rsi': rsi_mean}
+
+def classify(features: dict[str, np.ndarray]) -> np.ndarray:
+    """
+    依該代碼自身歷史的分位數分類 (各情境約取最極端的 1 - REGIME_QUANTILE)，優先順序 崩盤 → 大漲 → 高波動 → 盤整
+    崩盤 / 大漲另有絕對門檻，平穩的代碼不會把小跌小漲當成崩盤大漲
+    """
+    q = config.REGIME_QUANTILE
+    ret, dd, vol, rsi = features['ret'], features['drawdown'], features['vol'], features['rsi']
+    crash = (dd >= max(np.quantile(dd, q), config.REGIME_CRASH_DRAWDOWN)) & (ret < 0)
+    rally = (ret >= max(np.quantile(ret, q), config.REGIME_RALLY_RETURN)) & ~crash
+    high_vol = (vol >= np.quantile(vol, q)) & ~crash & ~rally
+    sideways = ((np.abs(ret) <= np.quantile(np.abs(ret), 1 - q)) & (vol <= np.median(vol)) & (dd <= np.median(dd))
+                & (np.abs(rsi - 50) <= 5) & ~crash & ~rally & ~high_vol)
+
+    labels = np.zeros(len(ret), dtype=np.int8)
+    for name, mask in (('crash', crash), ('rally', rally), ('high_vol', high_vol), ('sideways', sideways)):
+        labels[mask] = _CODES[name]
+    return labels
+
+# --- 索引 ---
+
+class RegimeIndex:
+    """單一代碼的情境索引：order 依情境排序的起點，offsets[k]:offsets[k+1] 為情境 k 的區段"""
+    def __init__(self, arrays: dict, built_at: float | None = None):
+        self.arrays = arrays
+        self.built_at = built_at if built_at is not None else time.time()
+        self.order = arrays['order']
+        self.offsets = arrays['offsets']
+        self.dates = arrays['dates']
+
+    @classmethod
+    def build(cls, data: pd.DataFrame) -> 'RegimeIndex | None':
+        obs_days, sim_days = config.INITIAL_OBSERVATION_DAYS, config.MIN_SIMULATION_DAYS
+        features = window_features(data, obs_days, sim_days)
+        if features is None:
+            return None
+        labels = classify(features)
+        order = np.argsort(labels, kind='stable').astype(np.int32)
+        offsets = np.searchsorted(labels[order], np.arange(len(REGIMES) + 2)).astype(np.int64)
+        dates = data['Date'].to_numpy(dtype='datetime64[ns]')
+        arrays = {
+            'format_version': np.array(FORMAT_VERSION), 'window': np.array([obs_days, sim_days]),
+            'n_bars': np.array(len(data)), 'first_date': dates[:1].astype('datetime64[D]'),
+            'labels': labels, 'order': order, 'offsets': offsets,
+            'dates': dates[:len(labels)].astype('datetime64[D]'),
+            **{name: values.astype(np.float32) for name, values in features.items()},
+        }
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'RegimeIndex | None':
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        if int(arrays.get('format_version', -1)) != FORMAT_VERSION:
+            return None
+        return cls(arrays, built_at=os.path.getmtime(path))
+
+    def save(self, path: str):
+        """寫入暫存檔再替換，讀取端不會讀到寫一半的檔案"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self.arrays)
+        os.replace(tmp_path, path)
+
+    def matches(self, data: pd.DataFrame | None) -> bool:
+        """視窗長度一致，且與目前資料相同 (data 為 None 時改以 REGIME_MAX_AGE_DAYS 判斷是否過期)"""
+        if tuple(self.arrays['window']) != (config.INITIAL_OBSERVATION_DAYS, config.MIN_SIMULATION_DAYS):
+            return False
+        if data is None:
+            return time.time() - self.built_at <= config.REGIME_MAX_AGE_DAYS * 86400
+        return (int(self.arrays['n_bars']) == len(data) and len(data) > 0
+                and data['Date'].to_numpy(dtype='datetime64[ns]')[:1].astype('datetime64[D]')[0] == self.arrays['first_date'][0])
+
+    def count(self, regime: str) -> int:
+        code = _CODES[regime]
+        return int(self.offsets[code + 1] - self.offsets[code])
+
+    def sample(self, regime: str, rng: random.Random) -> int | None:
+        """抽出符合情境的視窗起點索引 (O(1))，沒有符合的視窗時回傳 None"""
+        code = _CODES[regime]
+        lo, hi = int(self.offsets[code]), int(self.offsets[code + 1])
+        if hi <= lo:
+            return None
+        return int(self.order[lo + rng.randrange(hi - lo)])
+
+    def sample_date(self, regime: str, rng: random.Random) -> pd.Timestamp | None:
+        """同 sample，回傳視窗起點日期 (供只下載回測區段的 Yahoo 代碼使用)"""
+        start = self.sample(regime, rng)
+        return None if start is None else pd.Timestamp(self.dates[start])
+
+# --- 存放位置與快取 ---
+
+_indexes = {}
+
+def index_filename(ticker: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]', '_', ticker.upper()) + '.npz'
+
+def index_path(ticker: str) -> str | None:
+    """本地資料包代碼存在資料包版本目錄下 (與資料一起換版)，其餘存在 REGIME_DIR；未設定則不寫檔"""
+    name = index_filename(ticker)
+    bundle = get_bundle()
+    if bundle is not None and ticker.upper() in bundle:
+        return os.path.join(bundle.path, 'regimes', name)
+    return os.path.join(config.REGIME_DIR, name) if config.REGIME_DIR else None
+
+def get_index(ticker: str, data: pd.DataFrame | None = None) -> RegimeIndex | None:
+    """
+    取得代碼的情境索引：依序查記憶體、磁碟，都不符合時以 data 重建並寫檔
+    data 為 None 時只讀取既有索引 (不下載)，沒有或已過期則回傳 None
+    """
+    ticker = ticker.upper()
+    index = _indexes.get(ticker)
+    if index is None or not index.matches(data):
+        path = index_path(ticker)
+        index = RegimeIndex.load(path) if path and os.path.exists(path) else None
+        if index is None or not index.matches(data):
+            if data is None:
+                return None
+            index = RegimeIndex.build(data)
+            if index is None:
+                return None
+            if path:
+                try:
+                    index.save(path)
+                except OSError:
+                    pass  # 唯讀位置 (例如共用的資料包) 只保留在記憶體
+        _indexes[ticker] = index
+    return index
+
+def select_regime_window(ticker: str, data: pd.DataFrame, regime: str, seed: int) -> pd.DataFrame | None:
+    """
+    依種子從完整歷史中抽出符合情境的回測視窗 (與 logic.select_window 相同長度)
+    資料不足回傳 None；該代碼沒有此情境的視窗時丟出 ValueError
+    """
+    if regime not in REGIMES:
+        raise ValueError(f"未知的情境: {regime} (可用: {', '.join(REGIMES)})")
+    index = get_index(ticker, data)
+    if index is None:
+        return None
+    start = index.sample(regime, random.Random(seed))
+    if start is None:
+        raise ValueError(f"{ticker} 的歷史中沒有「{REGIMES[regime]}」情境的回測區間")
+    end = start + config.INITIAL_OBSERVATION_DAYS + config.MIN_SIMULATION_DAYS
+    return data.iloc[start:end].reset_index(drop=True)
+
+# --- CLI ---
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 市場情境索引")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (('build', "建立 (或更新) 索引"), ('show', "顯示各情境的視窗數與範例起點")):
+        p = sub.add_parser(command, help=help_text)
+        p.add_argument('tickers', nargs='+')
+    args = parser.parse_args(argv)
+
+    for ticker in (t.upper() for t in args.tickers):
+        data = fetch_historical_data(ticker)
+        if data is None:
+            print(f"⚠️ 無法載入 {ticker}")
+            continue
+        t0 = time.perf_counter()
+        index = get_index(ticker, data)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if index is None:
+            print(f"⚠️ {ticker} 資料不足 ({len(data)} 筆)")
+            continue
+        print(f"✅ {ticker}: {len(index.arrays['labels']):,} 個候選視窗 ({elapsed:,.1f} ms) → {index_path(ticker) or '(僅記憶體)'}")
+        for regime, label in REGIMES.items():
+            line = f"  {label:<4}{index.count(regime):>7,}"
+            if args.command == 'show' and index.count(regime):
+                rng = random.Random(0)
+                starts = sorted({index.sample(regime, rng) for _ in range(3)})
+                line += "  例：" + ", ".join(
+                    f"{str(index.dates[s])} (報酬 {index.arrays['ret'][s] * 100:+.0f}% / 回撤 {index.arrays['drawdown'][s] * 100:.0f}%)"
+                    for s in starts)
+            print(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# replay.py
+# 操作日誌回放：以無頭模式 (不經 Streamlit UI) 重新執行一段 session
+# 用途：快速重現使用者回報的問題、以真實 session 語料做引擎回歸測試
+#
+# 用法：python replay.py session1.json [session2.json ...] [--check]
+
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+import config
+import logic
+from data_manager import fetch_window_data, uses_local_data
+
+def load_session_log(path: str) -> dict:
+    """讀取 app 匯出的操作日誌 (JSON)"""
+    with open(path, encoding='utf-8') as f:
+        session_log = json.load(f)
+    if session_log.get('version') != logic.ACTION_LOG_VERSION:
+        raise ValueError(f"不支援的日誌版本: {session_log.get('version')}")
+    return session_log
+
+def locate_window(data: pd.DataFrame, session_log: dict) -> pd.DataFrame:
+    """依日誌中的 window_start / window_length 從完整歷史資料切出回測視窗"""
+    start_ts = pd.Timestamp(session_log['window_start'])
+    start_idx = int(data['Date'].searchsorted(start_ts))
+    if start_idx >= len(data) or data['Date'].iloc[start_idx].normalize() != start_ts:
+        raise ValueError(f"資料中找不到視窗起點 {session_log['window_start']}")
+
+    end_idx = start_idx + session_log['window_length']
+    if end_idx > len(data):
+        raise ValueError("資料長度不足以還原原始視窗")
+    return data.iloc[start_idx:end_idx].reset_index(drop=True)
+
+def load_logged_window(session_log: dict) -> pd.DataFrame:
+    """依日誌的 ticker / window_start / window_length 載入回測視窗 (Yahoo 代碼只下載該視窗)"""
+    ticker = session_log['ticker']
+    if config.WINDOWED_FETCH and not uses_local_data(ticker):
+        # 只下載日誌記錄的區段，不需完整歷史
+        data = fetch_window_data(ticker, session_log['window_start'], session_log['window_length'])
+    else:
+        data = logic.fetch_historical_data(ticker)
+    if data is None:
+        raise ValueError(f"無法載入 {ticker} 的數據")
+    return locate_window(data, session_log)
+
+def replay_session(session_log: dict, data: pd.DataFrame | None = None) -> logic.HeadlessState:
+    """
+    在獨立的 HeadlessState 上回放整段操作
+    data: 該代碼的歷史資料 (需涵蓋日誌中的視窗)，None 則自動載入 (Yahoo 代碼只下載該視窗)
+    """
+    window = load_logged_window(session_log) if data is None else locate_window(data, session_log)
+
+    state = logic.HeadlessState(ticker=session_log['ticker'], asset_type=session_log['asset_type'])
+    with logic.bind_state(state):
+        logic.reset_state()
+        logic.start_simulation(window, session_log['asset_type'], session_log['seed'])
+        for entry in session_log['actions']:
+            logic.apply_logged_action(entry)
+    return state
+
+def compare_result(session_log: dict, state: logic.HeadlessState, tol: float = 1e-6) -> list[str]:
+    """比對回放結果與日誌中記錄的結果，回傳差異描述 (空串列表示一致)"""
+    expected = session_log.get('result') or {}
+    with logic.bind_state(state):
+        actual = logic.export_session_log()['result']
+
+    diffs = []
+    for key, exp_val in expected.items():
+        act_val = actual.get(key)
+        if isinstance(exp_val, float):
+            if act_val is None or abs(act_val - exp_val) > tol * max(1.0, abs(exp_val)):
+                diffs.append(f"{key}: 預期 {exp_val} / 實際 {act_val}")
+        elif act_val != exp_val:
+            diffs.append(f"{key}: 預期 {exp_val} / 實際 {act_val}")
+    return diffs
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 操作日誌回放")
+    parser.add_argument('logs', nargs='+', help="app 匯出的操作日誌 (JSON)")
+    parser.add_argument('--check', action='store_true', help="比對回放結果與日誌記錄的結果")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path in args.logs:
+        session_log = load_session_log(path)
+        t0 = time.perf_counter()
+        state = replay_session(session_log)
+        elapsed = time.perf_counter() - t0
+
+        bars = max(0, state.current_sim_index - config.INITIAL_OBSERVATION_DAYS)
+        speed = bars / elapsed if elapsed > 0 else float('inf')
+        print(f"{path}: {session_log['ticker']} {bars} 根K線 / {elapsed * 1000:.1f} ms ({speed:,.0f} bars/s) "
+              f"餘額 ${state.balance:,.2f} 交易 {len(state.transactions)} 筆")
+
+        if args.check:
+            diffs = compare_result(session_log, state)
+            for d in diffs:
+                print(f"  ❌ {d}")
+            failed += bool(diffs)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# results_store.py
+# 回測結果資料庫 (SQLite)：保存每次結束的回測摘要、交易紀錄與降採樣權益曲線，供跨回測統計
+#
+# 資料表：
+#   runs    每次回測一列 (代碼、資產類型、視窗日期、槓桿、ROI、最大回撤、是否強平...)
+#   trades  每筆平倉紀錄 (run_id 關聯)
+#   equity  降採樣後的權益曲線 (run_id, step)
+#
+# 用法：python results_store.py stats [ksim_results.db] [--ticker TSLA] [--asset-type Stock] [--strategy ma_cross]
+
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+import numpy as np
+import config
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    asset_type TEXT NOT NULL,
+    seed INTEGER,
+    strategy TEXT,
+    leverage REAL NOT NULL,
+    window_start TEXT,
+    window_end TEXT,
+    bars INTEGER,
+    final_asset REAL,
+    roi REAL,
+    max_drawdown REAL,
+    n_trades INTEGER,
+    win_rate REAL,
+    total_fees REAL,
+    liquidated INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_ticker ON runs(ticker);
+CREATE INDEX IF NOT EXISTS idx_runs_asset_type ON runs(asset_type, liquidated);
+CREATE INDEX IF NOT EXISTS idx_runs_window ON runs(window_start, window_end);
+CREATE INDEX IF NOT EXISTS idx_runs_leverage ON runs(leverage, roi);
+
+CREATE TABLE IF NOT EXISTS trades (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    position_id TEXT,
+    mode TEXT,
+    direction TEXT,
+    leverage REAL,
+    open_date TEXT,
+    close_date TEXT,
+    qty REAL,
+    open_price REAL,
+    close_price REAL,
+    pnl REAL,
+    fees REAL,
+    net_pnl REAL,
+    reason TEXT,
+    PRIMARY KEY (run_id, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS equity (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    step INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, step)
+) WITHOUT ROWID;
+"""
+
+RUN_COLUMNS = ['created_at', 'source', 'ticker', 'asset_type', 'seed', 'strategy', 'leverage',
+               'window_start', 'window_end', 'bars', 'final_asset', 'roi', 'max_drawdown',
+               'n_trades', 'win_rate', 'total_fees', 'liquidated']
+
+# --- 摘要 ---
+
+def summarize_run(state, equity: list[float]) -> dict:
+    """單次回測摘要：結算結果、交易統計、最大回撤"""
+    stats = state.settlement_stats or {}
+    final_asset = stats.get('final_asset', state.balance)
+    curve = np.asarray(equity + [final_asset], dtype=float)
+    peaks = np.maximum.accumulate(curve)
+    max_drawdown = float(np.max((peaks - curve) / peaks)) if len(curve) else 0.0
+    transactions = state.transactions
+
+    return {
+        'window_start': state.core_data['Date'].iloc[config.INITIAL_OBSERVATION_DAYS].strftime('%Y-%m-%d'),
+        'window_end': stats['end_date'].strftime('%Y-%m-%d') if stats.get('end_date') else None,
+        'bars': state.current_sim_index - config.INITIAL_OBSERVATION_DAYS,
+        'final_asset': final_asset,
+        'roi': (final_asset - config.INITIAL_CAPITAL) / config.INITIAL_CAPITAL * 100,
+        'max_drawdown': max_drawdown * 100,
+        'n_trades': len(transactions),
+        'win_rate': sum(t['net_pnl'] > 0 for t in transactions) / len(transactions) * 100 if transactions else 0.0,
+        'total_fees': sum(t['fees'] for t in transactions),
+        'liquidated': any('強制平倉' in t['reason'] for t in transactions),
+    }
+
+def downsample(equity, points=None) -> list[float]:
+    """等距抽樣權益曲線 (保留頭尾)，點數不超過 points"""
+    points = points or config.RESULTS_EQUITY_POINTS
+    if len(equity) <= points:
+        return [float(v) for v in equity]
+    idx = np.linspace(0, len(equity) - 1, points).round().astype(int)
+    return np.asarray(equity, dtype=float)[idx].tolist()
+
+def _date_str(value):
+    return value.strftime('%Y-%m-%d') if hasattr(value, 'strftime') else value
+
+def trade_rows(transactions) -> list[tuple]:
+    """交易紀錄轉成 trades 表的欄位 (不含 run_id / seq)"""
+    return [
+        (t['ID'], t['mode_name'], t['direction'], t['leverage'], _date_str(t['open_date']), _date_str(t['close_date']),
+         t['qty'], t['open_price'], t['close_price'], t['pnl'], t['fees'], t['net_pnl'], t['reason'])
+        for t in transactions
+    ]
+
+def session_record(state, source='app', strategy='manual') -> dict:
+    """把已結算的 session (UI 或無頭) 轉成可寫入資料庫的紀錄"""
+    record = {
+        'source': source, 'ticker': state.ticker, 'asset_type': state.asset_type, 'seed': state.get('seed'),
+        'strategy': strategy,
+        'leverage': max((float(t['leverage']) for t in state.transactions), default=1.0),
+    }
+    equity = list(state.get('equity_curve') or [])
+    record.update(summarize_run(state, equity))
+    record['detail'] = {'trades': trade_rows(state.transactions), 'equity': downsample(equity + [record['final_asset']])}
+    return record
+
+# --- 資料庫 ---
+
+class ResultsStore:
+    """SQLite 結果庫；寫入一律整批進行，查詢在資料庫內完成聚合，不需載入 pandas"""
+    def __init__(self, path=None):
+        self.path = path or config.RESULTS_DB
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(f"不支援的結果庫版本: {version}")
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+            self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_runs(self, records) -> list[int]:
+        """
+        整批寫入回測紀錄，回傳各自的 run id
+        record 欄位同 RUN_COLUMNS；可帶 'detail': {'trades': trade_rows(...), 'equity': [...]}
+        有 'error' 的紀錄 (回測失敗) 會略過
+        """
+        records = [r for r in records if not r.get('error')]
+        if not records: return []
+        created_at = datetime.now().isoformat(timespec='seconds')
+
+        with self.conn:
+            # 在同一筆交易內預先配置 id，三張表都能用 executemany 一次寫入
+            self.conn.execute("BEGIN IMMEDIATE")
+            first_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM runs").fetchone()[0]
+            ids = list(range(first_id, first_id + len(records)))
+
+            run_rows, trade_batch, equity_batch = [], [], []
+            for run_id, record in zip(ids, records):
+                values = {'created_at': created_at, 'source': 'batch', 'strategy': None, **record}
+                values['liquidated'] = int(bool(values.get('liquidated')))
+                run_rows.append((run_id, *(values.get(c) for c in RUN_COLUMNS)))
+                detail = record.get('detail') or {}
+                trade_batch.extend((run_id, seq, *row) for seq, row in enumerate(detail.get('trades', [])))
+                equity_batch.extend((run_id, step, value) for step, value in enumerate(detail.get('equity', [])))
+
+            placeholders = ', '.join('?' * (len(RUN_COLUMNS) + 1))
+            self.conn.executemany(f"INSERT INTO runs (id, {', '.join(RUN_COLUMNS)}) VALUES ({placeholders})", run_rows)
+            self.conn.executemany("INSERT INTO trades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", trade_batch)
+            self.conn.executemany("INSERT INTO equity VALUES (?, ?, ?)", equity_batch)
+        return ids
+
+    # --- 查詢 ---
+
+    @staticmethod
+    def _where(filters):
+        clauses, params = [], []
+        for column in ('ticker', 'asset_type', 'strategy', 'source'):
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ''), params
+
+    def median_roi_by_leverage(self, **filters) -> list[dict]:
+        """依槓桿分組 (config.LEVERAGE_BUCKETS) 的回測數、ROI 中位數與平均值；中位數以視窗函數計算"""
+        bounds = sorted(config.LEVERAGE_BUCKETS)
+        bucket_case = 'CASE ' + ' '.join(f"WHEN leverage >= {b} THEN {b}" for b in reversed(bounds)) + ' ELSE 0 END'
+        where, params = self._where(filters)
+        sql = f"""
+            WITH ranked AS (
+                SELECT {bucket_case} AS bucket, roi,
+                       ROW_NUMBER() OVER (PARTITION BY {bucket_case} ORDER BY roi) AS rn,
+                       COUNT(*) OVER (PARTITION BY {bucket_case}) AS n,
+                       AVG(roi) OVER (PARTITION BY {bucket_case}) AS mean_roi
+                FROM runs {where}
+            )
+            SELECT bucket, n, AVG(roi) AS median_roi, mean_roi
+            FROM ranked WHERE rn IN ((n + 1) / 2, (n + 2) / 2)
+            GROUP BY bucket ORDER BY bucket
+        """
+        rows = self.conn.execute(sql, params).fetchall()
+        result = []
+        for bucket, n, median_roi, mean_roi in rows:
+            upper = next((b for b in bounds if b > bucket), None)
+            label = f"{bucket:g}x ~ {upper:g}x" if upper else f"{bucket:g}x 以上"
+            result.append({'bucket': label, 'runs': n, 'median_roi': median_roi, 'mean_roi': mean_roi})
+        return result
+
+    def liquidation_rate_by_asset(self, **filters) -> list[dict]:
+        """各資產類型的回測數與強平比例 (%)"""
+        where, params = self._where(filters)
+        sql = f"""
+            SELECT asset_type, COUNT(*), AVG(liquidated) * 100
+            FROM runs {where} GROUP BY asset_type ORDER BY asset_type
+        """
+        return [{'asset_type': a, 'runs': n, 'liquidation_rate': rate} for a, n, rate in self.conn.execute(sql, params)]
+
+    def run_count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def equity_curve(self, run_id) -> list[float]:
+        return [v for (v,) in self.conn.execute("SELECT value FROM equity WHERE run_id = ? ORDER BY step", (run_id,))]
+
+    def trades(self, run_id) -> list[tuple]:
+        return self.conn.execute("SELECT * FROM trades WHERE run_id = ? ORDER BY seq", (run_id,)).fetchall()
+
+def save_session(state, path=None, source='app') -> int | None:
+    """寫入一個已結算的 session，回傳 run id (path 為空字串表示停用)"""
+    path = config.RESULTS_DB if path is None else path
+    if not path: return None
+    with ResultsStore(path) as store:
+        return store.add_runs([session_record(state, source)])[0]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 回測結果庫統計")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_stats = sub.add_parser('stats', help="槓桿分組 ROI 中位數與各資產強平率")
+    p_stats.add_argument('db', nargs='?', default=config.RESULTS_DB)
+    for name in ('ticker', 'asset-type', 'strategy', 'source'):
+        p_stats.add_argument(f'--{name}')
+    args = parser.parse_args(argv)
+
+    filters = {'ticker': args.ticker.upper() if args.ticker else None, 'asset_type': args.asset_type,
+               'strategy': args.strategy, 'source': args.source}
+    with ResultsStore(args.db) as store:
+        print(f"{args.db}：共 {store.run_count():,} 次回測")
+        print(f"\n{'槓桿':<14}{'次數':>8}{'ROI 中位數':>12}{'ROI 平均':>12}")
+        for row in store.median_roi_by_leverage(**filters):
+            print(f"{row['bucket']:<14}{row['runs']:>8}{row['median_roi']:>+11.2f}%{row['mean_roi']:>+11.2f}%")
+        print(f"\n{'資產類型':<14}{'次數':>8}{'強平率':>12}")
+        for row in store.liquidation_rate_by_asset(**filters):
+            print(f"{row['asset_type']:<14}{row['runs']:>8}{row['liquidation_rate']:>11.1f}%")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
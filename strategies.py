@@ -0,0 +1,118 @@
+# strategies.py
+# 自動交易規則 (Rule Set)：供批次回測等無頭模式使用
+# 每根 K 線開盤時依「前一根收盤後」的指標決定動作，並透過 logic.perform_action 下單
+# (與 UI 共用同一套交易規則，產生的操作日誌也能用 replay.py 回放)
+
+import math
+import config
+import logic
+
+# --- 訊號函式 ---
+# 參數：cols = {欄位: numpy 陣列}、i = 前一根 K 線索引、params = 規則參數、direction = 'Long' / 'Short'
+# 回傳：'enter' (進場/續抱)、'exit' (出場) 或 None (不動作)
+
+def _signal_buy_and_hold(cols, i, params, direction):
+    return 'enter'
+
+def _signal_ma_cross(cols, i, params, direction):
+    fast = cols[f"MA{params.get('fast', 20)}"][i]
+    slow = cols[f"MA{params.get('slow', 60)}"][i]
+    bullish = fast > slow
+    return 'enter' if bullish == (direction == 'Long') else 'exit'
+
+def _signal_rsi_reversion(cols, i, params, direction):
+    rsi = cols['RSI'][i]
+    oversold = rsi < params.get('rsi_low', 30)
+    overbought = rsi > params.get('rsi_high', 70)
+    if direction == 'Long':
+        return 'enter' if oversold else ('exit' if overbought else None)
+    return 'enter' if overbought else ('exit' if oversold else None)
+
+RULES = {
+    'buy_and_hold': _signal_buy_and_hold,
+    'ma_cross': _signal_ma_cross,
+    'rsi_reversion': _signal_rsi_reversion,
+}
+
+def validate_rule(rule: dict):
+    """檢查規則設定，錯誤時丟出 ValueError"""
+    if rule.get('strategy') not in RULES:
+        raise ValueError(f"未知的策略: {rule.get('strategy')} (可用: {', '.join(RULES)})")
+    if rule.get('mode', 'Spot_Buy') not in config.TRADE_MODE_MAP:
+        raise ValueError(f"未知的交易模式: {rule.get('mode')}")
+    error = logic.validate_leverage(rule.get('mode', 'Spot_Buy'), float(rule.get('leverage', 1.0)))
+    if error:
+        raise ValueError(error)
+    if rule['strategy'] == 'ma_cross':
+        for key, default in (('fast', 20), ('slow', 60)):
+            if rule.get(key, default) not in config.MA_PERIODS:
+                raise ValueError(f"MA 週期 {rule.get(key, default)} 不在 config.MA_PERIODS 中")
+
+# --- 執行 ---
+
+def position_size(balance, price, size_pct, leverage, fee_rate, min_qty):
+    """依資金比例換算開倉數量 (保證金 + 開倉手續費不超過該比例)，並向下取整到最小單位"""
+    if price <= 0: return 0.0
+    raw_qty = balance * (size_pct / 100.0) / (price * (1.0 / leverage + fee_rate))
+    return math.floor(raw_qty / min_qty + 1e-9) * min_qty
+
+def make_rule_step(rule: dict, asset_type: str):
+    """
+    把規則編譯成逐根決策函式 step(cols, idx)：在目前綁定的狀態上，以第 idx 根的開盤價依 idx - 1 的訊號下單
+    (批次回測的 run_rule 與串流模式 streaming.py 共用)
+    """
+    validate_rule(rule)
+    signal_fn = RULES[rule['strategy']]
+    mode_key = rule.get('mode', 'Spot_Buy')
+    mode_conf = config.TRADE_MODE_MAP[mode_key]
+    direction = mode_conf['direction']
+    is_margin = mode_conf['type'] == 'Margin'
+    leverage = float(rule.get('leverage', 1.0)) if is_margin else 1.0
+    size_pct = float(rule.get('size_pct', 100.0))
+    sl_pct = float(rule.get('sl_pct', 0.0))
+    tp_pct = float(rule.get('tp_pct', 0.0))
+    trail_pct = float(rule.get('trail_pct', 0.0))
+    min_qty = config.ASSET_CONFIGS[asset_type]['min_qty']
+    sign = 1.0 if direction == 'Long' else -1.0
+
+    def step(cols, idx):
+        state = logic._state()
+        price = float(cols['Open'][idx])
+        signal = signal_fn(cols, idx - 1, rule, direction)
+        holding = [p for p in state.positions if p['pos_mode_key'] == mode_key]
+
+        if signal == 'enter' and not holding:
+            fee_rate = config.LEVERAGE_FEE_RATE if is_margin else config.FEE_RATE
+            qty = position_size(state.balance, price, size_pct, leverage, fee_rate, min_qty)
+            if qty > 0 and logic.perform_action('open', mode_key, qty, price, leverage):
+                pos_id = state.positions[-1]['id']
+                sl = price * (1.0 - sign * sl_pct / 100.0) if sl_pct > 0 else 0.0
+                tp = price * (1.0 + sign * tp_pct / 100.0) if tp_pct > 0 else 0.0
+                if sl or tp:
+                    logic.perform_action('sl_tp', pos_id, sl, tp)
+                if trail_pct > 0:
+                    logic.perform_action('trail', pos_id, trail_pct)
+        elif signal == 'exit' and holding:
+            for pos in holding:
+                logic.perform_action('close', pos['id'], pos['qty'], price)
+
+    return step
+
+def run_rule(state, rule: dict) -> list[float]:
+    """
+    在指定狀態上依規則自動交易直到模擬結束，回傳每根 K 線開盤時的總資產 (權益曲線)
+    rule 範例：{'strategy': 'ma_cross', 'mode': 'Margin_Long', 'leverage': 3, 'size_pct': 50, 'sl_pct': 5, 'tp_pct': 10, 'trail_pct': 0}
+    """
+    step = make_rule_step(rule, state.asset_type)
+    data = state.core_data
+    cols = {name: data[name].to_numpy() for name in data.columns if name != 'Date'}
+
+    equity = []
+    with logic.bind_state(state):
+        while state.sim_active:
+            idx = state.current_sim_index
+            equity.append(logic.get_current_asset_value(data, idx))
+            step(cols, idx)
+            if state.sim_active:
+                logic.perform_action('next_day')
+    return equity
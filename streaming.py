@@ -0,0 +1,346 @@
+# streaming.py
+# 串流模擬 (Paper Trading)：K 線由可替換的資料來源逐根送入，而不是一次載入固定的歷史 DataFrame
+# 每根新 K 線：增量更新指標 (MA / RSI) → 寫入環形緩衝 → 以 logic.py 的規則檢查強平 / SL / TP / 掛單 → (選用) 自動交易規則
+# 記憶體中只保留最近 config.STREAM_BUFFER_BARS 根 K 線，交易紀錄與權益曲線也有上限，可連續執行數週而不成長
+#
+# 資料來源 (--source)：
+#   bars.csv / bars.jsonl          本地回放檔 (欄位 Date, Open, High, Low, Close, Volume)，逐行讀取
+#   tcp:<host>:<port>              以換行分隔的 JSON K 線 (可用 serve 子命令在本機模擬行情伺服器)
+#   SYN:GBM:1 / TSLA ...           一般代碼 (合成資料、資料包或 Yahoo 歷史) 依序回放
+#
+# 用法：
+#   python streaming.py run --source SYN:GBM:1 --warmup 250 --rule '{"strategy": "ma_cross", "mode": "Margin_Long", "leverage": 2}'
+#   python streaming.py serve --source bars.csv --port 8700 --interval 1.0
+#   python streaming.py run --source tcp:127.0.0.1:8700
+
+import sys
+import csv
+import json
+import math
+import time
+import socket
+import argparse
+import socketserver
+import tracemalloc
+from collections import deque
+import numpy as np
+import pandas as pd
+import config
+import logic
+import strategies
+from data_manager import OHLCV_COLUMNS
+
+PRICE_COLUMNS = OHLCV_COLUMNS[1:]
+INDICATOR_COLUMNS = [f'MA{p}' for p in config.MA_PERIODS] + ['RSI']
+
+# --- 資料來源 ---
+# 每個來源都是可迭代物件，依序產出 {Date, Open, High, Low, Close, Volume} 的 dict
+
+def _parse_bar(raw: dict) -> dict:
+    bar = {col: float(raw[col]) for col in PRICE_COLUMNS}
+    bar['Date'] = pd.Timestamp(raw['Date'])
+    return bar
+
+class ReplayFileSource:
+    """本地回放檔 (.csv 或 .jsonl)，逐行讀取 (不把整個檔案載入記憶體)；interval 秒為每根 K 線之間的間隔"""
+    def __init__(self, path, interval=0.0):
+        self.path = path
+        self.interval = interval
+
+    def __iter__(self):
+        with open(self.path, encoding='utf-8', newline='') as f:
+            rows = (json.loads(line) for line in f if line.strip()) if self.path.endswith('.jsonl') else csv.DictReader(f)
+            for row in rows:
+                yield _parse_bar(row)
+                if self.interval: time.sleep(self.interval)
+
+class SocketSource:
+    """TCP 行情來源：每行一根 JSON K 線，連線關閉即結束"""
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def __iter__(self):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+            with conn.makefile('r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield _parse_bar(json.loads(line))
+
+class FrameSource:
+    """把已載入的 DataFrame 依序當作行情回放 (測試與離線展示用)"""
+    def __init__(self, data: pd.DataFrame, interval=0.0):
+        self.data = data
+        self.interval = interval
+
+    def __iter__(self):
+        dates = self.data['Date'].to_numpy()
+        cols = [self.data[col].to_numpy(dtype=float) for col in PRICE_COLUMNS]
+        for i in range(len(dates)):
+            bar = {col: values[i].item() for col, values in zip(PRICE_COLUMNS, cols)}
+            bar['Date'] = pd.Timestamp(dates[i])
+            yield bar
+            if self.interval: time.sleep(self.interval)
+
+def open_source(spec: str, interval=0.0):
+    """依字串建立資料來源 (格式見檔頭)"""
+    if spec.startswith('tcp:'):
+        _, host, port = spec.split(':')
+        return SocketSource(host, int(port))
+    if spec.endswith(('.csv', '.jsonl')):
+        return ReplayFileSource(spec, interval)
+    data = logic.fetch_historical_data(spec.upper())
+    if data is None:
+        raise ValueError(f"無法載入 {spec} 的數據")
+    return FrameSource(data[OHLCV_COLUMNS], interval)
+
+def serve_bars(spec, host='127.0.0.1', port=8700, interval=1.0):
+    """本機行情伺服器 (SocketSource 的測試替身)：每個連線從頭送出 spec 的 K 線"""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for bar in open_source(spec):
+                line = json.dumps({**bar, 'Date': bar['Date'].isoformat()}) + '\n'
+                try:
+                    self.wfile.write(line.encode('utf-8'))
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                if interval: time.sleep(interval)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), Handler) as server:
+        server.daemon_threads = True
+        server.serve_forever()
+
+# --- 增量指標 ---
+
+class IncrementalIndicators:
+    """
+    與 data_manager.add_indicators 相同的 MA / RSI，每根 K 線 O(1) 更新：
+    MA 只保存最近的收盤價 (超過兩倍最長週期才整批丟棄)；RSI 為 Wilder 平滑 (pandas ewm(com=13, adjust=True)) 的遞迴形式
+    """
+    RSI_WINDOW = 14
+
+    def __init__(self):
+        self.closes = []
+        self.keep = max(config.MA_PERIODS)
+        self.prev_close = None
+        self.decay = 1.0 - 1.0 / self.RSI_WINDOW
+        self.gain_num = self.loss_num = self.weight = 0.0
+        self.count = 0
+
+    def update(self, close: float) -> dict:
+        delta = 0.0 if self.prev_close is None else close - self.prev_close
+        self.prev_close = close
+        closes = self.closes
+        closes.append(close)
+        if len(closes) > 2 * self.keep:
+            del closes[:-self.keep]
+
+        values = {}
+        for p in config.MA_PERIODS:
+            values[f'MA{p}'] = math.fsum(closes[-p:]) / p if len(closes) >= p else math.nan
+
+        # adjust=True 的指數加權平均：分子、分母各自遞迴衰減
+        self.gain_num = self.gain_num * self.decay + max(delta, 0.0)
+        self.loss_num = self.loss_num * self.decay + max(-delta, 0.0)
+        self.weight = self.weight * self.decay + 1.0
+        self.count += 1
+        rsi = math.nan
+        if self.count >= self.RSI_WINDOW:
+            avg_gain, avg_loss = self.gain_num / self.weight, self.loss_num / self.weight
+            if avg_loss > 0: rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+            elif avg_gain > 0: rsi = 100.0
+        values['RSI'] = rsi
+        return values
+
+# --- 環形緩衝 ---
+
+class BarRing:
+    """固定容量的 K 線緩衝：每個欄位一條 numpy 陣列，寫滿後覆蓋最舊的一根"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.dates = np.empty(capacity, dtype='datetime64[ns]')
+        self.columns = {col: np.empty(capacity) for col in PRICE_COLUMNS + INDICATOR_COLUMNS}
+        self.size = 0
+        self.head = 0    # 下一根要寫入的位置
+
+    def __len__(self):
+        return self.size
+
+    def append(self, date, values: dict):
+        self.dates[self.head] = np.datetime64(date, 'ns')
+        for col, arr in self.columns.items():
+            arr[self.head] = values[col]
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """依時間順序取出目前緩衝內的 K 線 (每欄一條連續陣列)"""
+        order = (np.arange(self.size) + (self.head - self.size)) % self.capacity
+        data = {'Date': self.dates[order]}
+        data.update({col: arr[order] for col, arr in self.columns.items()})
+        return data
+
+    def frame(self) -> pd.DataFrame:
+        """欄位與 fetch_historical_data 相同的 DataFrame"""
+        return pd.DataFrame(self.arrays(), copy=False)
+
+# --- 串流 session ---
+
+class StreamSession:
+    """
+    以 logic.py 的交易規則處理逐根送入的 K 線
+    前 warmup 根只更新指標 (相當於觀察期)，之後每根新 K 線都等同歷史模擬中的「下一天」：
+    先以新 K 線的高低點檢查強平 / SL / TP / 掛單，再於其開盤價執行自動規則或手動操作
+    """
+    def __init__(self, ticker, asset_type='Stock', warmup=0, rule=None, capacity=None):
+        self.capacity = capacity or config.STREAM_BUFFER_BARS
+        if self.capacity < 2:
+            raise ValueError("環形緩衝至少需要 2 根 K 線")
+        self.state = logic.HeadlessState(ticker=ticker, asset_type=asset_type)
+        self.ring = BarRing(self.capacity)
+        self.indicators = IncrementalIndicators()
+        self.warmup = warmup
+        self.step = strategies.make_rule_step(rule, asset_type) if rule else None
+        self.bars_seen = 0
+        self.listeners = []   # 每根 K 線處理完後呼叫 listener(session, bar)
+
+    @property
+    def live(self):
+        return bool(self.state.get('initialized')) and self.state.sim_active
+
+    def _start(self, frame):
+        state = self.state
+        with logic.bind_state(state):
+            logic.reset_state()
+        state.core_data = frame
+        state.current_sim_index = state.max_sim_index = len(frame) - 1
+        state.initialized = True
+        state.sim_active = True
+        state.equity_curve = deque([config.INITIAL_CAPITAL], maxlen=self.capacity)
+        state.snapshots = None
+        state.start_date = frame['Date'].iloc[-1].to_pydatetime()
+
+    def on_bar(self, bar: dict):
+        """處理一根新的 K 線"""
+        self.ring.append(bar['Date'], {**bar, **self.indicators.update(bar['Close'])})
+        self.bars_seen += 1
+        if self.bars_seen > self.warmup and (self.live or not self.state.get('initialized')):
+            self._trade(self.ring.arrays())
+        for listener in self.listeners:
+            listener(self, bar)
+
+    def _trade(self, cols):
+        frame = pd.DataFrame(cols, copy=False)
+        state = self.state
+        if not state.get('initialized'):
+            self._start(frame)
+        else:
+            # 新 K 線永遠在緩衝的最後一格，上一根在倒數第二格 (緩衝寫滿後最舊的一根被擠掉，索引整體前移)
+            state.core_data = frame
+            state.current_sim_index = len(frame) - 2
+            state.max_sim_index = len(frame) - 1
+            with logic.bind_state(state):
+                logic._advance_one_day()
+
+        if self.step is not None and self.live:
+            with logic.bind_state(state):
+                self.step(cols, state.current_sim_index)
+        self._trim()
+
+    def _trim(self):
+        """交易紀錄與操作日誌只保留最近 STREAM_MAX_RECORDS 筆 (超過兩倍才整批刪除，攤提為 O(1))"""
+        limit = config.STREAM_MAX_RECORDS
+        for records in (self.state.get('transactions'), self.state.get('action_log')):
+            if records is not None and len(records) > 2 * limit:
+                del records[:-limit]
+
+    def act(self, op, *args):
+        """手動操作 (與 UI 相同的 perform_action)，例如 act('open', 'Margin_Long', 10, session.price(), 2.0)"""
+        with logic.bind_state(self.state):
+            return logic.perform_action(op, *args)
+
+    def price(self) -> float:
+        """目前可成交的價格 (最新一根 K 線的開盤價，與歷史模擬相同)"""
+        return logic._bar_value(self.state.core_data, 'Open', self.state.current_sim_index)
+
+    def asset_value(self) -> float:
+        with logic.bind_state(self.state):
+            return logic.get_current_asset_value(self.state.core_data, self.state.current_sim_index)
+
+    def chart(self):
+        """以緩衝內的 K 線繪圖 (圖表隨新 K 線往右延伸，寬度固定)"""
+        import charts
+        state = self.state
+        return charts.render_main_chart(state.ticker, state.core_data, state.current_sim_index, state.positions,
+                                        None, pending_orders=list(state.order_book))
+
+    def run(self, source, max_bars=None):
+        for bar in source:
+            self.on_bar(bar)
+            if max_bars and self.bars_seen >= max_bars:
+                break
+
+# --- 命令列 ---
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 串流模擬 (Paper Trading)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run', help="逐根處理資料來源的 K 線")
+    p_run.add_argument('--source', required=True)
+    p_run.add_argument('--ticker', help="顯示用代碼 (預設同 --source)")
+    p_run.add_argument('--asset-type', default='Stock')
+    p_run.add_argument('--warmup', type=int, default=config.WARMUP_BARS, help="前幾根只更新指標不交易")
+    p_run.add_argument('--rule', help="自動交易規則 (JSON，格式同 batch_runner)")
+    p_run.add_argument('--interval', type=float, default=0.0, help="回放檔每根 K 線的間隔秒數")
+    p_run.add_argument('--max-bars', type=int)
+    p_run.add_argument('--report-every', type=int, default=1000, help="每幾根 K 線輸出一次延遲")
+    p_run.add_argument('--memory', action='store_true', help="同時以 tracemalloc 量測記憶體 (會明顯拖慢執行)")
+    p_serve = sub.add_parser('serve', help="本機行情伺服器 (SocketSource 測試用)")
+    p_serve.add_argument('--source', required=True)
+    p_serve.add_argument('--host', default='127.0.0.1')
+    p_serve.add_argument('--port', type=int, default=8700)
+    p_serve.add_argument('--interval', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        print(f"📡 行情伺服器 tcp:{args.host}:{args.port} ({args.source}，每 {args.interval} 秒一根)")
+        try:
+            serve_bars(args.source, args.host, args.port, args.interval)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    rule = json.loads(args.rule) if args.rule else None
+    session = StreamSession((args.ticker or args.source).upper(), args.asset_type, args.warmup, rule)
+    latencies = []
+    if args.memory:
+        tracemalloc.start()
+
+    def report(s, bar):
+        latencies.append(time.perf_counter() - tick[0])
+        if s.bars_seen % args.report_every == 0:
+            lat = np.asarray(latencies) * 1e6
+            mem = f"  記憶體 {tracemalloc.get_traced_memory()[0] / 1024 / 1024:6.2f} MiB" if args.memory else ''
+            value = f"${s.asset_value():,.2f}" if s.state.get('initialized') else '-'
+            print(f"{s.bars_seen:>9,} 根  {bar['Date']:%Y-%m-%d}  資產 {value:>14}  "
+                  f"每根 p50 {np.percentile(lat, 50):6.0f} µs / p99 {np.percentile(lat, 99):6.0f} µs{mem}", flush=True)
+            latencies.clear()
+
+    tick = [0.0]
+    session.listeners.append(report)
+    for bar in open_source(args.source, args.interval):
+        tick[0] = time.perf_counter()
+        session.on_bar(bar)
+        if args.max_bars and session.bars_seen >= args.max_bars:
+            break
+
+    state = session.state
+    if state.get('initialized'):
+        print(f"✅ 共 {session.bars_seen:,} 根 K 線 / 最終資產 ${session.asset_value():,.2f} / "
+              f"{'進行中' if state.sim_active else '已結束'}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
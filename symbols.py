@@ -0,0 +1,248 @@
+# symbols.py
+# 本地代碼目錄：代碼、名稱、資產類型與可用日期範圍，存成 JSON 並建立前綴索引
+# 側邊欄的代碼自動完成、資產類型預選與代碼檢查都在本機完成，打錯字不必等一次失敗的 yf.download
+#
+# 目錄來源 (後者覆蓋前者)：內建常用代碼 → config.SYMBOL_DIRECTORY 檔案 → 本地資料包 (含日期範圍)
+#
+# 用法：
+#   python symbols.py build [--tickers 2454.TW ...]   以 Yahoo 月線查詢各代碼的日期範圍並寫入目錄檔
+#   python symbols.py search TS
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import functools
+import threading
+from bisect import bisect_left
+import numpy as np
+import config
+
+DIRECTORY_VERSION = 1
+ASSET_TYPES = ('Stock', 'Forex', 'Crypto')
+
+# 內建常用代碼 (代碼, 名稱, 資產類型)；日期範圍由 build 或資料包補上
+BUILTIN_SYMBOLS = [
+    ('AAPL', 'Apple', 'Stock'), ('MSFT', 'Microsoft', 'Stock'), ('GOOGL', 'Alphabet', 'Stock'),
+    ('AMZN', 'Amazon', 'Stock'), ('META', 'Meta Platforms', 'Stock'), ('NVDA', 'NVIDIA', 'Stock'),
+    ('TSLA', 'Tesla', 'Stock'), ('AMD', 'Advanced Micro Devices', 'Stock'), ('INTC', 'Intel', 'Stock'),
+    ('NFLX', 'Netflix', 'Stock'), ('TSM', 'Taiwan Semiconductor ADR', 'Stock'), ('AVGO', 'Broadcom', 'Stock'),
+    ('JPM', 'JPMorgan Chase', 'Stock'), ('BAC', 'Bank of America', 'Stock'), ('KO', 'Coca-Cola', 'Stock'),
+    ('DIS', 'Walt Disney', 'Stock'), ('BA', 'Boeing', 'Stock'), ('XOM', 'Exxon Mobil', 'Stock'),
+    ('SPY', 'SPDR S&P 500 ETF', 'Stock'), ('QQQ', 'Invesco QQQ ETF', 'Stock'), ('GLD', 'SPDR Gold Shares', 'Stock'),
+    ('^GSPC', 'S&P 500 Index', 'Stock'), ('^IXIC', 'Nasdaq Composite', 'Stock'), ('^TWII', '台灣加權指數', 'Stock'),
+    ('2330.TW', '台積電', 'Stock'), ('2317.TW', '鴻海', 'Stock'), ('2454.TW', '聯發科', 'Stock'),
+    ('2412.TW', '中華電', 'Stock'), ('0050.TW', '元大台灣50', 'Stock'), ('2603.TW', '長榮', 'Stock'),
+    ('JPY=X', 'USD/JPY', 'Forex'), ('TWD=X', 'USD/TWD', 'Forex'), ('EURUSD=X', 'EUR/USD', 'Forex'),
+    ('GBPUSD=X', 'GBP/USD', 'Forex'), ('AUDUSD=X', 'AUD/USD', 'Forex'), ('CNY=X', 'USD/CNY', 'Forex'),
+    ('HKD=X', 'USD/HKD', 'Forex'), ('CHF=X', 'USD/CHF', 'Forex'), ('CAD=X', 'USD/CAD', 'Forex'),
+    ('BTC-USD', 'Bitcoin', 'Crypto'), ('ETH-USD', 'Ethereum', 'Crypto'), ('SOL-USD', 'Solana', 'Crypto'),
+    ('BNB-USD', 'BNB', 'Crypto'), ('XRP-USD', 'XRP', 'Crypto'), ('ADA-USD', 'Cardano', 'Crypto'),
+    ('DOGE-USD', 'Dogecoin', 'Crypto'), ('LTC-USD', 'Litecoin', 'Crypto'),
+    ('SYN:GBM', '合成資料：幾何布朗運動', 'Stock'), ('SYN:JUMP', '合成資料：跳躍擴散 + 波動率切換', 'Stock'),
+]
+
+def infer_asset_type(symbol: str) -> str:
+    """依 Yahoo 代碼慣例推測資產類型 (=X 匯率、-USD 加密貨幣，其餘視為股票)"""
+    if symbol.endswith('=X'): return 'Forex'
+    if symbol.endswith('-USD'): return 'Crypto'
+    return 'Stock'
+
+# --- 目錄檔 ---
+
+def _entry(name='', asset_type=None, first_date=None, last_date=None, symbol=''):
+    return {'name': name, 'asset_type': asset_type or infer_asset_type(symbol),
+            'first_date': first_date, 'last_date': last_date}
+
+def read_directory_file(path: str) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != DIRECTORY_VERSION:
+        raise ValueError(f"不支援的代碼目錄版本: {data.get('version')}")
+    return data['symbols']
+
+def write_directory_file(symbols: dict, path: str):
+    """寫到暫存檔再 os.replace，讀取端不會看到寫到一半的檔案 (暫存檔名各自獨立，同時寫入不會互相覆寫)"""
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False) as f:
+        json.dump({'version': DIRECTORY_VERSION, 'symbols': symbols}, f, ensure_ascii=False, indent=1, sort_keys=True)
+    try:
+        os.replace(f.name, path)
+    except OSError:
+        os.unlink(f.name)
+        raise
+
+def load_directory(path: str | None = None) -> dict:
+    """合併內建清單、目錄檔與本地資料包，回傳 代碼 -> {name, asset_type, first_date, last_date}"""
+    path = config.SYMBOL_DIRECTORY if path is None else path
+    symbols = {s: _entry(name, asset_type) for s, name, asset_type in BUILTIN_SYMBOLS}
+    for symbol, info in read_directory_file(path).items():
+        symbols[symbol] = {**symbols.get(symbol, _entry(symbol=symbol)), **info}
+
+    if config.BUNDLE_DIR:
+        from data_manager import get_bundle
+        for symbol, info in get_bundle().symbols.items():
+            entry = symbols.setdefault(symbol, _entry(symbol=symbol))
+            entry['first_date'], entry['last_date'] = info['first_date'], info['last_date']
+            entry['local'] = True
+    return symbols
+
+# --- 前綴索引 ---
+
+class SymbolIndex:
+    """
+    兩條排序好的鍵陣列 + bisect：代碼本身一條、名稱中的每個單字一條
+    查詢前綴 q：bisect 找到第一個 >= q 的鍵後往後取，遇到不以 q 開頭或取滿 limit 筆即停，成本 O(log n + limit)
+    """
+    def __init__(self, symbols: dict):
+        self.symbols = symbols
+        self._symbol_keys = sorted((symbol.upper(), symbol) for symbol in symbols)
+        self._name_keys = sorted(
+            (word, symbol) for symbol, info in symbols.items()
+            for word in info.get('name', '').upper().replace('/', ' ').split()
+        )
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
+
+    def get(self, symbol):
+        return self.symbols.get(symbol)
+
+    def search(self, prefix: str, limit: int = 10) -> list[str]:
+        """前綴搜尋：完全相符優先，其次代碼前綴相符，最後名稱單字前綴相符"""
+        q = prefix.strip().upper()
+        if not q: return []
+        results = [q] if q in self.symbols else []
+        for keys in (self._symbol_keys, self._name_keys):
+            i = bisect_left(keys, (q,))
+            while i < len(keys) and len(results) < limit and keys[i][0].startswith(q):
+                symbol = keys[i][1]
+                if symbol not in results: results.append(symbol)
+                i += 1
+        return results
+
+@functools.lru_cache(maxsize=4)
+def _build_index(path, mtime, bundle_dir):
+    return SymbolIndex(load_directory(path))
+
+def get_index(path: str | None = None) -> SymbolIndex:
+    """取得代碼索引 (目錄檔修改後自動重建)"""
+    path = config.SYMBOL_DIRECTORY if path is None else path
+    mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+    return _build_index(path, mtime, config.BUNDLE_DIR)
+
+_remember_lock = threading.Lock()   # 各 session 共用目錄檔：讀取-合併-寫回需序列化，避免互相蓋掉新增的代碼
+
+def remember(symbol: str, asset_type: str, path: str | None = None):
+    """成功載入的代碼寫回目錄檔，之後可直接自動完成並預選資產類型 (寫入失敗不影響載入)"""
+    path = config.SYMBOL_DIRECTORY if path is None else path
+    if not path or symbol.startswith(config.SYNTHETIC_PREFIX): return
+    known = get_index(path).get(symbol)
+    if known and known['asset_type'] == asset_type: return
+    with _remember_lock:
+        try:
+            symbols = read_directory_file(path)
+            symbols[symbol] = {**symbols.get(symbol, _entry(symbol=symbol)), 'asset_type': asset_type}
+            write_directory_file(symbols, path)
+        except OSError:
+            pass   # 目錄檔只是自動完成的輔助資料 (例如唯讀目錄)，寫不進去就略過
+
+# --- 代碼檢查 (不連網) ---
+
+def validate_ticker(ticker: str, asset_type: str, index: SymbolIndex | None = None) -> str | None:
+    """檢查代碼與資產類型是否相符、目錄中的日期範圍是否足夠；通過回傳 None，否則回傳錯誤訊息"""
+    if ticker.startswith(config.SYNTHETIC_PREFIX):
+        from synthetic import parse_ticker
+        try:
+            parse_ticker(ticker)
+        except ValueError as e:
+            return f"錯誤：{e}"
+        return None
+
+    index = index or get_index()
+    entry = index.get(ticker)
+    if entry is not None:
+        if entry['asset_type'] != asset_type:
+            return f"錯誤：{ticker} ({entry['name'] or '目錄'}) 屬於「{entry['asset_type']}」，請改選對應的資產類型。"
+        if entry.get('first_date') and entry.get('last_date'):
+            # 連觀察期 + 指標暖機都不夠時，下載了也無法開始回測
+            required = config.INITIAL_OBSERVATION_DAYS + config.WARMUP_BARS
+            if np.busday_count(entry['first_date'], entry['last_date']) < required:
+                return f"錯誤：{ticker} 只有 {entry['first_date']} ~ {entry['last_date']} 的資料，不足觀察期所需的 {required} 個交易日。"
+        return None
+
+    if not ticker.isascii() or ' ' in ticker:
+        return f"錯誤：{ticker} 不是有效的代碼，請從「建議代碼」中選擇。"
+    if asset_type == 'Forex' and not ticker.endswith('=X'):
+        return f"錯誤：匯率代碼通常以 '=X' 結尾 (例如 JPY=X)。您輸入的是 {ticker}。"
+    if asset_type == 'Crypto' and not ticker.endswith('-USD'):
+        return f"錯誤：加密貨幣代碼通常以 '-USD' 結尾 (例如 BTC-USD)。您輸入的是 {ticker}。"
+    if asset_type == 'Stock' and (ticker.endswith('=X') or ticker.endswith('-USD')):
+        return "錯誤：您選擇了「股票」，但輸入的代碼看起來像匯率或加密貨幣。"
+    if config.SYMBOL_STRICT:
+        suggestions = index.search(ticker[:2], limit=5)
+        hint = f" 您是不是要找：{', '.join(suggestions)}" if suggestions else ""
+        return f"錯誤：{ticker} 不在本地代碼目錄中。{hint}"
+    return None
+
+# --- 命令列 ---
+
+def build(tickers, path):
+    """以 Yahoo 月線查詢每個代碼的日期範圍 (與 data_manager.fetch_date_range 相同的輕量查詢)"""
+    from data_manager import download_ohlcv
+    symbols = read_directory_file(path)
+    known = load_directory(path)
+    targets = list(dict.fromkeys([s for s in known if not s.startswith(config.SYNTHETIC_PREFIX)] + tickers))
+    failed = []
+    for symbol in targets:
+        try:
+            data = download_ohlcv(symbol, interval='1mo')
+        except Exception:
+            data = None
+        if data is None or data.empty:
+            failed.append(symbol)
+            continue
+        entry = {**known.get(symbol, _entry(symbol=symbol)), **symbols.get(symbol, {})}
+        entry.pop('local', None)
+        entry['first_date'] = data['Date'].iloc[0].strftime('%Y-%m-%d')
+        entry['last_date'] = data['Date'].iloc[-1].strftime('%Y-%m-%d')
+        symbols[symbol] = entry
+    write_directory_file(symbols, path)
+    return len(targets) - len(failed), failed
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ksim 本地代碼目錄")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help="查詢日期範圍並寫入目錄檔")
+    p_build.add_argument('--tickers', nargs='*', default=[], help="額外加入的代碼")
+    p_search = sub.add_parser('search', help="前綴搜尋")
+    p_search.add_argument('prefix')
+    parser.add_argument('--path', default=config.SYMBOL_DIRECTORY)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        ok, failed = build([t.upper() for t in args.tickers], args.path)
+        print(f"✅ {ok} 個代碼已更新 → {args.path}")
+        if failed: print(f"⚠️ 查詢失敗: {', '.join(failed)}")
+        return 0
+
+    index = get_index(args.path)
+    t0 = time.perf_counter()
+    results = index.search(args.prefix)
+    elapsed = time.perf_counter() - t0
+    for symbol in results:
+        info = index.get(symbol)
+        span = f"{info['first_date']} ~ {info['last_date']}" if info.get('first_date') else ''
+        print(f"  {symbol:<12}{info['asset_type']:<8}{info['name']:<28}{span}")
+    print(f"({len(results)} 筆 / 目錄 {len(index)} 筆 / {elapsed * 1e6:.0f} µs)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
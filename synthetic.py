@@ -0,0 +1,161 @@
+# synthetic.py
+# 合成 OHLCV 資料來源：不需連網即可產生大量擬真日線 (供測試、效能壓測與離線展示)
+#
+# 代碼格式 (在 app / batch_runner / replay 中可直接當作一般代碼使用)：
+#   SYN:GBM[:種子]             幾何布朗運動
+#   SYN:JUMP[:種子]            跳躍擴散 + 兩狀態波動率切換 (平靜 / 恐慌)
+#   SYN:BOOT:<代碼>[:種子]     以真實歷史資料 (資料包或 Yahoo 快取) 做區塊重抽樣
+#
+# 全部以 NumPy 向量化產生，百萬根 K 線在數秒內完成；輸出欄位與 fetch_historical_data 相同
+
+import functools
+import numpy as np
+import pandas as pd
+import config
+from data_manager import OHLCV_COLUMNS, add_indicators, fetch_historical_data
+
+TRADING_DAYS = 252
+
+# --- K 線組裝 ---
+
+def _dates(n, start=None):
+    """從 start 起連續 n 個工作日 (datetime64[s]，超過 pandas 奈秒範圍也能表示)"""
+    start = np.datetime64(start or config.SYNTHETIC_START, 'D')
+    days = np.busday_offset(start, np.arange(n), roll='forward')
+    return days.astype('datetime64[s]')
+
+def _bars_from_returns(log_ret, daily_vol, rng, s0, start=None) -> pd.DataFrame:
+    """
+    由收盤對數報酬組出 OHLCV：開盤跳空、盤中高低點與成交量依當日波動率隨機產生
+    daily_vol 可為純量或與 log_ret 等長的陣列 (波動率切換模型)
+    """
+    n = len(log_ret)
+    close = s0 * np.exp(np.cumsum(log_ret))
+    prev_close = np.concatenate(([s0], close[:-1]))
+    open_ = prev_close * np.exp(rng.normal(0.0, 0.25, n) * daily_vol)
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0.0, 0.5, n)) * daily_vol)
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0.0, 0.5, n)) * daily_vol)
+    volume = np.round(rng.lognormal(13.0, 0.4, n) * (1.0 + 20.0 * np.abs(log_ret)))
+    return pd.DataFrame({'Date': _dates(n, start), 'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume})
+
+# --- 模型 ---
+
+def gbm(n: int, seed: int = 0, s0: float = 100.0, mu: float = 0.07, sigma: float = 0.25, start=None) -> pd.DataFrame:
+    """幾何布朗運動 (mu / sigma 為年化值)"""
+    rng = np.random.default_rng(seed)
+    daily_vol = sigma / np.sqrt(TRADING_DAYS)
+    drift = (mu - 0.5 * sigma ** 2) / TRADING_DAYS
+    log_ret = drift + daily_vol * rng.standard_normal(n)
+    return _bars_from_returns(log_ret, daily_vol, rng, s0, start)
+
+def _regime_path(n, mean_durations, rng):
+    """兩狀態馬可夫鏈：各狀態停留天數為幾何分布，回傳每根 K 線所屬狀態 (0 / 1)"""
+    p = 1.0 / np.asarray(mean_durations, dtype=float)
+    # 預估足夠的狀態段數，一次抽完後以 np.repeat 展開
+    segments = int(n * p.mean() * 2) + 4
+    first = rng.integers(0, 2)
+    states = (first + np.arange(segments)) % 2
+    durations = rng.geometric(p[states])
+    while durations.sum() < n:
+        extra = (states[-1] + 1 + np.arange(segments)) % 2
+        states = np.concatenate((states, extra))
+        durations = np.concatenate((durations, rng.geometric(p[extra])))
+    return np.repeat(states, durations)[:n]
+
+def regime_jump(n: int, seed: int = 0, s0: float = 100.0,
+                mus=(0.15, -0.10), sigmas=(0.15, 0.45), mean_durations=(250, 60),
+                jump_rate: float = 4.0, jump_mean: float = -0.01, jump_std: float = 0.06, start=None) -> pd.DataFrame:
+    """
+    跳躍擴散 + 波動率切換
+    mus / sigmas：兩個狀態的年化報酬與波動率；mean_durations：各狀態平均持續天數
+    jump_rate：每年平均跳躍次數；jump_mean / jump_std：單次跳躍的對數報酬分布
+    """
+    rng = np.random.default_rng(seed)
+    regime = _regime_path(n, mean_durations, rng)
+    mu = np.asarray(mus)[regime]
+    sigma = np.asarray(sigmas)[regime]
+    daily_vol = sigma / np.sqrt(TRADING_DAYS)
+
+    # 同一天 k 次跳躍的總和 ~ N(k * mean, k * std^2)
+    k = rng.poisson(jump_rate / TRADING_DAYS, n)
+    jumps = k * jump_mean + np.sqrt(k) * jump_std * rng.standard_normal(n)
+    log_ret = (mu - 0.5 * sigma ** 2) / TRADING_DAYS + daily_vol * rng.standard_normal(n) + jumps
+    return _bars_from_returns(log_ret, daily_vol, rng, s0, start)
+
+def block_bootstrap(source: pd.DataFrame, n: int, seed: int = 0, block: int = 20, s0: float | None = None, start=None) -> pd.DataFrame:
+    """
+    區塊重抽樣：從真實資料隨機抽取連續 block 根 K 線拼接，保留短期自相關與波動叢聚
+    每根 K 線以「相對前一日收盤」的形狀 (開 / 高 / 低 / 收) 搬移，成交量原樣沿用
+    """
+    close = source['Close'].to_numpy(dtype=float)
+    if len(close) < block + 2:
+        raise ValueError("來源資料太短，無法做區塊重抽樣")
+    prev = close[:-1]
+    rel = {col: np.log(source[col].to_numpy(dtype=float)[1:] / prev) for col in ('Open', 'High', 'Low', 'Close')}
+    volume = source['Volume'].to_numpy(dtype=float)[1:]
+
+    rng = np.random.default_rng(seed)
+    m = len(prev)
+    n_blocks = -(-n // block)
+    idx = (rng.integers(0, m - block + 1, n_blocks)[:, None] + np.arange(block)).ravel()[:n]
+
+    s0 = float(close[0]) if s0 is None else s0
+    new_close = s0 * np.exp(np.cumsum(rel['Close'][idx]))
+    new_prev = np.concatenate(([s0], new_close[:-1]))
+    return pd.DataFrame({
+        'Date': _dates(n, start),
+        'Open': new_prev * np.exp(rel['Open'][idx]),
+        'High': new_prev * np.exp(rel['High'][idx]),
+        'Low': new_prev * np.exp(rel['Low'][idx]),
+        'Close': new_close,
+        'Volume': volume[idx],
+    })
+
+# --- 代碼解析 ---
+
+def is_synthetic(ticker: str) -> bool:
+    return ticker.upper().startswith(config.SYNTHETIC_PREFIX)
+
+def parse_ticker(ticker: str) -> tuple[str, str | None, int]:
+    """'SYN:BOOT:TSLA:7' -> ('BOOT', 'TSLA', 7)；種子省略時為 0"""
+    parts = ticker.upper()[len(config.SYNTHETIC_PREFIX):].split(':')
+    model = parts[0]
+    if model not in ('GBM', 'JUMP', 'BOOT'):
+        raise ValueError(f"未知的合成模型: {model} (可用: GBM, JUMP, BOOT)")
+    source = None
+    if model == 'BOOT':
+        if len(parts) < 2 or not parts[1]:
+            raise ValueError("SYN:BOOT 需要指定來源代碼，例如 SYN:BOOT:TSLA")
+        source = parts[1]
+        parts = parts[1:]
+    seed = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+    return model, source, seed
+
+def generate_ohlcv(ticker: str, n: int | None = None) -> pd.DataFrame:
+    """依合成代碼產生 OHLCV (未計算指標)"""
+    model, source, seed = parse_ticker(ticker)
+    n = n or config.SYNTHETIC_BARS
+    if model == 'GBM':
+        return gbm(n, seed)
+    if model == 'JUMP':
+        return regime_jump(n, seed)
+
+    real = fetch_historical_data(source)
+    if real is None:
+        raise ValueError(f"無法載入 SYN:BOOT 的來源 {source}")
+    return block_bootstrap(real[OHLCV_COLUMNS], n, seed)
+
+@functools.lru_cache(maxsize=32)
+def _synthetic_frame(ticker: str) -> pd.DataFrame | None:
+    try:
+        return add_indicators(generate_ohlcv(ticker))
+    except ValueError:
+        return None
+
+def fetch_synthetic_data(ticker: str) -> pd.DataFrame | None:
+    """
+    fetch_historical_data 的合成版本：相同代碼永遠得到相同資料 (可回放)
+    快取的 DataFrame 不外流：每次回傳副本 (與 st.cache_data 相同)，呼叫端修改不會污染之後的 session
+    """
+    data = _synthetic_frame(ticker)
+    return None if data is None else data.copy()